@@ -3,11 +3,16 @@ import logging
 
 import numpy as np
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
 
+from backend.frontend_parsing.frontend_to_postgre import clean_user_labels
 from backend.frontend_parsing.postgre_to_frontend import form_paragraph_json, form_sentence_json
-from backend.helpers import quote_end_sentence, label_consensus, aggregate_label
-from backend.models import Article, UserLabel
-from backend.xml_parsing.xml_to_postgre import process_article, extract_sentence_spans
+from backend.helpers import label_consensus, aggregate_articles_labels, refresh_pending_tasks, \
+    rebuild_pending_tasks, CONFIDENCE_THRESHOLD
+from backend.models import Article, UserLabel, PendingTask
+from backend.xml_parsing.doc_cache import load_sentence_docs, serialize_sentence_docs
+from backend.xml_parsing.xml_to_postgre import process_article
 
 """ File containing all methods used for database management """
 
@@ -16,17 +21,14 @@ logger = logging.getLogger(__name__)
 """ The minumum amount of user labels required for a sentence to be labeled. """
 MIN_USER_LABELS = 4
 
-""" The number of articles in which to check for sentences to label. """
-ARTICLE_LOADS = 10
-
 """ The minimum number of users needed for a sentence to be considered labelled. """
 COUNT_THRESHOLD = 4
 
 """ The minimum consensus required for a sentence to be considered labelled. """
 CONSENSUS_THRESHOLD = 0.75
 
-""" The minimum confidence required for an a full paragraph to be labeled at once. """
-CONFIDENCE_THRESHOLD = 0.8
+""" The number of articles fetched from the database at once when streaming them. """
+FETCH_CHUNK_SIZE = 100
 
 
 def add_user_label_to_db(user_id, article_id, sentence_index, labels, author_index, admin):
@@ -53,125 +55,313 @@ def add_user_label_to_db(user_id, article_id, sentence_index, labels, author_ind
     :return: UserLabel.
         The UserLabel created
     """
-    # Get the article to which these labels belong
+    userlabels = add_user_labels_to_db(user_id, article_id, [(sentence_index, labels, author_index)], admin)
+    if userlabels is None:
+        return None
+    return userlabels[0]
+
+
+def lock_article(article_id):
+    """
+    Loads an article and locks it until the end of the transaction, without the fields that are only used to display
+    it. Needs to be called inside a transaction.
+
+    :param article_id: int.
+        The key of the article.
+    :return: Article.
+        The locked article, or None if there is no article with this key.
+    """
     try:
-        article = Article.objects.get(id=article_id)
+        return Article.objects\
+            .select_for_update()\
+            .defer('parsed', 'text', 'tokens', 'people')\
+            .get(id=article_id)
     except ObjectDoesNotExist:
         return None
 
-    labeled = article.labeled['labeled']
 
-    if labels != []:
-        # User knew how to annotate: recompute consensus to see if sentence is fully labeled.
-        if admin:
-            labeled[sentence_index] = 1
-        else:
-            other_userlabels = UserLabel.objects.filter(article=article, sentence_index=sentence_index)
-            # Only keep valid user labels
-            other_userlabels = other_userlabels.exclude(labels__labels=[])
-            other_labels = [userlabel.labels['labels'] for userlabel in other_userlabels]
-            other_authors = [userlabel.author_index['author_index'] for userlabel in other_userlabels]
+def assign_article_to_set(article):
+    """
+    Assigns a fully labeled article to the test set with 10% probability, or to the training set, unless it is already
+    assigned. The article is locked and its labeled field re-read before the assignment is written, so that labels
+    added at the same time aren't overwritten.
+
+    :param article: Article.
+        The article. Its labeled field is updated with the assignment.
+    :return: int.
+        1 if the article is in the test set, 0 if it is in the training set.
+    """
+    if 'test_set' not in article.labeled:
+        with transaction.atomic():
+            locked_article = lock_article(article.id)
+            if 'test_set' not in locked_article.labeled:
+                locked_article.labeled['test_set'] = int(np.random.random() > 0.9)
+                locked_article.save(update_fields=['labeled'])
+        article.labeled = locked_article.labeled
+    return article.labeled['test_set']
 
-            all_labels = other_labels + [labels]
-            all_authors = other_authors + [author_index]
 
-            _, _, consensus = label_consensus(all_labels, all_authors)
-            labeled[sentence_index] = int(consensus >= CONSENSUS_THRESHOLD and len(all_labels) >= COUNT_THRESHOLD)
+def add_user_labels_to_db(user_id, article_id, sentence_labels, admin):
+    """
+    Adds the user labels of several sentences of an article to the database, as done by add_user_label_to_db for each
+    sentence, but with a single query for the labels of other users and a single save of the article.
 
-        fully_labeled = int(sum(labeled) == len(labeled))
-        article.labeled = {
-                'labeled': labeled,
-                'fully_labeled': fully_labeled,
-        }
-        article.save()
+    The article is locked until the labels are added, so that concurrent labels for the same article don't overwrite
+    each other's changes, and only its labeled status is written.
+
+    :param user_id: int.
+        The users session id
+    :param article_id: int.
+        The key of the article that was annotated
+    :param sentence_labels: list(Tuple(int, list(int), list(int))).
+        The index of the sentence, the labels the user created for the sentence and the indices of the tokens that are
+        authors, for each sentence that was labelled.
+    :param admin: bool.
+        If the user is an admin.
+    :return: list(UserLabel).
+        The UserLabels created, or None if the article doesn't exist.
+    """
+    with transaction.atomic():
+        article = lock_article(article_id)
+        if article is None:
+            return None
+        return add_labels_to_article(article, user_id, sentence_labels, admin)
 
-    return UserLabel.objects.create(
+
+def add_tags_to_db(user_id, article_id, task_indices, first_sentence, last_sentence, tags, authors, admin):
+    """
+    Adds the tags a user created for a labelling task to the database. The tags are separated into labels for each
+    sentence with the sentence boundaries of the locked article, and added as done by add_user_labels_to_db.
+
+    :param user_id: int.
+        The users session id
+    :param article_id: int.
+        The key of the article that was annotated
+    :param task_indices: list(int).
+        The indices of the sentences the user was tasked to label.
+    :param first_sentence: int.
+        The index of the first sentence which has tagged values.
+    :param last_sentence: int.
+        The index of the last sentence which has tagged values.
+    :param tags: list(int).
+        The label the user created for each token in the sentences.
+    :param authors: list(int).
+        The relative position of the tokens of the author of the quote, if there is one.
+    :param admin: bool.
+        If the user is an admin.
+    :return: list(UserLabel).
+        The UserLabels created, or None if the article doesn't exist.
+    """
+    with transaction.atomic():
+        article = lock_article(article_id)
+        if article is None:
+            return None
+        clean_labels = clean_user_labels(article.sentences['sentences'], task_indices, first_sentence, last_sentence,
+                                         tags, authors)
+        sentence_labels = [(sentence['index'], sentence['labels'], sentence['authors']) for sentence in clean_labels]
+        return add_labels_to_article(article, user_id, sentence_labels, admin)
+
+
+def add_labels_to_article(article, user_id, sentence_labels, admin):
+    """
+    Adds the user labels of several sentences of an article to the database, and updates the labeled status of the
+    article.
+
+    :param article: Article.
+        The annotated article, locked by lock_article.
+    :param user_id: int.
+        The users session id
+    :param sentence_labels: list(Tuple(int, list(int), list(int))).
+        The index of the sentence, the labels the user created for the sentence and the indices of the tokens that are
+        authors, for each sentence that was labelled.
+    :param admin: bool.
+        If the user is an admin.
+    :return: list(UserLabel).
+        The UserLabels created
+    """
+    labeled = article.labeled['labeled']
+    valid_sentences = set(sentence_index for sentence_index, labels, _ in sentence_labels if labels != [])
+
+    # Keys: sentence index
+    # Values: the labels and the author indices of all valid user labels for the sentence
+    sentences_userlabels = {}
+    if not admin and len(valid_sentences) > 0:
+        other_userlabels = UserLabel.objects\
+            .filter(article=article, sentence_index__in=valid_sentences, is_empty_label=False)\
+            .order_by('id')\
+            .values_list('sentence_index', 'labels', 'author_index')
+        for sentence_index, labels, author_index in other_userlabels:
+            all_labels, all_authors = sentences_userlabels.setdefault(sentence_index, ([], []))
+            all_labels.append(labels['labels'])
+            all_authors.append(author_index['author_index'])
+
+    userlabels = []
+    for sentence_index, labels, author_index in sentence_labels:
+        if labels != []:
+            # User knew how to annotate: recompute consensus to see if sentence is fully labeled.
+            if admin:
+                labeled[sentence_index] = 1
+            else:
+                all_labels, all_authors = sentences_userlabels.setdefault(sentence_index, ([], []))
+                all_labels.append(labels)
+                all_authors.append(author_index)
+                _, _, consensus = label_consensus(all_labels, all_authors)
+                labeled[sentence_index] = int(consensus >= CONSENSUS_THRESHOLD
+                                              and len(all_labels) >= COUNT_THRESHOLD)
+
+        userlabel = UserLabel(
             article=article,
             session_id=user_id,
             labels={'labels': labels},
             sentence_index=sentence_index,
             author_index={'author_index': author_index},
             admin_label=admin,
-    )
+        )
+        userlabel.sync_promoted_fields()
+        userlabels.append(userlabel)
 
+    if len(valid_sentences) > 0:
+        fully_labeled = int(sum(labeled) == len(labeled))
+        article.labeled = {
+                'labeled': labeled,
+                'fully_labeled': fully_labeled,
+        }
+        article.save(update_fields=['labeled'])
+        refresh_pending_tasks(article)
 
-def add_article_to_db(path, nlp, source, admin_article=False):
+    return UserLabel.objects.bulk_create(userlabels)
+
+
+def load_article_file(path):
     """
-    Loads an article stored as an XML file, and adds it to the database after having processed it.
+    Loads an article stored as an XML file.
 
     :param path: string.
         The URL of the stored XML file
-    :param nlp: spaCy.Language.
-        The language model used to tokenize the text.
-    :param source: string.
-        The newspaper in which the article was published.
-    :param admin_article: boolean.
-        Can this article only be seen by admins.
-    :return: Article.
-        The article created
+    :return: string.
+        The article in XML format, with '&' characters escaped.
     """
     # Loading an xml file as a string
     with open(path, 'r') as file:
         article_text = file.read()
+    return article_text.replace('&', '&amp;')
 
-    article_text = article_text.replace('&', '&amp;')
-    # Process the file
-    data = process_article(article_text, nlp)
+
+def article_fields(article_text, data, nlp):
+    """
+    Computes the values of the fields of an Article from a processed article, except for its source and whether it's an
+    admin article.
+
+    :param article_text: string.
+        The article in XML format, as returned by load_article_file.
+    :param data: dict.
+        The processed article, as returned by process_article.
+    :param nlp: spaCy.Language.
+        The language model used to tokenize the text.
+    :return: dict.
+        The values of the fields of the Article.
+    """
     labeled = len(data['s']) * [0]
     confidence = len(data['s']) * [0]
     predictions = len(data['s']) * [0]
-    return Article.objects.create(
-        name=data['name'],
-        text=article_text,
-        people={
+    return {
+        'name': data['name'],
+        'text': article_text,
+        'people': {
             'people': list(data['people']),
             'mentions': data['mentions'],
         },
-        tokens={'tokens': data['tokens']},
-        paragraphs={'paragraphs': data['p']},
-        sentences={'sentences': data['s']},
-        labeled={
+        'tokens': {'tokens': data['tokens']},
+        'paragraphs': {'paragraphs': data['p']},
+        'sentences': {'sentences': data['s']},
+        'labeled': {
             'labeled': labeled,
             'fully_labeled': 0,
         },
-        in_quotes={'in_quotes': data['in_quotes']},
-        confidence={
+        'in_quotes': {'in_quotes': data['in_quotes']},
+        'confidence': {
             'confidence': confidence,
             'predictions': predictions,
             'min_confidence': 0,
         },
+        'parsed': serialize_sentence_docs(article_text, data['sentence_docs'], nlp),
+    }
+
+
+def add_article_to_db(path, nlp, source, admin_article=False):
+    """
+    Loads an article stored as an XML file, and adds it to the database after having processed it.
+
+    :param path: string.
+        The URL of the stored XML file
+    :param nlp: spaCy.Language.
+        The language model used to tokenize the text.
+    :param source: string.
+        The newspaper in which the article was published.
+    :param admin_article: boolean.
+        Can this article only be seen by admins.
+    :return: Article.
+        The article created
+    """
+    article_text = load_article_file(path)
+    # Process the file
+    data = process_article(article_text, nlp)
+    article = Article.objects.create(
+        **article_fields(article_text, data, nlp),
         admin_article=admin_article,
         source=source,
     )
+    refresh_pending_tasks(article)
+    return article
 
 
-def load_hardest_articles(n=None):
+def add_articles_to_db(articles, source, admin_article=False):
     """
-    Loads the hardest articles to classify in the database, in terms of the confidence in the
-    answers.
+    Adds many processed articles to the database at once, in a single transaction.
 
-    :param n: int.
-        If None, all articles are returned.
-        Otherwise, limited to n articles.
+    :param articles: list(dict).
+        The values of the fields of each article, as returned by article_fields.
+    :param source: string.
+        The newspaper in which the articles were published.
+    :param admin_article: boolean.
+        Can these articles only be seen by admins.
     :return: list(Article).
-        The n hardest articles to classify.
+        The articles created
     """
-    unlabeled_articles = Article.objects.filter(labeled__fully_labeled=0)
-    # Randomly select an article source, load all of its unlabeled articles
-    r = random.random()
-    if r < 1/3:
-        filtered_by_source = unlabeled_articles.filter(source='Heidi.News')
-    elif r > 2/3:
-        filtered_by_source = unlabeled_articles.filter(source='Parisien')
-    else:
-        filtered_by_source = unlabeled_articles.filter(source='Republique')
-    # If it has at least one unlabeled article, return those. Otherwise return from all sources.
-    if len(filtered_by_source) > 0:
-        unlabeled_articles = filtered_by_source
-    if n is None:
-        return unlabeled_articles.order_by('confidence__min_confidence', 'id')
-    else:
-        return unlabeled_articles.order_by('confidence__min_confidence', 'id')[:n]
+    articles = [Article(**fields, admin_article=admin_article, source=source) for fields in articles]
+    for article in articles:
+        article.sync_promoted_fields()
+    with transaction.atomic():
+        created = Article.objects.bulk_create(articles)
+        rebuild_pending_tasks(created)
+    return created
+
+
+def labelling_tasks(session_id, source=None):
+    """
+    Finds the sentences and paragraphs that need to be labelled, and whose first sentence doesn't already have a label
+    with the given session_id, in the order in which they are given to users.
+
+    :param session_id: int.
+        The user's session id
+    :param source: string.
+        If defined, only the tasks of articles from this source are returned.
+    :return: QuerySet.
+        The tasks, from the hardest article first.
+    """
+    tasks = PendingTask.objects.all()
+    if source is not None:
+        tasks = tasks.filter(source=source)
+    # Only keeps tasks for which the user hasn't labeled the first sentence
+    session_labels = UserLabel.objects.filter(
+        session_id=session_id,
+        article_id=OuterRef('article_id'),
+        sentence_index=OuterRef('first_sentence'),
+    )
+    return tasks\
+        .annotate(annotated=Exists(session_labels))\
+        .filter(annotated=False)\
+        .order_by('article_confidence', 'article_id', 'position')
 
 
 def request_labelling_task(session_id):
@@ -180,50 +370,32 @@ def request_labelling_task(session_id):
     session_id. If the list of sentence_indices is empty, then the whole paragraph needs to be labelled. Otherwise,
     the sentence(s) need to be labelled.
 
+    Tasks are read from the PendingTask table, from the article with the lowest confidence of a randomly selected source
+    (or of all sources if it has no task left for this session).
+
     :param session_id: int.
         The user's session id
     :return: dict.
         A dict containing article_id, paragraph_id, sentence_id, data and task keys
     """
-    session_labels = UserLabel.objects.filter(session_id=session_id)
-    articles = load_hardest_articles(ARTICLE_LOADS)
-    for article in articles:
-        annotated_sentences = [user_label.sentence_index for user_label in session_labels.filter(article=article)]
-        labeled = article.labeled['labeled']
-        confidences = article.confidence['confidence']
-        sentence_ends = article.sentences['sentences']
-        prev_par_end = -1
-        # p is the index of the last sentence in paragraph i
-        for (i, p) in enumerate(article.paragraphs['paragraphs']):
-            # Lowest confidence in the whole paragraph
-            min_conf = min([conf for conf in confidences[prev_par_end + 1:p + 1]])
-            par_predictions = article.confidence['predictions'][prev_par_end + 1:p + 1]
-            # For high enough confidences, annotate the whole paragraph
-            if min_conf >= CONFIDENCE_THRESHOLD \
-                    and max(par_predictions) == 0 \
-                    and labeled[prev_par_end + 1] == 0 \
-                    and (prev_par_end + 1) not in annotated_sentences\
-                    and p - prev_par_end > 2:
-                return form_paragraph_json(article, i)
-
-            # For all sentences in the paragraph, check if they can be annotated by the user
-            for j in range(prev_par_end + 1, p + 1):
-                if not article.labeled['labeled'][j] == 1 and j not in annotated_sentences:
-                    # List of sentence indices to label
-                    labelling_task = [j]
-                    # Checks that the sentence's last token is inside quotes, in which case the next sentence would
-                    # also need to be returned
-                    sent_end = sentence_ends[j]
-                    if article.in_quotes['in_quotes'][sent_end] == 1:
-                        last_sent = quote_end_sentence(sentence_ends, article.in_quotes['in_quotes'], sent_end)
-                        labelling_task = list(range(labelling_task[0], min(last_sent + 1, len(sentence_ends))))
-
-                    print()
-                    print('confidences', confidences[j])
-                    print('predictions', article.confidence['predictions'][j])
-                    return form_sentence_json(article, labelling_task)
-            prev_par_end = p
-    return None
+    # Randomly select an article source. If it has at least one task left for this session, only use those.
+    r = random.random()
+    if r < 1/3:
+        source = 'Heidi.News'
+    elif r > 2/3:
+        source = 'Parisien'
+    else:
+        source = 'Republique'
+    task = labelling_tasks(session_id, source).first()
+    if task is None:
+        task = labelling_tasks(session_id).first()
+    if task is None:
+        return None
+
+    article = Article.objects.defer('parsed').get(id=task.article_id)
+    if task.task == PendingTask.PARAGRAPH:
+        return form_paragraph_json(article, task.paragraph)
+    return form_sentence_json(article, list(range(task.first_sentence, task.last_sentence + 1)))
 
 
 def load_sentence_labels(nlp):
@@ -242,7 +414,9 @@ def load_sentence_labels(nlp):
         * the list of all testing labels
         * the list of in_quote values for each test sentence
     """
-    articles = Article.objects.filter(labeled__fully_labeled=1)
+    articles = list(Article.objects.filter(fully_labeled=1))
+    # The consensus labels of all sentences in all articles
+    articles_labels = aggregate_articles_labels(articles)
     train_sentences = []
     train_labels = []
     train_in_quotes = []
@@ -251,12 +425,10 @@ def load_sentence_labels(nlp):
     test_in_quotes = []
     for article in articles:
         start = 0
-        # Check if the article already has its sentences assigned to the test or training set.
-        if 'test_set' not in article.labeled:
-            article.labeled['test_set'] = int(np.random.random() > 0.9)
-            article.save()
+        # Assigns the article to the test or training set if it isn't assigned yet.
+        assign_article_to_set(article)
         # The spaCy.Doc object for each sentence in the article.
-        article_sentence_docs = extract_sentence_spans(article.text, nlp)
+        article_sentence_docs = load_sentence_docs(article, nlp)
         # The in_quotes list for each sentence in the article
         article_in_quotes = []
         # The label for each sentence in the article
@@ -266,7 +438,7 @@ def load_sentence_labels(nlp):
             in_quotes = article.in_quotes['in_quotes'][start:end + 1]
             article_in_quotes.append(in_quotes)
             # Compute consensus labels
-            sentence_labels, sentence_authors, _ = aggregate_label(article, sentence_index)
+            sentence_labels, sentence_authors, _ = articles_labels[article.id][sentence_index]
             article_labels.append(int(sum(sentence_labels) > 0))
             start = end + 1
 
@@ -283,28 +455,32 @@ def load_sentence_labels(nlp):
     return train_sentences, train_labels, train_in_quotes, test_sentences, test_labels, test_in_quotes
 
 
-def load_labeled_articles(nlp):
+def load_labeled_articles(nlp, article_ids=None):
     """
     Finds all fully labeled articles, and assigns unassigned articles to the test or training set.
 
+    :param nlp: spaCy.Language
+        The language model used to tokenize the text.
+    :param article_ids: list(int)
+        If defined, only the fully labeled articles with these ids are loaded.
     :return: list(models.Article), list(list(spaCy.Doc)), list(models.Article), list(list(spaCy.Doc))
         * the list of all training articles
         * the list of docs for each sentence for each training article
         * the list of all test articles
         * the list of docs for each sentence for each test article
     """
-    articles = Article.objects.filter(labeled__fully_labeled=1)
+    articles = Article.objects.filter(fully_labeled=1)
+    if article_ids is not None:
+        articles = articles.filter(id__in=article_ids)
     train_articles = []
     train_sentences = []
     test_articles = []
     test_sentences = []
     for article in articles:
-        # Check if the article already has its sentences assigned to the test or training set.
-        if 'test_set' not in article.labeled:
-            article.labeled['test_set'] = int(np.random.random() > 0.9)
-            article.save()
+        # Assigns the article to the test or training set if it isn't assigned yet.
+        assign_article_to_set(article)
         # The spaCy.Doc object for each sentence in the article.
-        article_sentence_docs = extract_sentence_spans(article.text, nlp)
+        article_sentence_docs = load_sentence_docs(article, nlp)
         if article.labeled['test_set'] == 0:
             train_articles.append(article)
             train_sentences.append(article_sentence_docs)
@@ -315,6 +491,26 @@ def load_labeled_articles(nlp):
     return train_articles, train_sentences, test_articles, test_sentences
 
 
+def load_labeled_article_ids(since=None, training_set=False):
+    """
+    Finds the fully labeled articles, or the ones that received labels since a given time.
+
+    :param since: datetime.datetime
+        If defined, only the articles with labels created after this time are returned.
+    :param training_set: bool
+        If True, the articles assigned to the test set are left out. The ones that aren't assigned yet are kept.
+    :return: set(int)
+        The ids of the articles.
+    """
+    if since is None:
+        articles = Article.objects.filter(fully_labeled=1)
+    else:
+        articles = Article.objects.filter(fully_labeled=1, userlabel__created_at__gte=since)
+    if training_set:
+        articles = articles.filter(Q(labeled__test_set=0) | ~Q(labeled__has_key='test_set'))
+    return set(articles.values_list('id', flat=True).distinct())
+
+
 def load_unlabeled_sentences(nlp):
     """
     Finds all articles that aren't fully labeled, and extracts all sentences from each.
@@ -326,21 +522,43 @@ def load_unlabeled_sentences(nlp):
         * the list of the list of docs for each sentence in each article.
         * the list of in_quotes values for each sentence in each article.
     """
-    articles = list(Article.objects.filter(labeled__fully_labeled=0))
+    articles = []
     sentences = []
     in_quotes = []
-    for article in articles:
+    for article, article_sentence_docs, article_in_quotes in iter_unlabeled_sentences(nlp):
+        articles.append(article)
+        sentences.append(article_sentence_docs)
+        in_quotes.append(article_in_quotes)
+    return articles, sentences, in_quotes
+
+
+def iter_unlabeled_sentences(nlp, article_ids=None, chunk_size=FETCH_CHUNK_SIZE):
+    """
+    Streams all articles that aren't fully labeled, along with their sentences, so that they don't all need to be kept
+    in memory at once.
+
+    :param nlp: spaCy.Language
+        The language model used to tokenize the text.
+    :param article_ids: list(int)
+        If defined, only the articles with these ids are loaded.
+    :param chunk_size: int
+        The number of articles fetched from the database at once.
+    :return: generator(Tuple(backend.models.Article, list(spaCy.Doc), list(list(int))))
+        For each article that isn't fully labeled, the article, the doc for each of its sentences and the in_quotes
+        values for each of its sentences.
+    """
+    articles = Article.objects.filter(fully_labeled=0).defer('tokens', 'people').order_by('id')
+    if article_ids is not None:
+        articles = articles.filter(id__in=article_ids)
+    for article in articles.iterator(chunk_size=chunk_size):
         start = 0
-        article_sentence_docs = extract_sentence_spans(article.text, nlp)
+        article_sentence_docs = load_sentence_docs(article, nlp)
         article_in_quotes = []
-        sentences.append(article_sentence_docs)
         for sentence_index, end in enumerate(article.sentences['sentences']):
             # Extract in_quotes values
             article_in_quotes.append(article.in_quotes['in_quotes'][start:end + 1])
             start = end + 1
-        in_quotes.append(article_in_quotes)
-
-    return articles, sentences, in_quotes
+        yield article, article_sentence_docs, article_in_quotes
 
 
 def load_quote_authors(nlp):
@@ -356,23 +574,23 @@ def load_quote_authors(nlp):
             * 'quotes': list(int), the indices of sentences that contain quotes in the article.
             * 'author': list(list(int)), the indices of the tokens of the author of the quote.
     """
-    articles = Article.objects.filter(labeled__fully_labeled=1)
+    articles = list(Article.objects.filter(fully_labeled=1))
+    # The consensus labels of all sentences in all articles
+    articles_labels = aggregate_articles_labels(articles)
     # list of training articles
     train_articles = []
     # list of test quotes
     test_articles = []
     for article in articles:
-        # Check if the article already has its sentences assigned to the test or training set.
-        if 'test_set' not in article.labeled:
-            article.labeled['test_set'] = int(np.random.random() > 0.9)
-            article.save()
+        # Assigns the article to the test or training set if it isn't assigned yet.
+        assign_article_to_set(article)
         # The spaCy.Doc object for each sentence in the article.
-        article_sentence_docs = extract_sentence_spans(article.text, nlp)
+        article_sentence_docs = load_sentence_docs(article, nlp)
         quotes = []
         authors = []
         for sentence_index, end in enumerate(article.sentences['sentences']):
             # Compute consensus labels
-            sentence_labels, sentence_authors, _ = aggregate_label(article, sentence_index)
+            sentence_labels, sentence_authors, _ = articles_labels[article.id][sentence_index]
             # Check if the sentence contains reported speech. If it does, add to the training or test set.
             if int(sum(sentence_labels) > 0):
                 quotes.append(sentence_index)
@@ -1,13 +1,11 @@
 import csv
 
-import numpy as np
-from sklearn.preprocessing import PolynomialFeatures
-
-from backend.ml.author_prediction_feature_extraction import attribution_features_baseline_no_db
+from backend.ml.author_prediction_feature_extraction import attribution_features_baseline_batch
 from backend.ml.baseline import predict_sentence, attribute_quote_lazy
-from backend.ml.helpers import load_model, author_full_name_no_db, find_true_author_index
+from backend.ml.feature_expansion import PolynomialExpansion
+from backend.ml.helpers import load_cached_model, author_full_name_no_db, find_true_author_index
 from backend.ml.quote_detection import predict_quotes
-from backend.xml_parsing.xml_to_postgre import process_article, extract_sentence_spans
+from backend.xml_parsing.xml_to_postgre import process_article, process_articles, DEFAULT_BATCH_SIZE
 from backend.xml_parsing.helpers import load_nlp
 
 """
@@ -48,18 +46,59 @@ def extract_people_quoted(article_text, nlp, cue_verbs, lazy_baseline=True):
     """
     if lazy_baseline:
         return extract_people_quoted_baseline(article_text, nlp, cue_verbs)
-        
+
     # Parses the article
     article_text = article_text.replace('&', '&amp;')
     data = process_article(article_text, nlp)
+    return predict_people_quoted(data, data['sentence_docs'], cue_verbs)
+
+
+def extract_people_quoted_batch(article_texts, nlp, cue_verbs, lazy_baseline=True, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Extracts the names of people cited in many articles at once. All articles are processed by the language model in a
+    single stream, which is much faster than calling extract_people_quoted on each article.
+
+    :param article_texts: list(string)
+        The articles, in XML format (as extracted from websites).
+    :param nlp: spaCy.Language.
+        The language model used to tokenize the text.
+    :param cue_verbs: list(string)
+        The list of all "cue verbs", which are verbs that often introduce reported speech.
+    :param lazy_baseline: bool.
+        If the lazy baseline should be used instead of the ML model.
+    :param batch_size: int.
+        The number of paragraphs the language model processes at once.
+    :return: list(list(String))
+        For each article, in the same order as article_texts, the names of all people that are predicted to have been
+        cited in it.
+    """
+    article_texts = [article_text.replace('&', '&amp;') for article_text in article_texts]
+    articles_data = process_articles(article_texts, nlp, batch_size=batch_size)
+    if lazy_baseline:
+        return [predict_people_quoted_baseline(data, data['sentence_docs'], cue_verbs) for data in articles_data]
+    return [predict_people_quoted(data, data['sentence_docs'], cue_verbs) for data in articles_data]
+
+
+def predict_people_quoted(data, article_sentence_docs, cue_verbs):
+    """
+    Uses the trained quote detection and author prediction models to find the people cited in a processed article.
+
+    :param data: dict
+        The processed article, as returned by process_article.
+    :param article_sentence_docs: list(spaCy.Doc)
+        A Doc object for each sentence in the article.
+    :param cue_verbs: list(string)
+        The list of all "cue verbs", which are verbs that often introduce reported speech.
+    :return: list(String)
+        The names of all people that are predicted to have been cited in the article.
+    """
     article_mentions = data['mentions']
     article_sentences = data['s']
     article_in_quotes = data['in_quotes']
-    article_sentence_docs = extract_sentence_spans(article_text, nlp)
 
-    # Loads quote detection model and author extraction model
-    quote_detection_model = load_model(path_quote_detection_weights)
-    author_extraction_model = load_model(path_author_attribution_weights)
+    # Loads quote detection model and author extraction model, which are only read from disk when they changed
+    quote_detection_model = load_cached_model(path_quote_detection_weights)
+    author_extraction_model = load_cached_model(path_author_attribution_weights)
 
     # Computes the in_quotes value for each sentence
     sentence_in_quotes = []
@@ -69,7 +108,7 @@ def extract_people_quoted(article_text, nlp, cue_verbs, lazy_baseline=True):
         sentence_start = end + 1
 
     # Predict if each sentence contains a quote or not
-    qd_poly = PolynomialFeatures(quote_detection_poly_degree, interaction_only=True, include_bias=True)
+    qd_poly = PolynomialExpansion(quote_detection_poly_degree, interaction_only=True, include_bias=True)
     sentence_predictions = predict_quotes(
         quote_detection_model,
         article_sentence_docs,
@@ -97,24 +136,17 @@ def extract_people_quoted(article_text, nlp, cue_verbs, lazy_baseline=True):
                                            if contains_quote == 1]
 
     # Determining authors
-    ap_poly = PolynomialFeatures(author_prediction_poly_degree, interaction_only=True, include_bias=True)
-    ap_features = []
-    for i, speaker in enumerate(article_mentions):
-        speaker_features = attribution_features_baseline_no_db(
-            article_sentences,
-            article_in_quotes,
-            article_sentence_docs,
-            indices_sentences_containing_quotes,
-            speaker,
-            article_mentions[:i] + article_mentions[i + 1:],
-            cue_verbs
-        )
-        speaker_features = ap_poly.fit_transform(speaker_features.reshape((-1, 1))).reshape((-1,))
-        ap_features.append(
-            speaker_features
-        )
-
-    predicted_labels = author_extraction_model.predict(np.array(ap_features))
+    ap_poly = PolynomialExpansion(author_prediction_poly_degree, interaction_only=True, include_bias=True)
+    ap_features = attribution_features_baseline_batch(
+        article_sentences,
+        article_in_quotes,
+        article_sentence_docs,
+        indices_sentences_containing_quotes,
+        article_mentions,
+        cue_verbs
+    )
+
+    predicted_labels = author_extraction_model.predict(ap_poly.transform(ap_features))
 
     # DEBUGGING CODE
     """
@@ -171,10 +203,25 @@ def extract_people_quoted_baseline(article_text, nlp, cue_verbs):
     # Parses the article
     article_text = article_text.replace('&', '&amp;')
     data = process_article(article_text, nlp)
+    return predict_people_quoted_baseline(data, data['sentence_docs'], cue_verbs)
+
+
+def predict_people_quoted_baseline(data, article_sentence_docs, cue_verbs):
+    """
+    Uses the rule-based baseline models to find the people cited in a processed article.
+
+    :param data: dict
+        The processed article, as returned by process_article.
+    :param article_sentence_docs: list(spaCy.Doc)
+        A Doc object for each sentence in the article.
+    :param cue_verbs: list(string)
+        The list of all "cue verbs", which are verbs that often introduce reported speech.
+    :return: list(String)
+        The names of all people that are predicted to have been cited in the article.
+    """
     article_mentions = data['mentions']
     article_sentences = data['s']
     article_in_quotes = data['in_quotes']
-    article_sentence_docs = extract_sentence_spans(article_text, nlp)
 
     # Computes the in_quotes value for each sentence
     sentence_in_quotes = []
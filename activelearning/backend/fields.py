@@ -0,0 +1,104 @@
+import base64
+from abc import ABCMeta, abstractmethod
+
+import numpy as np
+from django.db import models
+
+"""
+Model fields storing lists of integers as packed binary instead of JSON.
+
+The values of the fields are dicts containing the list under a single key (for example {'in_quotes': [0, 1, 1]}), like
+the JSON fields they replace, so that code reading or assigning them doesn't need to change. Only the representation in
+the database is different.
+"""
+
+
+class PackedListField(models.BinaryField, metaclass=ABCMeta):
+    """
+    Stores a dict {key: list(int)} as packed bytes. Subclasses define how the list is packed.
+    """
+
+    def __init__(self, key, *args, **kwargs):
+        """
+        Initializes the field.
+
+        :param key: string
+            The key of the list in the dict value of the field.
+        """
+        self.key = key
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['key'] = self.key
+        return name, path, args, kwargs
+
+    @abstractmethod
+    def pack(self, values):
+        """
+        Packs a list of integers.
+
+        :param values: list(int)
+            The values to pack.
+        :return: bytes
+            The packed values.
+        """
+
+    @abstractmethod
+    def unpack(self, data):
+        """
+        Unpacks a list of integers.
+
+        :param data: bytes
+            The packed values.
+        :return: list(int)
+            The values.
+        """
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        return {self.key: self.unpack(bytes(value))}
+
+    def to_python(self, value):
+        if value is None or isinstance(value, dict):
+            return value
+        if isinstance(value, str):
+            value = base64.b64decode(value.encode('ascii'))
+        return {self.key: self.unpack(bytes(value))}
+
+    def get_prep_value(self, value):
+        if value is None or isinstance(value, (bytes, bytearray, memoryview)):
+            return value
+        if isinstance(value, dict):
+            value = value[self.key]
+        return self.pack(value)
+
+    def value_to_string(self, obj):
+        return base64.b64encode(self.get_prep_value(self.value_from_object(obj))).decode('ascii')
+
+
+class BitListField(PackedListField):
+    """
+    Stores a list of values in {0, 1} using a bit per value, preceded by the number of values.
+    """
+
+    def pack(self, values):
+        values = np.asarray(values, dtype=np.uint8)
+        return np.array([len(values)], dtype='<u4').tobytes() + np.packbits(values).tobytes()
+
+    def unpack(self, data):
+        length = int(np.frombuffer(data[:4], dtype='<u4')[0])
+        return np.unpackbits(np.frombuffer(data[4:], dtype=np.uint8))[:length].tolist()
+
+
+class Int32ListField(PackedListField):
+    """
+    Stores a list of integers as little-endian 32 bits integers.
+    """
+
+    def pack(self, values):
+        return np.asarray(values, dtype='<i4').tobytes()
+
+    def unpack(self, data):
+        return np.frombuffer(data, dtype='<i4').tolist()
@@ -89,7 +89,7 @@ def load_paragraph_above(article_id, sentence_id):
         paragraph: int. The index of the paragraph returned.
     """
     try:
-        article = Article.objects.get(id=article_id)
+        article = Article.objects.defer('parsed').get(id=article_id)
     except ObjectDoesNotExist:
         return None
 
@@ -138,7 +138,7 @@ def load_paragraph_below(article_id, sentence_id):
         paragraph: int. The index of the paragraph returned.
     """
     try:
-        article = Article.objects.get(id=article_id)
+        article = Article.objects.defer('parsed').get(id=article_id)
     except ObjectDoesNotExist:
         return None
 
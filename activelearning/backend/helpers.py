@@ -1,6 +1,14 @@
+from collections import Counter
+
+import numpy as np
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+
+from backend.models import Article, UserLabel, PendingTask
 
-from backend.models import Article, UserLabel
+
+""" The minimum confidence required for an a full paragraph to be labeled at once. """
+CONFIDENCE_THRESHOLD = 0.8
 
 
 ##############################################################################################
@@ -11,7 +19,7 @@ from backend.models import Article, UserLabel
 def label_consensus(labels, authors):
     """
     Computes the (label, author) pair that is most common in the user labels, as well as the percentage of responses
-    that contain them
+    that contain them. Ties are broken in favour of the label (or author) that appears first.
 
     :param labels: list(list(int)).
         The list of tags that each user reported.
@@ -24,15 +32,74 @@ def label_consensus(labels, authors):
     """
     if len(labels) == 0:
         return [], [], 0
-    # Set of tuples as lists can't be hashed in Python
-    label_sets = set(tuple(i) for i in labels)
-    author_sets = set(tuple(i) for i in authors)
-    label_counts = [[label, labels.count(list(label))] for label in label_sets]
-    author_counts = [[author, authors.count(list(author))] for author in author_sets]
-    max_label_count = max(label_counts, key=lambda x: x[1])
-    max_author_count = max(author_counts, key=lambda x: x[1])
-    return list(max_label_count[0]), list(max_author_count[0]),\
-        (max_label_count[1] + max_author_count[1]) / (2 * len(labels))
+    # Tuples as lists can't be hashed in Python
+    max_label, max_label_count = Counter(tuple(i) for i in labels).most_common(1)[0]
+    max_author, max_author_count = Counter(tuple(i) for i in authors).most_common(1)[0]
+    return list(max_label), list(max_author), (max_label_count + max_author_count) / (2 * len(labels))
+
+
+def majority_batch(values, group_sizes):
+    """
+    Finds the most common value in each of many groups of values. Ties are broken in favour of the value that appears
+    first in the group.
+
+    :param values: list(list(int)).
+        The values of all groups, one after the other.
+    :param group_sizes: np.array.
+        The number of values in each group.
+    :return: list(list(int)), np.array
+        The most common value in each group (None for empty groups) and the number of times it appears.
+    """
+    num_groups = len(group_sizes)
+    # Each distinct value is mapped to an integer code
+    codes = {}
+    value_codes = np.array([codes.setdefault(tuple(value), len(codes)) for value in values], dtype=np.int64)
+    distinct_values = list(codes)
+    num_codes = max(len(codes), 1)
+
+    # Counts every (group, value) pair, and where it first appears
+    value_groups = np.repeat(np.arange(num_groups), group_sizes)
+    pairs, first_index, counts = np.unique(value_groups * num_codes + value_codes, return_index=True,
+                                           return_counts=True)
+    pair_groups = pairs // num_codes
+    # Sorts the pairs of each group by decreasing count, then by first appearance, and keeps the first one per group
+    order = np.lexsort((first_index, -counts, pair_groups))
+    sorted_groups = pair_groups[order]
+    is_group_start = np.ones(len(order), dtype=bool)
+    is_group_start[1:] = sorted_groups[1:] != sorted_groups[:-1]
+    best = order[is_group_start]
+
+    majority = num_groups * [None]
+    majority_counts = np.zeros(num_groups, dtype=np.int64)
+    for group, code, count in zip(pair_groups[best], pairs[best] % num_codes, counts[best]):
+        majority[group] = list(distinct_values[code])
+        majority_counts[group] = count
+    return majority, majority_counts
+
+
+def label_consensus_batch(sentences_labels, sentences_authors):
+    """
+    Computes label_consensus for many sentences at once.
+
+    :param sentences_labels: list(list(list(int))).
+        For each sentence, the list of tags that each user reported.
+    :param sentences_authors: list(list(list(int))).
+        For each sentence, the list of author indices that each user reported.
+    :return: list(Tuple(list(int), list(int), float)).
+        For each sentence, the values returned by label_consensus.
+    """
+    group_sizes = np.array([len(labels) for labels in sentences_labels], dtype=np.int64)
+    max_labels, max_label_counts = majority_batch([l for labels in sentences_labels for l in labels], group_sizes)
+    max_authors, max_author_counts = majority_batch([a for authors in sentences_authors for a in authors], group_sizes)
+
+    consensus = []
+    for size, label, label_count, author, author_count in zip(group_sizes, max_labels, max_label_counts, max_authors,
+                                                              max_author_counts):
+        if size == 0:
+            consensus.append(([], [], 0))
+        else:
+            consensus.append((label, author, (int(label_count) + int(author_count)) / (2 * int(size))))
+    return consensus
 
 
 def aggregate_label(article, sentence_index):
@@ -44,12 +111,62 @@ def aggregate_label(article, sentence_index):
     :return:
     """
     sentence_labels = UserLabel.objects.filter(article=article, sentence_index=sentence_index)
-    sentence_labels = sentence_labels.exclude(labels__labels=[])
+    sentence_labels = sentence_labels.filter(is_empty_label=False)
     all_labels = [userlabel.labels['labels'] for userlabel in sentence_labels]
     all_authors = [userlabel.author_index['author_index'] for userlabel in sentence_labels]
     labels, author, consensus = label_consensus(all_labels, all_authors)
     return labels, author, consensus
 
+
+def aggregate_articles_labels(articles):
+    """
+    Computes the consensus labels of every sentence of many articles, fetching all their user labels in a single query.
+
+    :param articles: list(models.Article)
+        The articles for which to aggregate labels.
+    :return: dict(int, list(Tuple(list(int), list(int), float)))
+        For each article id, the labels, author indices and consensus of each sentence in the article, as returned by
+        aggregate_label.
+    """
+    articles = list(articles)
+    userlabels = UserLabel.objects\
+        .filter(article_id__in=[article.id for article in articles])\
+        .filter(is_empty_label=False)\
+        .order_by('article_id', 'sentence_index', 'id')\
+        .values_list('article_id', 'sentence_index', 'labels', 'author_index')
+
+    # Keys: (article id, sentence index)
+    # Values: the labels and the author indices of all user labels for the sentence
+    sentence_userlabels = {}
+    for article_id, sentence_index, labels, author_index in userlabels:
+        all_labels, all_authors = sentence_userlabels.setdefault((article_id, sentence_index), ([], []))
+        all_labels.append(labels['labels'])
+        all_authors.append(author_index['author_index'])
+
+    # Computes the consensus of all sentences at once
+    sentence_keys = [(article.id, sentence_index) for article in articles
+                     for sentence_index in range(len(article.sentences['sentences']))]
+    all_userlabels = [sentence_userlabels.get(key, ([], [])) for key in sentence_keys]
+    consensus = iter(label_consensus_batch([labels for labels, _ in all_userlabels],
+                                           [authors for _, authors in all_userlabels]))
+
+    aggregated = {}
+    for article in articles:
+        aggregated[article.id] = [next(consensus) for _ in range(len(article.sentences['sentences']))]
+    return aggregated
+
+
+def aggregate_article_labels(article):
+    """
+    Computes the consensus labels of every sentence of an article, fetching all its user labels in a single query.
+
+    :param article: models.Article
+        The article for which to aggregate labels.
+    :return: list(Tuple(list(int), list(int), float))
+        The labels, author indices and consensus of each sentence in the article, as returned by aggregate_label.
+    """
+    return aggregate_articles_labels([article])[article.id]
+
 ##############################################################################################
 # Learning
 ##############################################################################################
@@ -69,23 +186,179 @@ def change_confidence(article_id, confidences, predictions):
     :return: int.
         The minimum confidence this article has in a sentence, or -1 if the article couldn't be added to the database.
     """
-    try:
-        article = Article.objects.get(id=article_id)
-    except ObjectDoesNotExist:
-        return None
-
-    old_conf = article.confidence['confidence']
-    min_conf = min(confidences)
-    if len(confidences) == len(old_conf) and len(predictions) == len(old_conf) and \
-            min_conf >= 0 and max(confidences) <= 1:
-        article.confidence['confidence'] = confidences
-        article.confidence['predictions'] = predictions
-        article.confidence['min_confidence'] = min_conf
-        article.save()
-        return min_conf
+    with transaction.atomic():
+        # Locks the article so that labels added at the same time aren't overwritten
+        try:
+            article = Article.objects\
+                .select_for_update()\
+                .defer('parsed', 'text', 'tokens', 'people')\
+                .get(id=article_id)
+        except ObjectDoesNotExist:
+            return None
+
+        old_conf = article.confidence['confidence']
+        min_conf = min(confidences)
+        if len(confidences) == len(old_conf) and len(predictions) == len(old_conf) and \
+                min_conf >= 0 and max(confidences) <= 1:
+            article.confidence['confidence'] = confidences
+            article.confidence['predictions'] = predictions
+            article.confidence['min_confidence'] = min_conf
+            article.save(update_fields=['confidence'])
+            refresh_pending_tasks(article)
+            return min_conf
     return None
 
 
+def reset_confidences(article_id, first_sentence, last_sentence):
+    """
+    Sets the confidence of the model for some sentences of an article to 0, for example when a user found quotes in a
+    paragraph the model was confident didn't contain any.
+
+    :param article_id: int.
+        The id of the article to edit
+    :param first_sentence: int.
+        The index of the first sentence whose confidence is reset.
+    :param last_sentence: int.
+        The index of the last sentence whose confidence is reset.
+    :return: float.
+        The minimum confidence this article has in a sentence, or None if the article doesn't exist.
+    """
+    with transaction.atomic():
+        # Locks the article so that labels added at the same time aren't overwritten
+        try:
+            article = Article.objects\
+                .select_for_update()\
+                .defer('parsed', 'text', 'tokens', 'people')\
+                .get(id=article_id)
+        except ObjectDoesNotExist:
+            return None
+
+        confidences = article.confidence['confidence']
+        # The confidences are only changed if the sentences are in the article
+        if 0 <= first_sentence <= last_sentence < len(confidences):
+            confidences[first_sentence:last_sentence + 1] = (last_sentence - first_sentence + 1) * [0]
+            article.confidence['min_confidence'] = min(confidences)
+            article.save(update_fields=['confidence'])
+            refresh_pending_tasks(article)
+        return article.confidence['min_confidence']
+
+
+##############################################################################################
+# Labelling tasks
+##############################################################################################
+
+
+def pending_task_fields(article):
+    """
+    Finds all paragraphs and sentences of an article that can be given to users to label, in the order in which they
+    should be given.
+
+    A whole paragraph is given if the model is confident that none of its sentences contain a quote, if its first
+    sentence isn't labeled and if it has more than two sentences. Otherwise, each sentence that isn't labeled is given,
+    along with the following sentences if the quote it ends with continues in them.
+
+    :param article: models.Article
+        The article in which to find tasks.
+    :return: list(dict)
+        The values of the fields of a PendingTask for each task in the article.
+    """
+    if article.labeled['fully_labeled'] == 1:
+        return []
+
+    labeled = article.labeled['labeled']
+    confidences = article.confidence['confidence']
+    predictions = article.confidence['predictions']
+    sentence_ends = article.sentences['sentences']
+    in_quotes = article.in_quotes['in_quotes']
+    tasks = []
+    prev_par_end = -1
+    # p is the index of the last sentence in paragraph i
+    for (i, p) in enumerate(article.paragraphs['paragraphs']):
+        # Lowest confidence in the whole paragraph
+        min_conf = min([conf for conf in confidences[prev_par_end + 1:p + 1]])
+        par_predictions = predictions[prev_par_end + 1:p + 1]
+        # For high enough confidences, annotate the whole paragraph
+        if min_conf >= CONFIDENCE_THRESHOLD \
+                and max(par_predictions) == 0 \
+                and labeled[prev_par_end + 1] == 0 \
+                and p - prev_par_end > 2:
+            tasks.append({
+                'task': PendingTask.PARAGRAPH,
+                'paragraph': i,
+                'first_sentence': prev_par_end + 1,
+                'last_sentence': p,
+                'position': 2 * (prev_par_end + 1),
+            })
+
+        # All sentences in the paragraph that need to be annotated
+        for j in range(prev_par_end + 1, p + 1):
+            if not labeled[j] == 1:
+                last_sentence = j
+                # Checks that the sentence's last token is inside quotes, in which case the next sentence would also
+                # need to be returned
+                sent_end = sentence_ends[j]
+                if in_quotes[sent_end] == 1:
+                    last_sent = quote_end_sentence(sentence_ends, in_quotes, sent_end)
+                    last_sentence = max(j, min(last_sent + 1, len(sentence_ends)) - 1)
+                tasks.append({
+                    'task': PendingTask.SENTENCE,
+                    'paragraph': i,
+                    'first_sentence': j,
+                    'last_sentence': last_sentence,
+                    'position': 2 * j + 1,
+                })
+        prev_par_end = p
+
+    for task in tasks:
+        task['article_id'] = article.id
+        task['source'] = article.source
+        task['article_confidence'] = article.confidence['min_confidence']
+    return tasks
+
+
+def refresh_pending_tasks(article):
+    """
+    Recomputes the pending labelling tasks of an article, after its labels or confidences changed.
+
+    :param article: models.Article
+        The article for which to refresh the tasks.
+    """
+    with transaction.atomic():
+        PendingTask.objects.filter(article_id=article.id).delete()
+        PendingTask.objects.bulk_create([PendingTask(**fields) for fields in pending_task_fields(article)])
+
+
+def rebuild_pending_tasks(articles=None, batch_size=500):
+    """
+    Recomputes the pending labelling tasks of many articles at once.
+
+    :param articles: iterable(models.Article)
+        The articles for which to rebuild the tasks. If None, the tasks of all articles are rebuilt.
+    :param batch_size: int
+        The number of tasks created in the database at once.
+    :return: int
+        The number of pending tasks created.
+    """
+    with transaction.atomic():
+        if articles is None:
+            PendingTask.objects.all().delete()
+            articles = Article.objects.defer('parsed', 'text', 'tokens', 'people').iterator()
+        else:
+            articles = list(articles)
+            PendingTask.objects.filter(article_id__in=[article.id for article in articles]).delete()
+        created = 0
+        tasks = []
+        for article in articles:
+            tasks += [PendingTask(**fields) for fields in pending_task_fields(article)]
+            if len(tasks) >= batch_size:
+                PendingTask.objects.bulk_create(tasks)
+                created += len(tasks)
+                tasks = []
+        PendingTask.objects.bulk_create(tasks)
+        created += len(tasks)
+    return created
+
+
 def quote_start_sentence(sentence_ends, in_quote, token_index):
     """
     Given the index of the first token of a sentence, which is inside quotation marks, returns the index of the sentence
@@ -1,10 +1,86 @@
-from os import listdir
-from os.path import isfile, join
+import time
+from multiprocessing import Pool
+from os import fsync, listdir
+from os.path import basename, isfile, join
 
+from django import db
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
-from backend.db_management import add_article_to_db
+from backend.db_management import add_articles_to_db, article_fields, load_article_file
 from backend.xml_parsing.helpers import load_nlp
+from backend.xml_parsing.xml_to_postgre import process_articles, DEFAULT_BATCH_SIZE
+
+
+""" The name of the file, in the directory of the articles, listing the articles already added to the database. """
+PROGRESS_FILE = '.addarticle_progress'
+
+
+""" The language model used by each worker process. """
+worker_nlp = None
+
+
+def init_worker():
+    """ Loads the language model once in each worker process. """
+    global worker_nlp
+    worker_nlp = load_nlp()
+
+
+def parse_article_files(article_paths, nlp=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Loads and processes a batch of articles stored as XML files.
+
+    :param article_paths: list(string).
+        The paths of the articles to process.
+    :param nlp: spaCy.Language.
+        The language model used to tokenize the text. If None, the language model of the worker process is used.
+    :param batch_size: int.
+        The number of paragraphs the language model processes at once.
+    :return: list(string), list(dict)
+        The paths of the articles, and the values of the fields of each article, as returned by article_fields.
+    """
+    if nlp is None:
+        nlp = worker_nlp
+    article_texts = [load_article_file(path) for path in article_paths]
+    processed = process_articles(article_texts, nlp, batch_size)
+    return article_paths, [article_fields(text, data, nlp) for text, data in zip(article_texts, processed)]
+
+
+def parse_article_files_worker(args):
+    """ Unpacks the arguments of parse_article_files, for use with Pool.imap. """
+    article_paths, batch_size = args
+    return parse_article_files(article_paths, batch_size=batch_size)
+
+
+def add_article_batch(batch_paths, batch_fields, source, progress_path):
+    """
+    Adds a batch of parsed articles to the database, and lists them in the progress file within the same transaction.
+    The progress entries are written before the transaction is committed, and removed if it fails, so that the
+    articles are only listed as added if they were.
+
+    :param batch_paths: list(string).
+        The paths of the articles.
+    :param batch_fields: list(dict).
+        The values of the fields of each article, as returned by article_fields.
+    :param source: string.
+        The newspaper in which the articles were published.
+    :param progress_path: string.
+        The path of the file listing the articles already added to the database.
+    :return: int.
+        The number of articles added.
+    """
+    with open(progress_path, 'a') as f:
+        progress_size = f.tell()
+        try:
+            with transaction.atomic():
+                add_articles_to_db(batch_fields, source)
+                f.writelines(f'{basename(article_path)}\n' for article_path in batch_paths)
+                f.flush()
+                fsync(f.fileno())
+        except BaseException:
+            f.truncate(progress_size)
+            raise
+    return len(batch_fields)
 
 
 class Command(BaseCommand):
@@ -14,24 +90,65 @@ class Command(BaseCommand):
         parser.add_argument('path', help="Path of the article to add to the database")
         parser.add_argument('--source', required=True, choices=['Heidi.News', 'Parisien', 'Republique'],
                             help="The newspaper in which the articles were published")
+        parser.add_argument('--workers', type=int, default=1,
+                            help="The number of processes parsing articles. Default: 1")
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help="The number of articles parsed and added to the database at once. Default: 50")
+        parser.add_argument('--restart', action='store_true',
+                            help=f"Ignore the articles listed as already added in {PROGRESS_FILE}")
 
     def handle(self, *args, **options):
         path = options['path']
         source = 'None'
         if options['source']:
             source = options['source']
+        workers = max(1, options['workers'])
+        batch_size = max(1, options['batch_size'])
+        progress_path = join(path, PROGRESS_FILE)
         print(f'Loading data from: {path}')
         try:
-            articles = []
+            added = 0
             article_files = [join(path, article) for article in listdir(path)
                              if isfile(join(path, article)) and len(article) > 4 and article[-3:] == 'xml']
             article_files.sort()
-            print('Loading language model...')
-            nlp = load_nlp()
+
+            # Resumes from where a previous run stopped
+            if not options['restart'] and isfile(progress_path):
+                with open(progress_path, 'r') as f:
+                    done = set(line.strip() for line in f)
+                article_files = [article for article in article_files if basename(article) not in done]
+                print(f'Skipping {len(done)} article(s) already added.')
+            elif isfile(progress_path):
+                open(progress_path, 'w').close()
+
+            batches = [article_files[i:i + batch_size] for i in range(0, len(article_files), batch_size)]
+            start_time = time.time()
+            tokens = 0
+            pool = None
+            if workers > 1:
+                print(f'Loading language model in {workers} processes...')
+                # The worker processes don't use the database, so they shouldn't share the connection.
+                db.connections.close_all()
+                pool = Pool(processes=workers, initializer=init_worker)
+                worker_args = [(batch, DEFAULT_BATCH_SIZE) for batch in batches]
+                parsed_batches = pool.imap(parse_article_files_worker, worker_args)
+            else:
+                print('Loading language model...')
+                nlp = load_nlp()
+                parsed_batches = (parse_article_files(batch, nlp) for batch in batches)
+
             print('Adding articles to the database...')
-            for article_path in article_files:
-                articles.append(add_article_to_db(article_path, nlp, source))
+            try:
+                for batch_paths, batch_fields in parsed_batches:
+                    added += add_article_batch(batch_paths, batch_fields, source, progress_path)
+                    tokens += sum(len(fields['tokens']['tokens']) for fields in batch_fields)
+                    elapsed = time.time() - start_time
+                    print(f'{added}/{len(article_files)} articles, {added / elapsed:.2f} articles/s, '
+                          f'{tokens / elapsed:.0f} tokens/s')
+            finally:
+                if pool is not None:
+                    pool.terminate()
         except IOError:
             raise CommandError('Article could not be added. IOError.')
 
-        self.stdout.write(self.style.SUCCESS(f'Successfully added {len(articles)} article(s).'))
+        self.stdout.write(self.style.SUCCESS(f'Successfully added {added} article(s).'))
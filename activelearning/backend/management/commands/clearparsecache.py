@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from backend.models import Article
+
+
+class Command(BaseCommand):
+    help = 'Removes the stored parse of articles from the database, so that they are parsed again the next time they ' \
+           'are loaded.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('article_ids', nargs='*', type=int,
+                            help="The ids of the articles whose parse is removed. Default: all articles")
+
+    def handle(self, *args, **options):
+        article_ids = options['article_ids']
+        articles = Article.objects.exclude(parsed=None)
+        if len(article_ids) > 0:
+            articles = articles.filter(id__in=article_ids)
+        cleared = articles.update(parsed=None)
+        self.stdout.write(self.style.SUCCESS(f'Successfully removed {cleared} parsed article(s) from the database.'))
@@ -3,10 +3,10 @@ import itertools
 
 from django.core.management.base import BaseCommand, CommandError
 
-from backend.ml.author_prediction import evaluate_author_prediction
+from backend.ml.author_prediction import evaluate_author_prediction_grid
 from backend.ml.baseline import baseline_quote_detection, baseline_quote_attribution
 from backend.ml.quote_attribution import evaluate_quote_attribution
-from backend.ml.quote_detection import evaluate_quote_detection
+from backend.ml.quote_detection import evaluate_quote_detection_grid
 from backend.ml.scoring import ResultAccumulator
 from backend.xml_parsing.helpers import load_nlp
 
@@ -51,6 +51,11 @@ class Command(BaseCommand):
                             choices=['l1', 'l2', 'all'], )
         parser.add_argument('--exp', help='The degree of feature expansion for author prediction and quote detection.',
                             type=int, default=2)
+        parser.add_argument('--jobs', type=int, default=1,
+                            help='The number of processes training cross-validation folds in parallel. Default: 1')
+        parser.add_argument('--candidates', type=int,
+                            help='The number of mentions closest to each quote that are candidate authors in the '
+                                 'One vs One quote attribution model. Default: all mentions are.')
 
     def handle(self, *args, **options):
         folds = 5
@@ -61,6 +66,8 @@ class Command(BaseCommand):
         if options['epochs']:
             max_epochs = options['epochs']
 
+        jobs = max(1, options['jobs'])
+
         losses = ['log', 'hinge']
         if options['loss']:
             if options['loss'] == 'log':
@@ -98,12 +105,16 @@ class Command(BaseCommand):
             with open('logs.txt', 'a') as f:
                 f.write(f'  Baseline quote detection:\n{results.print_average_score()}\n')
 
+            # The folds of all models are trained at once, and their results are then grouped by loss and penalty
+            parameters = list(itertools.product(losses, log_penalties, alphas))
+            detection_results = dict(zip(parameters, evaluate_quote_detection_grid(parameters, max_epochs, nlp,
+                                                                                   cue_verbs, folds, jobs=jobs)))
             for l in losses:
                 for p in log_penalties:
                     print(f'  {p} {l}:')
                     accumulator = ResultAccumulator()
                     for alpha in alphas:
-                        train_res, test_res = evaluate_quote_detection(l, p, alpha, max_epochs, nlp, cue_verbs, folds)
+                        train_res, test_res = detection_results[(l, p, alpha)]
                         with open('logs.txt', 'a') as f:
                             f.write(f'  Quote detection: {p}-{l} loss, alpha={alpha}\n'
                                     f'    Training results:\n{train_res.print_average_score()}\n'
@@ -132,6 +143,9 @@ class Command(BaseCommand):
 
             print('Speaker prediction: classifying each named entity in a text as either the author of a quote or not'
                   ', but not assigning a single named entity to each quote.')
+            prediction_results = dict(zip(parameters, evaluate_author_prediction_grid(parameters, max_epochs, nlp,
+                                                                                      cue_verbs, options['exp'],
+                                                                                      folds, jobs)))
             for l in losses:
                 for p in log_penalties:
                     print(f'   Speaker Prediction Results with {p}-{l} loss'.ljust(80))
@@ -142,10 +156,7 @@ class Command(BaseCommand):
                     best_f1 = 0
                     best_alpha = ''
                     for alpha in alphas:
-                        exp_degree = options['exp']
-                        train_res, test_res, train_set, test_set = evaluate_author_prediction(l, p, alpha, max_epochs,
-                                                                                              nlp, cue_verbs,
-                                                                                              exp_degree, folds)
+                        train_res, test_res, train_set, test_set = prediction_results[(l, p, alpha)]
 
                         acc, pre, rec, f1 = test_set.average_score()
                         if f1 > best_f1:
@@ -189,7 +200,8 @@ class Command(BaseCommand):
                         best_alpha = ''
                         for alpha in alphas:
                             train_res, test_res = evaluate_quote_attribution(l, p, alpha, ext_method, max_epochs, nlp,
-                                                                             cue_verbs, folds, ovo)
+                                                                             cue_verbs, folds, ovo,
+                                                                             options['candidates'] if ovo else None)
 
                             with open('logs.txt', 'a') as f:
                                 f.write(f'  Quote attribution: one vs one: {ovo}, {ext_method}-feature extraction,'
@@ -0,0 +1,113 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from backend.db_management import labelling_tasks
+from backend.management.commands.refreshstatus import refreshed_articles, valid_userlabels
+from backend.models import Article, UserLabel
+
+
+""" The number of articles for which the user labels are aggregated. """
+AGGREGATED_ARTICLES = 50
+
+
+def hot_queries(source, session_id):
+    """
+    The queries used to select labelling tasks, to refresh the status of the articles and to aggregate labels. The
+    queries filtering on the JSON fields that were promoted to columns are given both before and after.
+
+    :param source: string
+        The source of the articles from which labelling tasks are selected.
+    :param session_id: string
+        The session of the user for which labelling tasks are selected.
+    :return: list(Tuple(string, QuerySet, QuerySet))
+        The name of each query, and the query before the JSON fields were promoted to columns (None if it doesn't
+        filter on them) and after.
+    """
+    article_ids = list(Article.objects.order_by('id').values_list('id', flat=True)[:AGGREGATED_ARTICLES])
+    userlabels = UserLabel.objects.filter(article_id__in=article_ids)
+    return [
+        (
+            'Task selection (next task of a source)',
+            None,
+            labelling_tasks(session_id, source)[:1],
+        ),
+        (
+            'Task selection (next task of all sources)',
+            None,
+            labelling_tasks(session_id)[:1],
+        ),
+        (
+            'Status refresh (valid user labels)',
+            UserLabel.objects.exclude(labels__labels=[]).order_by('article_id', 'sentence_index', 'id')
+                .values_list('article_id', 'sentence_index', 'labels', 'author_index', 'admin_label'),
+            valid_userlabels(),
+        ),
+        (
+            'Status refresh (articles)',
+            None,
+            refreshed_articles(),
+        ),
+        (
+            'Labeled articles',
+            Article.objects.defer('parsed').filter(labeled__fully_labeled=1),
+            Article.objects.defer('parsed').filter(fully_labeled=1),
+        ),
+        (
+            f'Label aggregation ({len(article_ids)} articles)',
+            userlabels.exclude(labels__labels=[]).order_by('article_id', 'sentence_index', 'id')
+                .values_list('article_id', 'sentence_index', 'labels', 'author_index'),
+            userlabels.filter(is_empty_label=False).order_by('article_id', 'sentence_index', 'id')
+                .values_list('article_id', 'sentence_index', 'labels', 'author_index'),
+        ),
+    ]
+
+
+def time_query(queryset, repeat):
+    """
+    Measures the time taken to fetch all the rows of a query.
+
+    :param queryset: QuerySet
+        The query to run.
+    :param repeat: int
+        The number of times the query is run.
+    :return: float
+        The average time taken, in milliseconds.
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        # Clones the query so that the results aren't cached
+        list(queryset.all())
+    return 1000 * (time.perf_counter() - start) / repeat
+
+
+class Command(BaseCommand):
+    help = 'Shows the query plans and running times of the queries used to select labelling tasks, to refresh the ' \
+           'status of the articles and to aggregate labels, before and after the JSON fields they filter on were ' \
+           'promoted to indexed columns.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default='Heidi.News', choices=['Heidi.News', 'Parisien', 'Republique'],
+                            help="The source of the articles from which labelling tasks are selected.")
+        parser.add_argument('--analyze', action='store_true',
+                            help="Run the queries when explaining them, to show the actual costs.")
+        parser.add_argument('--repeat', type=int, default=10,
+                            help="The number of times each query is run to measure its running time. Default: 10")
+        parser.add_argument('--session',
+                            help="The session for which labelling tasks are selected. Default: the session of the "
+                                 "latest user label.")
+
+    def handle(self, *args, **options):
+        repeat = max(1, options['repeat'])
+        session_id = options['session']
+        if session_id is None:
+            # A session with labels, so that the tasks it already labeled are excluded
+            session_id = UserLabel.objects.order_by('-id').values_list('session_id', flat=True).first() or ''
+        for name, before, after in hot_queries(options['source'], session_id):
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for label, queryset in [('Before', before), ('After', after)]:
+                if queryset is None:
+                    continue
+                self.stdout.write(f'{label}: {time_query(queryset, repeat):.2f} ms')
+                self.stdout.write(queryset.explain(analyze=options['analyze']))
+            self.stdout.write('')
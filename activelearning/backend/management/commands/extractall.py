@@ -1,6 +1,6 @@
 from django.core.management.base import BaseCommand, CommandError
 
-from backend.helpers import aggregate_label
+from backend.helpers import aggregate_articles_labels
 from backend.models import Article
 from backend.xml_parsing.postgre_to_xml import database_to_xml
 
@@ -14,18 +14,17 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         path = options['path']
         try:
-            articles = Article.objects.all()
+            articles = list(Article.objects.defer('parsed').filter(fully_labeled=1))
+            articles_labels = aggregate_articles_labels(articles)
             for a in articles:
-                if a.labeled['fully_labeled'] == 1:
-                    labels = []
-                    authors = []
-                    for s_id in range(len(a.sentences['sentences'])):
-                        sent_label, sent_authors, consensus = aggregate_label(a, s_id)
-                        labels.append(sent_label)
-                        authors.append(sent_authors)
-                    output_xml = database_to_xml(a, labels, authors)
-                    with open(f'{path}/article_{a.id}.xml', 'w') as f:
-                        f.write(output_xml)
+                labels = []
+                authors = []
+                for sent_label, sent_authors, consensus in articles_labels[a.id]:
+                    labels.append(sent_label)
+                    authors.append(sent_authors)
+                output_xml = database_to_xml(a, labels, authors)
+                with open(f'{path}/article_{a.id}.xml', 'w') as f:
+                    f.write(output_xml)
 
         except IOError:
             raise CommandError('Articles could not be extracted. IO Error.')
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from backend.helpers import rebuild_pending_tasks
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the paragraphs and sentences that still need to be labelled for all articles. This should ' \
+           'only be needed if the articles were modified outside of the application.'
+
+    def handle(self, *args, **options):
+        created = rebuild_pending_tasks()
+        self.stdout.write(self.style.SUCCESS(f'Successfully created {created} labelling task(s).'))
@@ -0,0 +1,31 @@
+import csv
+
+from django.core.management.base import BaseCommand
+
+from backend.extraction_pipeline import path_quote_detection_weights, quote_detection_poly_degree
+from backend.ml.confidence_refresh import update_confidences
+from backend.ml.helpers import load_model
+from backend.xml_parsing.helpers import load_nlp
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the confidence of the trained quote detection model for the articles that received new labels ' \
+           'since the last refresh, or whose confidences were computed by another model.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help="Refresh the confidences of all articles that aren't fully labeled.")
+
+    def handle(self, *args, **options):
+        print('\nLoading language model...\n')
+        nlp = load_nlp()
+        with open('data/cue_verbs.csv', 'r') as f:
+            reader = csv.reader(f)
+            cue_verbs = set(list(reader)[0])
+
+        trained_model = load_model(path_quote_detection_weights)
+        timings, refreshed = update_confidences(trained_model, nlp, cue_verbs, quote_detection_poly_degree,
+                                                incremental=not options['full'])
+        for stage, duration in timings.items():
+            print(f'    {stage}: {duration:.2f}s')
+        self.stdout.write(self.style.SUCCESS(f'Successfully refreshed the confidences of {refreshed} article(s).'))
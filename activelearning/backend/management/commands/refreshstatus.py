@@ -1,33 +1,98 @@
+from itertools import groupby
+
 from django.core.management.base import BaseCommand
 
 from backend.db_management import CONSENSUS_THRESHOLD, COUNT_THRESHOLD
-from backend.helpers import label_consensus
+from backend.helpers import label_consensus_batch, rebuild_pending_tasks
 from backend.models import Article, UserLabel
 
 
+""" The number of articles updated in the database at once. """
+UPDATE_CHUNK_SIZE = 500
+
+
+""" The fields of the articles updated by the command. """
+UPDATED_FIELDS = ['labeled', 'confidence', 'fully_labeled', 'min_confidence']
+
+
+""" The number of rows fetched from the database at once when streaming the user labels and articles. """
+FETCH_CHUNK_SIZE = 2000
+
+
+def sentences_are_labeled(sentences_userlabels):
+    """
+    Determines if sentences are labeled, given all their valid user labels.
+
+    :param sentences_userlabels: list(list((list(int), list(int), bool)))
+        For each sentence, the labels, author indices and whether it's an admin label, for each user label of the
+        sentence.
+    :return: list(int)
+        For each sentence, 1 if it's labeled, 0 otherwise.
+    """
+    all_consensus = label_consensus_batch(
+        [[labels for labels, _, _ in userlabels] for userlabels in sentences_userlabels],
+        [[authors for _, authors, _ in userlabels] for userlabels in sentences_userlabels],
+    )
+    labeled = []
+    for userlabels, (label, author, consensus) in zip(sentences_userlabels, all_consensus):
+        if any(admin_label for _, _, admin_label in userlabels):
+            labeled.append(1)
+        else:
+            labeled.append(int(consensus >= CONSENSUS_THRESHOLD and len(userlabels) >= COUNT_THRESHOLD))
+    return labeled
+
+
+def valid_userlabels():
+    """
+    The query streaming the values of all valid user labels, grouped by article and sentence.
+
+    :return: QuerySet
+        The article id, sentence index, labels, author indices and whether it's an admin label, for each user label.
+    """
+    return UserLabel.objects\
+        .filter(is_empty_label=False)\
+        .order_by('article_id', 'sentence_index', 'id')\
+        .values_list('article_id', 'sentence_index', 'labels', 'author_index', 'admin_label')
+
+
+def refreshed_articles():
+    """
+    The query streaming the fields of all articles needed to refresh their status.
+
+    :return: QuerySet
+        The articles, ordered by id.
+    """
+    return Article.objects.only('id', 'sentences', 'labeled', 'confidence').order_by('id')
+
+
 class Command(BaseCommand):
     help = 'Goes over all articles and user labels, and recomputes if each sentence is labeled or not. This should ' \
            'not change anything in the tables unless the requirements for a sentence to be labeled have changed.'
 
     def handle(self, *args, **options):
+        # All valid user labels, in a single query, grouped by article
+        userlabels = valid_userlabels().iterator(chunk_size=FETCH_CHUNK_SIZE)
+        article_userlabels = groupby(userlabels, key=lambda userlabel: userlabel[0])
+        next_labeled_article = next(article_userlabels, None)
 
-        articles = Article.objects.all()
-        for a in articles:
-            labeled = []
-            for s_index in range(len(a.sentences['sentences'])):
-                userlabels = UserLabel.objects.filter(article=a, sentence_index=s_index).exclude(labels__labels=[])
-
-                admin_labels = userlabels.filter(admin_label=True)
+        updated = []
+        total = 0
+        for a in refreshed_articles().iterator(chunk_size=FETCH_CHUNK_SIZE):
+            # The user labels of each sentence of the article
+            sentence_userlabels = {}
+            # Both are ordered by article id, so the labels of articles deleted since the query started are skipped
+            while next_labeled_article is not None and next_labeled_article[0] < a.id:
+                next_labeled_article = next(article_userlabels, None)
+            if next_labeled_article is not None and next_labeled_article[0] == a.id:
+                for s_index, group in groupby(next_labeled_article[1], key=lambda userlabel: userlabel[1]):
+                    sentence_userlabels[s_index] = [
+                        (labels['labels'], author_index['author_index'], admin_label)
+                        for _, _, labels, author_index, admin_label in group
+                    ]
+                next_labeled_article = next(article_userlabels, None)
 
-                if len(admin_labels) > 0:
-                    labeled.append(1)
-                else:
-                    labels = [userlabel.labels['labels'] for userlabel in userlabels]
-                    authors = [userlabel.author_index['author_index'] for userlabel in userlabels]
-                    label, author, consensus = label_consensus(labels, authors)
-
-                    is_labeled = int(consensus >= CONSENSUS_THRESHOLD and len(labels) >= COUNT_THRESHOLD)
-                    labeled.append(is_labeled)
+            labeled = sentences_are_labeled([sentence_userlabels.get(s_index, [])
+                                             for s_index in range(len(a.sentences['sentences']))])
 
             predictions = len(a.sentences['sentences']) * [0]
             a.confidence['predictions'] = predictions
@@ -36,4 +101,20 @@ class Command(BaseCommand):
                 'labeled': labeled,
                 'fully_labeled': fully_labeled,
             }
-            a.save()
+            a.sync_promoted_fields()
+            updated.append(a)
+
+            if len(updated) >= UPDATE_CHUNK_SIZE:
+                Article.objects.bulk_update(updated, UPDATED_FIELDS)
+                total += len(updated)
+                updated = []
+
+        if len(updated) > 0:
+            Article.objects.bulk_update(updated, UPDATED_FIELDS)
+            total += len(updated)
+
+        # The sentences that need to be labelled depend on the status of each article
+        tasks = rebuild_pending_tasks()
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully refreshed the status of {total} article(s) and created '
+                                             f'{tasks} labelling task(s).'))
@@ -0,0 +1,118 @@
+import csv
+import logging
+import time
+from datetime import timedelta
+from multiprocessing import Process
+
+from django import db
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from backend.ml.retrain import train_models, read_model_version
+from backend.models import UserLabel
+from backend.xml_parsing.helpers import load_nlp
+
+logger = logging.getLogger(__name__)
+
+
+def count_new_labels(since):
+    """
+    Counts the valid user labels created since the models were last trained.
+
+    :param since: datetime.datetime
+        The time at which the models started being trained, or None if they were never trained.
+    :return: int
+        The number of new user labels.
+    """
+    userlabels = UserLabel.objects.filter(is_empty_label=False)
+    if since is not None:
+        userlabels = userlabels.filter(created_at__gte=since)
+    return userlabels.count()
+
+
+def failure_backoff(failures, poll, max_backoff):
+    """
+    Computes how long to wait before retraining after consecutive failed trainings, doubling after each failure.
+
+    :param failures: int
+        The number of consecutive failed trainings.
+    :param poll: float
+        The number of seconds between two checks for new labels.
+    :param max_backoff: float
+        The longest time to wait, in seconds.
+    :return: float
+        The number of seconds to wait.
+    """
+    return min(max_backoff, poll * 2 ** failures)
+
+
+class Command(BaseCommand):
+    help = 'Retrains the models in a separate process whenever enough new labels were added, or when new labels were ' \
+           'added and the models are older than a given interval. The application keeps using the previous models ' \
+           'until the new ones are saved.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-labels', type=int, default=50,
+                            help="The number of new labels after which the models are retrained. Default: 50")
+        parser.add_argument('--interval', type=int, default=60,
+                            help="The number of minutes after which the models are retrained if there is at least one "
+                                 "new label. Default: 60")
+        parser.add_argument('--poll', type=int, default=60,
+                            help="The number of seconds between two checks for new labels. Default: 60")
+        parser.add_argument('--once', action='store_true',
+                            help="Check for new labels a single time instead of running forever.")
+        parser.add_argument('--max-backoff', type=int, default=360,
+                            help="The longest number of minutes to wait before retraining after failed trainings. The "
+                                 "wait doubles after each consecutive failure. Default: 360")
+        parser.add_argument('--epochs', type=int, help='Max number of epochs to train for. Default: 500', default=500)
+        parser.add_argument('--incremental', action='store_true',
+                            help="Update the current quote detection model with the new labels instead of training "
+                                 "new models.")
+
+    def handle(self, *args, **options):
+        interval = timedelta(minutes=options['interval'])
+
+        # The language model is loaded once, and shared with the training processes
+        print('\nLoading language model...\n')
+        nlp = load_nlp()
+        with open('data/cue_verbs.csv', 'r') as f:
+            reader = csv.reader(f)
+            cue_verbs = set(list(reader)[0])
+
+        # Consecutive failed trainings, and the time before which the models aren't retrained after them or after a
+        # skipped update
+        failures = 0
+        retry_at = None
+        while True:
+            published = read_model_version()
+            trained_at = None if published is None else published['trained_at']
+            new_labels = count_new_labels(trained_at)
+            outdated = trained_at is None or timezone.now() - trained_at >= interval
+            backing_off = retry_at is not None and timezone.now() < retry_at
+            if not backing_off and (new_labels >= options['min_labels'] or (outdated and new_labels > 0)):
+                print(f'{timezone.now():%Y-%m-%d %H:%M:%S} Retraining with {new_labels} new label(s)...')
+                # The training process can't share the database connection of this process
+                db.connections.close_all()
+                process = Process(target=train_models, args=(nlp, cue_verbs, options['epochs']),
+                                  kwargs={'incremental': options['incremental']})
+                process.start()
+                process.join()
+                if process.exitcode == 0:
+                    failures = 0
+                    retry_at = None
+                    published = read_model_version()
+                    self.stdout.write(self.style.SUCCESS(f'Published model version {published["version"]}'))
+                    if trained_at is not None and published['trained_at'] == trained_at:
+                        # The update was skipped, so the new labels are counted again until more are labeled
+                        retry_at = timezone.now() + interval
+                else:
+                    failures += 1
+                    backoff = failure_backoff(failures, options['poll'], 60 * options['max_backoff'])
+                    retry_at = timezone.now() + timedelta(seconds=backoff)
+                    message = f'Training failed with exit code {process.exitcode} ({failures} consecutive ' \
+                              f'failure(s)), not retraining before {retry_at:%Y-%m-%d %H:%M:%S}'
+                    logger.error(message)
+                    self.stderr.write(message)
+            if options['once']:
+                break
+            time.sleep(options['poll'])
@@ -1,9 +1,9 @@
 from functools import reduce
 
 from django.core.management.base import BaseCommand
-from numpy.random import random
 
-from backend.helpers import aggregate_label
+from backend.db_management import assign_article_to_set
+from backend.helpers import aggregate_articles_labels
 from backend.models import Article
 
 
@@ -26,18 +26,17 @@ class Command(BaseCommand):
         # Number of labeled sentences that are quotes for each source
         labeled_quotes = {'Heidi.News': 0, 'Parisien': 0, 'Republique': 0}
 
-        articles = Article.objects.all()
+        articles = list(Article.objects.defer('parsed'))
+        # The consensus labels of all sentences in all fully labeled articles
+        articles_labels = aggregate_articles_labels([a for a in articles if a.labeled['fully_labeled'] == 1])
         for a in articles:
             articles_count[a.source] += 1
             sentences_count[a.source] += len(a.sentences['sentences'])
             if a.labeled['fully_labeled'] == 1:
                 labeled_articles[a.source] += 1
 
-                # Check if the article is in the training or test set.
-                if 'test_set' not in a.labeled:
-                    a.labeled['test_set'] = int(random() > 0.9)
-                    a.save()
-                if a.labeled['test_set'] == 0:
+                # Check if the article is in the training or test set, and assigns it if it isn't assigned yet.
+                if assign_article_to_set(a) == 0:
                     train_articles[a.source] += 1
                 else:
                     test_articles[a.source] += 1
@@ -46,7 +45,7 @@ class Command(BaseCommand):
                 for sentence_index, end in enumerate(a.sentences['sentences']):
                     labeled_sentences[a.source] += 1
                     # Compute consensus labels
-                    sentence_labels, sentence_authors, _ = aggregate_label(a, sentence_index)
+                    sentence_labels, sentence_authors, _ = articles_labels[a.id][sentence_index]
                     # If the sentence is a quote, add the number of quotes to the source
                     if sum(sentence_labels) > 0:
                         labeled_quotes[a.source] += 1
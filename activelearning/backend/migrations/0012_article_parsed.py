@@ -0,0 +1,18 @@
+# Generated by Django 2.2.5 on 2020-06-02 09:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0011_auto_20200518_0821'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='parsed',
+            field=models.BinaryField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,144 @@
+# Generated by Django 2.2.5 on 2020-06-04 10:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+""" The minimum confidence required for a full paragraph to be labeled at once, when the migration was written. """
+CONFIDENCE_THRESHOLD = 0.8
+
+
+def quote_end_sentence(sentence_ends, in_quote, token_index):
+    """
+    Given the index of the last token of a sentence, which is inside quotation marks, returns the index of the sentence
+    where the quotation mark ends. Frozen copy of backend.helpers.quote_end_sentence.
+
+    :param sentence_ends: list(int).
+        The list of the last token of each sentence
+    :param in_quote: list(int).
+        The list of in_quote tokens
+    :param token_index: int.
+        The index of the last token in the sentence
+    :return: int.
+        The index of the sentence containing the last token in the quote
+    """
+    while token_index < len(in_quote) and in_quote[token_index] == 1:
+        token_index += 1
+    sentence_index = len(sentence_ends) - 1
+    while sentence_index >= 0 and token_index <= sentence_ends[sentence_index]:
+        sentence_index -= 1
+    return sentence_index + 1
+
+
+def pending_task_fields(article):
+    """
+    Finds all paragraphs and sentences of an article that can be given to users to label. Frozen copy of
+    backend.helpers.pending_task_fields, so that the migration doesn't change when the application code does.
+
+    :param article: Article
+        The historical article in which to find tasks.
+    :return: list(dict)
+        The values of the fields of a PendingTask for each task in the article.
+    """
+    if article.labeled['fully_labeled'] == 1:
+        return []
+
+    labeled = article.labeled['labeled']
+    confidences = article.confidence['confidence']
+    predictions = article.confidence['predictions']
+    sentence_ends = article.sentences['sentences']
+    in_quotes = article.in_quotes['in_quotes']
+    tasks = []
+    prev_par_end = -1
+    # p is the index of the last sentence in paragraph i
+    for (i, p) in enumerate(article.paragraphs['paragraphs']):
+        # Lowest confidence in the whole paragraph
+        min_conf = min(confidences[prev_par_end + 1:p + 1])
+        par_predictions = predictions[prev_par_end + 1:p + 1]
+        # For high enough confidences, annotate the whole paragraph
+        if min_conf >= CONFIDENCE_THRESHOLD \
+                and max(par_predictions) == 0 \
+                and labeled[prev_par_end + 1] == 0 \
+                and p - prev_par_end > 2:
+            tasks.append({
+                'task': 'paragraph',
+                'paragraph': i,
+                'first_sentence': prev_par_end + 1,
+                'last_sentence': p,
+                'position': 2 * (prev_par_end + 1),
+            })
+
+        # All sentences in the paragraph that need to be annotated
+        for j in range(prev_par_end + 1, p + 1):
+            if not labeled[j] == 1:
+                last_sentence = j
+                # The following sentences are also given if the quote the sentence ends with continues in them
+                sent_end = sentence_ends[j]
+                if in_quotes[sent_end] == 1:
+                    last_sent = quote_end_sentence(sentence_ends, in_quotes, sent_end)
+                    last_sentence = max(j, min(last_sent + 1, len(sentence_ends)) - 1)
+                tasks.append({
+                    'task': 'sentence',
+                    'paragraph': i,
+                    'first_sentence': j,
+                    'last_sentence': last_sentence,
+                    'position': 2 * j + 1,
+                })
+        prev_par_end = p
+
+    for task in tasks:
+        task['article_id'] = article.id
+        task['source'] = article.source
+        task['article_confidence'] = article.confidence['min_confidence']
+    return tasks
+
+
+def populate_pending_tasks(apps, schema_editor):
+    """ Creates the pending labelling tasks of all existing articles. """
+    Article = apps.get_model('backend', 'Article')
+    PendingTask = apps.get_model('backend', 'PendingTask')
+    tasks = []
+    for article in Article.objects.defer('parsed', 'text', 'tokens', 'people').iterator():
+        tasks += [PendingTask(**fields) for fields in pending_task_fields(article)]
+        if len(tasks) >= 500:
+            PendingTask.objects.bulk_create(tasks)
+            tasks = []
+    PendingTask.objects.bulk_create(tasks)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0012_article_parsed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingTask',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=200)),
+                ('article_confidence', models.FloatField()),
+                ('position', models.IntegerField()),
+                ('task', models.CharField(max_length=20)),
+                ('paragraph', models.IntegerField()),
+                ('first_sentence', models.IntegerField()),
+                ('last_sentence', models.IntegerField()),
+                ('article', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='backend.Article')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='userlabel',
+            index=models.Index(fields=['session_id', 'article', 'sentence_index'], name='userlabel_session_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pendingtask',
+            index=models.Index(fields=['source', 'article_confidence', 'article', 'position'],
+                               name='pendingtask_source_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pendingtask',
+            index=models.Index(fields=['article_confidence', 'article', 'position'], name='pendingtask_order_idx'),
+        ),
+        migrations.RunPython(populate_pending_tasks, migrations.RunPython.noop),
+    ]
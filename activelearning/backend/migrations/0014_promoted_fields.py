@@ -0,0 +1,51 @@
+# Generated by Django 2.2.5 on 2020-06-05 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0013_pendingtask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='fully_labeled',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='min_confidence',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userlabel',
+            name='is_empty_label',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        # Fills the new columns from the JSON fields
+        migrations.RunSQL(
+            "UPDATE backend_article SET fully_labeled = (labeled->>'fully_labeled')::integer, "
+            "min_confidence = (confidence->>'min_confidence')::double precision;",
+            migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            "UPDATE backend_userlabel SET is_empty_label = (labels->'labels' = '[]'::jsonb);",
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['fully_labeled', 'min_confidence', 'id'], name='article_hardest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['source', 'fully_labeled', 'min_confidence'],
+                               name='article_source_hardest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userlabel',
+            index=models.Index(fields=['article', 'is_empty_label', 'sentence_index'], name='userlabel_sentence_idx'),
+        ),
+    ]
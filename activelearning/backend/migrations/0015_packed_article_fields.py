@@ -0,0 +1,134 @@
+# Generated by Django 2.2.5 on 2020-06-08 09:37
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+import backend.fields
+
+
+""" The fields converted from JSON to packed binary. """
+PACKED_FIELDS = ['in_quotes', 'sentences', 'paragraphs']
+
+
+""" The number of articles converted at once. """
+CHUNK_SIZE = 500
+
+
+def convert_articles(apps, from_suffix, to_suffix):
+    """
+    Copies the values of the packed fields between their JSON and binary columns.
+
+    :param apps: django.apps.registry.Apps
+        The historical models.
+    :param from_suffix: string
+        The suffix of the columns from which values are copied.
+    :param to_suffix: string
+        The suffix of the columns to which values are copied.
+    """
+    Article = apps.get_model('backend', 'Article')
+    from_fields = [f'{field}{from_suffix}' for field in PACKED_FIELDS]
+    to_fields = [f'{field}{to_suffix}' for field in PACKED_FIELDS]
+    articles = Article.objects.only('id', *from_fields).order_by('id')
+    updated = []
+    for article in articles.iterator(chunk_size=CHUNK_SIZE):
+        for from_field, to_field in zip(from_fields, to_fields):
+            setattr(article, to_field, getattr(article, from_field))
+        updated.append(article)
+        if len(updated) >= CHUNK_SIZE:
+            Article.objects.bulk_update(updated, to_fields)
+            updated = []
+    if len(updated) > 0:
+        Article.objects.bulk_update(updated, to_fields)
+
+
+def pack_articles(apps, schema_editor):
+    convert_articles(apps, '', '_packed')
+
+
+def unpack_articles(apps, schema_editor):
+    convert_articles(apps, '_packed', '')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0014_promoted_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='in_quotes_packed',
+            field=backend.fields.BitListField(key='in_quotes', null=True),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='sentences_packed',
+            field=backend.fields.Int32ListField(key='sentences', null=True),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='paragraphs_packed',
+            field=backend.fields.Int32ListField(key='paragraphs', null=True),
+        ),
+        # The JSON columns are made nullable, so that they can be added back empty if the migration is reversed. When
+        # reversed, they are only made required again once unpack_articles copied the values back into them.
+        migrations.AlterField(
+            model_name='article',
+            name='in_quotes',
+            field=django.contrib.postgres.fields.jsonb.JSONField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='article',
+            name='sentences',
+            field=django.contrib.postgres.fields.jsonb.JSONField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='article',
+            name='paragraphs',
+            field=django.contrib.postgres.fields.jsonb.JSONField(null=True),
+        ),
+        migrations.RunPython(pack_articles, unpack_articles),
+        migrations.RemoveField(
+            model_name='article',
+            name='in_quotes',
+        ),
+        migrations.RemoveField(
+            model_name='article',
+            name='sentences',
+        ),
+        migrations.RemoveField(
+            model_name='article',
+            name='paragraphs',
+        ),
+        migrations.RenameField(
+            model_name='article',
+            old_name='in_quotes_packed',
+            new_name='in_quotes',
+        ),
+        migrations.RenameField(
+            model_name='article',
+            old_name='sentences_packed',
+            new_name='sentences',
+        ),
+        migrations.RenameField(
+            model_name='article',
+            old_name='paragraphs_packed',
+            new_name='paragraphs',
+        ),
+        migrations.AlterField(
+            model_name='article',
+            name='in_quotes',
+            field=backend.fields.BitListField(key='in_quotes'),
+        ),
+        migrations.AlterField(
+            model_name='article',
+            name='sentences',
+            field=backend.fields.Int32ListField(key='sentences'),
+        ),
+        migrations.AlterField(
+            model_name='article',
+            name='paragraphs',
+            field=backend.fields.Int32ListField(key='paragraphs'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.2.5 on 2020-06-10 16:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0015_packed_article_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='confidence_version',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['fully_labeled', 'confidence_version'], name='article_confidence_version_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.5 on 2020-06-15 10:12
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0016_article_confidence_version'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='article',
+            name='article_hardest_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='article',
+            name='article_source_hardest_idx',
+        ),
+    ]
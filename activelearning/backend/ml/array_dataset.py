@@ -0,0 +1,148 @@
+import numpy as np
+
+"""
+Datasets storing their features as a single contiguous matrix, and loaders iterating over mini-batches of them.
+
+The loaders replace torch DataLoaders: the batches are slices of NumPy arrays given directly to scikit-learn, instead of
+lists of small arrays collated into tensors one datapoint at a time.
+"""
+
+
+""" The type of the feature matrices. """
+FEATURE_DTYPE = np.float32
+
+
+class ArrayDataset:
+    """ Dataset whose features and labels are stored as a matrix and a vector """
+
+    def __init__(self, features, labels):
+        """
+        Initializes the dataset.
+
+        :param features: list(np.array)
+            The features of each datapoint, which must all have the same dimensionality.
+        :param labels: list(int)
+            The label of each datapoint.
+        """
+        self.features = np.ascontiguousarray(features, dtype=FEATURE_DTYPE)
+        self.labels = np.asarray(labels, dtype=np.int64)
+        self.feature_dimensionality = self.features.shape[1:]
+        self.length = len(self.labels)
+
+    def __getitem__(self, index):
+        """
+        Finds the item at a given index of the dataset.
+
+        :param index: int or slice or np.array(int).
+            The index at which we want the data.
+        :return: np.array, np.array
+            The features and label for the datapoint
+        """
+        return self.features[index], self.labels[index]
+
+    def __len__(self):
+        return self.length
+
+    @classmethod
+    def from_arrays(cls, features, labels, article_features):
+        """
+        Creates a dataset from features that were already extracted, for example by a FeatureStore.
+
+        :param features: np.array
+            The feature matrix. It isn't copied if it's already a contiguous float32 matrix.
+        :param labels: np.array(int)
+            The label of each datapoint.
+        :param article_features: dict(int, tuple)
+            The first and last row of each article, followed by any other value the dataset stores for the article.
+        :return: ArrayDataset
+            The dataset, of the class on which the method is called.
+        """
+        dataset = cls.__new__(cls)
+        ArrayDataset.__init__(dataset, features, labels)
+        dataset.article_features = article_features
+        return dataset
+
+
+def article_rows(article_ranges):
+    """
+    Finds the rows of the dataset that contain the features of some articles.
+
+    :param article_ranges: list(Tuple(int, int))
+        The first and last row containing the features of each article.
+    :return: np.array(int)
+        The indices of the rows, in the order of the articles.
+    """
+    if len(article_ranges) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.concatenate([np.arange(start, end + 1) for start, end in article_ranges])
+
+
+def subset_rows(dataset, rows):
+    """
+    Returns a subset of a dataset, with its own contiguous copy of the features of some rows.
+
+    :param dataset: ArrayDataset
+        The dataset from which to take a subset.
+    :param rows: np.array(int)
+        The indices of the rows to keep.
+    :return: ArrayDataset
+        The subset.
+    """
+    return ArrayDataset(dataset.features[rows], dataset.labels[rows])
+
+
+def balanced_weights(labels):
+    """
+    Computes the weights to give to each datapoint for random sampling, so that both classes 0 and 1 are sampled as
+    often on average. Datapoints of any other class are never sampled.
+
+    :param labels: np.array(int)
+        The label of each datapoint.
+    :return: np.array(float), int
+        The weights for each datapoint and the total number of samples in an epoch.
+    """
+    class_counts = np.bincount(labels, minlength=2)
+    divisor = 2 * class_counts[0] * class_counts[1]
+    class_weights = np.zeros(len(class_counts))
+    if divisor > 0:
+        class_weights[0] = class_counts[1] / divisor
+        class_weights[1] = class_counts[0] / divisor
+    num_samples = 2 * min(class_counts[0], class_counts[1])
+    return class_weights[labels], int(num_samples)
+
+
+class ArrayLoader:
+    """
+    Iterates over mini-batches of a dataset. When weights are given, each iteration draws a new sample of the dataset
+    with replacement (like torch's WeightedRandomSampler). Otherwise, the rows are returned in order.
+    """
+
+    def __init__(self, dataset, batch_size=None, weights=None, num_samples=None):
+        """
+        Initializes the loader.
+
+        :param dataset: ArrayDataset
+            The dataset from which to load data.
+        :param batch_size: int
+            The batch size. The default is None, where the batch size is the size of the data.
+        :param weights: np.array(float)
+            If defined, the weight of each datapoint for random sampling.
+        :param num_samples: int
+            The number of datapoints sampled in each iteration when using weights.
+        """
+        self.dataset = dataset
+        self.weights = weights
+        self.num_samples = len(dataset) if weights is None else num_samples
+        self.batch_size = max(1, self.num_samples if batch_size is None else batch_size)
+
+    def __iter__(self):
+        features, labels = self.dataset.features, self.dataset.labels
+        if self.weights is not None and self.num_samples > 0:
+            rows = np.random.choice(len(self.weights), size=self.num_samples, replace=True,
+                                    p=self.weights / self.weights.sum())
+            features, labels = features[rows], labels[rows]
+        for start in range(0, self.num_samples, self.batch_size):
+            yield features[start:start + self.batch_size], labels[start:start + self.batch_size]
+
+    def __len__(self):
+        return (self.num_samples + self.batch_size - 1) // self.batch_size
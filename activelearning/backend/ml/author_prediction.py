@@ -2,13 +2,15 @@ import numpy as np
 from sklearn.linear_model import SGDClassifier
 from sklearn.metrics import precision_recall_fscore_support
 from sklearn.model_selection import KFold
-from sklearn.preprocessing import PolynomialFeatures
 
 from backend.ml.helpers import extract_speaker_names
 from backend.db_management import load_quote_authors
 from backend.ml.author_prediction_dataset import AuthorPredictionDataset, subset, author_prediction_loader
+from backend.ml.feature_expansion import PolynomialExpansion
+from backend.ml.feature_store import FEATURE_STORE_PATH, feature_version, load_dataset
 from backend.ml.scoring import Results
-from backend.ml.sgd import train, evaluate
+from backend.ml.sgd import train, evaluate, run_jobs
+from backend.models import Article
 
 """
 File with the second way of extracting authors for quotes. Instead of trying to determine which Named Entity is the
@@ -17,26 +19,46 @@ binary classifier.
 """
 
 
-def load_data(nlp, cue_verbs, poly):
+def load_data(nlp, cue_verbs, poly, store_path=FEATURE_STORE_PATH):
     """
-    Loads the datasets to perform article quotee extraction.
+    Loads the datasets to perform article quotee extraction. The features are stored, and only extracted again when the
+    labeled articles change.
 
     :param nlp: spaCy.Language
         The language model used to tokenize the text.
     :param cue_verbs: list(string)
         The list of all "cue verbs", which are verbs that often introduce reported speech.
-    :param poly: sklearn.preprocessing.PolynomialFeatures
+    :param poly: backend.ml.feature_expansion.PolynomialExpansion
         If defined, used to perform feature extraction.
+    :param store_path: string
+        The directory in which the features are stored. If None, the features are always extracted.
     :return: np.array(dict), np.array(int), QuoteAttributionDataset
         * Array of dicts containing training and test quotes, respectively. Keys:
             * 'article': models.Article, the article containing the quote
             * 'sentences': list(spaCy.Doc), the spaCy.Doc for each sentence in the article.
             * 'quotes': list(int), the indices of sentences that contain quotes in the article.
             * 'author': list(list(int)), the indices of the tokens of the author of the quote.
+          When the features are loaded from the store, the dicts only contain the article.
         * The dataset
     """
-    train_dicts, _ = load_quote_authors(nlp)
-    author_prediction_dataset = AuthorPredictionDataset(train_dicts, cue_verbs, poly)
+    train_dicts = []
+
+    def extract():
+        train_dicts.extend(load_quote_authors(nlp)[0])
+        return AuthorPredictionDataset(train_dicts, cue_verbs, poly)
+
+    if store_path is None:
+        author_prediction_dataset = extract()
+        return np.array(train_dicts), author_prediction_dataset
+
+    version = feature_version('author_prediction', cue_verbs, poly)
+    author_prediction_dataset, loaded = load_dataset(f'author_prediction_{poly.degree if poly else 1}',
+                                                     AuthorPredictionDataset, extract, version, store_path)
+    if loaded:
+        # The features were extracted in a previous run, so the sentences of the articles don't need to be parsed
+        article_ids = list(author_prediction_dataset.article_features.keys())
+        articles = Article.objects.only('id', 'people').in_bulk(article_ids)
+        train_dicts = [{'article': articles[article_id]} for article_id in article_ids]
     return np.array(train_dicts), author_prediction_dataset
 
 
@@ -106,91 +128,137 @@ def evaluate_author_prediction(loss, penalty, alpha, max_iter, nlp, cue_verbs, p
             * CV test results of predicting if each person (across all mentions of that person) is cited in the article
               or not
     """
-    poly = PolynomialFeatures(poly_degree, interaction_only=True, include_bias=True)
+    return evaluate_author_prediction_grid([(loss, penalty, alpha)], max_iter, nlp, cue_verbs, poly_degree, cv_folds)[0]
+
+
+def evaluate_author_prediction_grid(parameters, max_iter, nlp, cue_verbs, poly_degree, cv_folds=5, jobs=1):
+    """
+    Evaluates author prediction models with different hyperparameters using cross-validation, on the same metrics as
+    evaluate_author_prediction. The dataset is only built once, and the folds of all models are trained in parallel.
+
+    :param parameters: list(Tuple(string, string, float))
+        The loss, penalty and regularization term of each model.
+    :param max_iter: int
+        The maximum number of epochs to train for
+    :param nlp: spaCy.Language
+        The language model used to tokenize the text.
+    :param cue_verbs: list(string)
+        The list of all "cue verbs", which are verbs that often introduce reported speech.
+    :param poly_degree: int
+        The degree to which polynomial feature expansion should be performed
+    :param cv_folds: int
+        The number of cross-validation folds to perform.
+    :param jobs: int
+        The number of processes training folds.
+    :return: list(Tuple(Scoring.Results, Scoring.Results, Scoring.Results, Scoring.Results))
+        The results of cross-validation of each model, as returned by evaluate_author_prediction.
+    """
+    poly = PolynomialExpansion(poly_degree, interaction_only=True, include_bias=True)
     article_dicts, author_prediction_dataset = load_data(nlp, cue_verbs, poly)
 
-    kf = KFold(n_splits=cv_folds)
+    folds = list(KFold(n_splits=cv_folds).split(article_dicts))
+    progress = [f'{int(100 * n / cv_folds)}% {10 * n // cv_folds * "█"}' for n in range(cv_folds)]
+    jobs_args = [(loss, penalty, alpha, max_iter, train_indices, test_indices,
+                  f'      Evaluating with alpha={alpha}: {fold_progress}'.ljust(50))
+                 for loss, penalty, alpha in parameters
+                 for fold_progress, (train_indices, test_indices) in zip(progress, folds)]
+    scores = iter(run_jobs(author_prediction_fold, (article_dicts, author_prediction_dataset), jobs_args, jobs))
+
+    results = []
+    for _ in parameters:
+        fold_results = (Results(), Results(), Results(), Results())
+        for _ in folds:
+            for accumulated, fold_scores in zip(fold_results, next(scores)):
+                accumulated.add_scores(fold_scores)
+        results.append(fold_results)
+    return results
+
+
+def author_prediction_fold(data, loss, penalty, alpha, max_iter, train_indices, test_indices, prefix=''):
+    """
+    Trains an author prediction model on a cross-validation fold, and evaluates it.
 
-    train_results = Results()
-    test_results = Results()
+    :param data: Tuple(np.array(dict), AuthorPredictionDataset)
+        The articles and the dataset, as returned by load_data.
+    :param loss: string
+        One of {'log', 'hinge'}. The loss function to use.
+    :param penalty: string
+        One of {'l1', 'l2}. The penalty to use for training
+    :param alpha: float
+        The regularization to use for training
+    :param max_iter: int
+        The maximum number of epochs to train for
+    :param train_indices: np.array(int)
+        The indices of the articles of the training set.
+    :param test_indices: np.array(int)
+        The indices of the articles of the test set.
+    :param prefix: String
+        The prefix to the string indicating the progression of the training
+    :return: dict, dict, dict, dict
+        The training and test scores of predicting if each named entity is the quotee for a sentence or not, and the
+        training and test scores of predicting if each person is cited in the article or not.
+    """
+    article_dicts, author_prediction_dataset = data
+    classifier = SGDClassifier(loss=loss, alpha=alpha, penalty=penalty, warm_start=True)
 
-    train_author_set_results = Results()
-    test_author_set_results = Results()
+    train_articles = article_dicts[train_indices]
+    train_ids = list(map(lambda a: a['article'].id, train_articles))
+
+    test_articles = article_dicts[test_indices]
+    test_ids = list(map(lambda a: a['article'].id, test_articles))
+
+    train_dataset = subset(author_prediction_dataset, train_ids)
+    test_dataset = subset(author_prediction_dataset, test_ids)
+
+    train_loader = author_prediction_loader(train_dataset, train=True, batch_size=10)
+    test_loader = author_prediction_loader(test_dataset, train=False, batch_size=len(test_dataset))
+
+    classifier, _ = train(classifier, train_loader, test_loader, max_iter, print_prefix=prefix)
+
+    train_loader = author_prediction_loader(train_dataset, train=False, batch_size=len(train_dataset))
+    train_scores = evaluate(classifier, train_loader)
+    test_scores = evaluate(classifier, test_loader)
+
+    train_people_cited_scores = people_cited_scores(classifier, author_prediction_dataset, train_articles)
+    test_people_cited_scores = people_cited_scores(classifier, author_prediction_dataset, test_articles)
+    return train_scores, test_scores, train_people_cited_scores, test_people_cited_scores
+
+
+def people_cited_scores(classifier, dataset, articles):
+    """
+    Evaluates a trained model in predicting the set of people cited in articles.
+
+    :param classifier: SGDClassifier
+        The trained model.
+    :param dataset: AuthorPredictionDataset
+        The dataset containing the articles.
+    :param articles: np.array(dict)
+        The articles, as returned by load_data.
+    :return: dict
+        The accuracy, precision, recall and f1 scores.
+    """
+    people_cited_true_labels = []
+    people_cited_predicted_labels = []
+
+    for article in articles:
+        prediction_results = predict_authors(classifier, dataset, article['article'])
+        if prediction_results:
+            true_labels, predicted_labels = prediction_results
+            people_cited_true_labels += true_labels
+            people_cited_predicted_labels += predicted_labels
 
-    n = 0
-    for train_indices, test_indices in kf.split(article_dicts):
-        prefix = f'      Evaluating with alpha={alpha}: {int(100 * n / cv_folds)}% {10 * n // cv_folds * "█"}'.ljust(50)
-        n += 1
-
-        classifier = SGDClassifier(loss=loss, alpha=alpha, penalty=penalty, warm_start=True)
-
-        train_articles = article_dicts[train_indices]
-        train_ids = list(map(lambda a: a['article'].id, train_articles))
-
-        test_articles = article_dicts[test_indices]
-        test_ids = list(map(lambda a: a['article'].id, test_articles))
-
-        train_dataset = subset(author_prediction_dataset, train_ids)
-        test_dataset = subset(author_prediction_dataset, test_ids)
-
-        train_loader = author_prediction_loader(train_dataset, train=True, batch_size=10)
-        test_loader = author_prediction_loader(test_dataset, train=False, batch_size=len(test_dataset))
-
-        classifier, _ = train(classifier, train_loader, test_loader, max_iter, print_prefix=prefix)
-
-        train_loader = author_prediction_loader(train_dataset, train=False, batch_size=len(train_dataset))
-        train_results.add_scores(evaluate(classifier, train_loader))
-        test_results.add_scores(evaluate(classifier, test_loader))
-
-        train_people_cited_true_labels = []
-        train_people_cited_predicted_labels = []
-
-        for article in train_articles:
-            prediction_results = predict_authors(classifier, author_prediction_dataset, article['article'])
-            if prediction_results:
-                true_labels, predicted_labels = prediction_results
-                train_people_cited_true_labels += true_labels
-                train_people_cited_predicted_labels += predicted_labels
-
-        train_labels = zip(train_people_cited_true_labels, train_people_cited_predicted_labels)
-        accuracy = sum([true == predicted for true, predicted in train_labels]) / len(train_people_cited_true_labels)
-        precision, recall, f1, _ = precision_recall_fscore_support(train_people_cited_true_labels,
-                                                                   train_people_cited_predicted_labels,
-                                                                   zero_division=0,
-                                                                   average='binary')
-        train_people_cited_scores = {
-            'accuracy': accuracy,
-            'precision': precision,
-            'recall': recall,
-            'f1': f1,
-        }
-        train_author_set_results.add_scores(train_people_cited_scores)
-
-        test_people_cited_true_labels = []
-        test_people_cited_predicted_labels = []
-
-        for article in test_articles:
-            prediction_results = predict_authors(classifier, author_prediction_dataset, article['article'])
-            if prediction_results:
-                true_labels, predicted_labels = prediction_results
-                test_people_cited_true_labels += true_labels
-                test_people_cited_predicted_labels += predicted_labels
-
-        test_labels = zip(test_people_cited_true_labels, test_people_cited_predicted_labels)
-        accuracy = sum([true == predicted for true, predicted in test_labels]) / len(test_people_cited_true_labels)
-        precision, recall, f1, _ = precision_recall_fscore_support(test_people_cited_true_labels,
-                                                                   test_people_cited_predicted_labels,
-                                                                   zero_division=0,
-                                                                   average='binary')
-        test_people_cited_scores = {
-            'accuracy': accuracy,
-            'precision': precision,
-            'recall': recall,
-            'f1': f1,
-        }
-        test_author_set_results.add_scores(test_people_cited_scores)
-
-    return train_results, test_results, train_author_set_results, test_author_set_results
+    labels = zip(people_cited_true_labels, people_cited_predicted_labels)
+    accuracy = sum([true == predicted for true, predicted in labels]) / len(people_cited_true_labels)
+    precision, recall, f1, _ = precision_recall_fscore_support(people_cited_true_labels,
+                                                               people_cited_predicted_labels,
+                                                               zero_division=0,
+                                                               average='binary')
+    return {
+        'accuracy': accuracy,
+        'precision': precision,
+        'recall': recall,
+        'f1': f1,
+    }
 
 
 def evaluate_author_prediction_test(loss, penalty, alpha, max_iter, nlp, cue_verbs, poly_degree):
@@ -227,7 +295,7 @@ def evaluate_author_prediction_test(loss, penalty, alpha, max_iter, nlp, cue_ver
                 * 'predicted': the names of people predicted to have been cited in the article
     """
     # Load Data
-    poly = PolynomialFeatures(poly_degree, interaction_only=True, include_bias=True)
+    poly = PolynomialExpansion(poly_degree, interaction_only=True, include_bias=True)
     train_dicts, test_dicts = load_quote_authors(nlp)
     train_dataset = AuthorPredictionDataset(train_dicts, cue_verbs, poly)
     train_loader = author_prediction_loader(train_dataset, train=True, batch_size=10)
@@ -1,6 +1,6 @@
-from torch.utils.data import Dataset, DataLoader, Subset
-from torch.utils.data.sampler import WeightedRandomSampler
+import numpy as np
 
+from backend.ml.array_dataset import ArrayDataset, ArrayLoader, article_rows, balanced_weights, subset_rows
 from backend.ml.helpers import find_true_author_index
 from backend.ml.author_prediction_feature_extraction import *
 
@@ -17,30 +17,28 @@ def parse_article(article_dict, cue_verbs, poly=None):
             * 'author': list(list(int)), the indices of the tokens of the author for each quote.
     :param cue_verbs: list(string)
         The list of all "cue verbs", which are verbs that often introduce reported speech.
-    :param poly: sklearn.preprocessing.PolynomialFeatures
+    :param poly: backend.ml.feature_expansion.PolynomialExpansion
         If defined, used for feature expansion.
     :return: list(np.array), list(int), int, int
         * The features for each speaker in the article. The features for the i-th speaker in the article is at index i.
         * The label for each speaker in the article. The label for the i-th speaker in the article is at index i.
         * The number of speakers in the article
     """
-    features = []
     speakers_in_article = article_dict['article'].people['mentions']
 
-    for i, speaker in enumerate(speakers_in_article):
-        speaker_features = attribution_features_baseline(
-            article_dict['article'],
-            article_dict['sentences'],
-            article_dict['quotes'],
-            speaker,
-            speakers_in_article[:i] + speakers_in_article[i + 1:],
-            cue_verbs
-        )
-        if poly:
-            speaker_features = poly.fit_transform(speaker_features.reshape((-1, 1))).reshape((-1,))
-        features.append(
-            speaker_features
-        )
+    # Extracts the features of all speakers at once
+    features = article_attribution_features_baseline(
+        article_dict['article'],
+        article_dict['sentences'],
+        article_dict['quotes'],
+        speakers_in_article,
+        cue_verbs
+    )
+
+    # Expands the features of all speakers at once
+    if poly and len(features) > 0:
+        features = poly.transform(features)
+    features = list(features)
 
     labels = len(speakers_in_article) * [0]
 
@@ -55,7 +53,7 @@ def parse_article(article_dict, cue_verbs, poly=None):
     return features, labels, len(speakers_in_article)
 
 
-class AuthorPredictionDataset(Dataset):
+class AuthorPredictionDataset(ArrayDataset):
     """ Dataset comprised of labeled articles, with features extracted for quote attribution """
 
     def __init__(self, article_dicts, cue_verbs, poly=None):
@@ -70,11 +68,11 @@ class AuthorPredictionDataset(Dataset):
             * 'author': list(list(int)), the indices of the tokens of the author for each quote.
         :param cue_verbs: list(string)
             The list of all "cue verbs", which are verbs that often introduce reported speech.
-        :param poly: sklearn.preprocessing.PolynomialFeatures
+        :param poly: backend.ml.feature_expansion.PolynomialExpansion
             If defined, used for feature expansion.
         """
-        self.features = []
-        self.labels = []
+        features = []
+        labels = []
 
         # Keys: article id
         # Values: first feature in the article
@@ -84,28 +82,13 @@ class AuthorPredictionDataset(Dataset):
 
         for a_dict in article_dicts:
             article_features, article_labels, article_speakers = parse_article(a_dict, cue_verbs, poly=poly)
-            first_feature = len(self.features)
-            self.features += article_features
-            last_feature = len(self.features) - 1
-            self.labels += article_labels
+            first_feature = len(features)
+            features += article_features
+            last_feature = len(features) - 1
+            labels += article_labels
             self.article_features[a_dict['article'].id] = (first_feature, last_feature, article_speakers)
 
-        self.feature_dimensionality = self.features[0].shape
-        self.length = len(self.features)
-
-    def __getitem__(self, index):
-        """
-        Finds the item at a given index of the dataset.
-
-        :param index: int.
-            The index at which we want the data.
-        :return: np.array, np.array
-            The features and label for the datapoint
-        """
-        return self.features[index], self.labels[index]
-
-    def __len__(self):
-        return self.length
+        super().__init__(features, labels)
 
     def get_article_indices(self, article_id):
         """
@@ -140,12 +123,11 @@ def subset(dataset, article_indices):
         The dataset from which to take a subset.
     :param article_indices: list(int)
         The indices of the articles to keep in the subset.
-    :return:
+    :return: ArrayDataset
+        The subset.
     """
-    indices = []
-    for a_id in article_indices:
-        indices += dataset.get_article_indices(a_id)
-    return Subset(dataset, indices)
+    article_ranges = [dataset.get_article_features(a_id)[:2] for a_id in article_indices]
+    return subset_rows(dataset, article_rows(article_ranges))
 
 
 def sampler_weights(dataset):
@@ -154,23 +136,10 @@ def sampler_weights(dataset):
 
     :param dataset: Dataset
         The dataset to find the weights for
-    :return: list(float), int
+    :return: np.array(float), int
         The weights for each index in the dataset and the total number of samples in an epoch.
     """
-    class_counts = [0, 0]
-    for index in range(len(dataset)):
-        _, label = dataset[index]
-        class_counts[label] += 1
-
-    divisor = 2 * class_counts[0] * class_counts[1]
-    sample_weights = (class_counts[1] / divisor, class_counts[0] / divisor)
-    weights = []
-    for index in range(len(dataset)):
-        _, label = dataset[index]
-        weights.append(sample_weights[label])
-
-    num_samples = 2 * min(class_counts[0], class_counts[1])
-    return weights, num_samples
+    return balanced_weights(dataset.labels)
 
 
 def author_prediction_loader(dataset, train=True, batch_size=None):
@@ -184,14 +153,13 @@ def author_prediction_loader(dataset, train=True, batch_size=None):
         Whether to load a training or testing dataloader.
     :param batch_size: int.
         The batch size. The default is None, where the batch size is the size of the data.
-    :return: torch.utils.data.DataLoader
-        DataLoader for quote detection.
+    :return: ArrayLoader
+        Loader for quote detection.
     """
     if batch_size is None:
         batch_size = len(dataset)
     if train:
         weights, num_samples = sampler_weights(dataset)
-        sampler = WeightedRandomSampler(weights=weights, num_samples=num_samples, replacement=True)
-        return DataLoader(dataset=dataset, batch_size=batch_size, sampler=sampler)
+        return ArrayLoader(dataset, batch_size, weights, num_samples)
     else:
-        return DataLoader(dataset=dataset, batch_size=batch_size, shuffle=False)
+        return ArrayLoader(dataset, batch_size)
@@ -1,10 +1,51 @@
+from bisect import bisect_left
+
 import numpy as np
-from backend.ml.quote_attribution_feature_extraction import speaker_information, speaker_information_no_db
 
 
-def attribution_features_baseline(article, sentences, quotes, speaker, other_speakers, cue_verbs):
+""" The number of features extracted for each speaker. """
+NUM_FEATURES = 20
+
+
+def speaker_sentences(sentence_indices, speakers):
     """
-    First feature extraction model for author prediction. Extracts the following features for a named entity.
+    Finds the sentence containing each speaker, in the same way as speaker_information.
+
+    :param sentence_indices: list(int)
+        The index of the last token of each sentence in the article, as in article.sentences['sentences']
+    :param speakers: list(dict)
+        The speakers. Each has keys 'name', 'full_name', 'start', 'end', as described in the database.
+    :return: np.array(int), np.array(int)
+        The index of the sentence containing each speaker, and the index of the first token of that sentence.
+    """
+    sentences = np.array([bisect_left(sentence_indices, speaker['end']) for speaker in speakers], dtype=np.int64)
+    sentence_starts = np.concatenate(([0], np.asarray(sentence_indices, dtype=np.int64) + 1))
+    return sentences, sentence_starts[sentences]
+
+
+def window_counts(prefix_sums, first, last):
+    """
+    Counts elements in windows of sentences using prefix sums.
+
+    :param prefix_sums: np.array(int)
+        The number of elements before each sentence (prefix_sums[k] counts the elements in sentences 0 to k - 1).
+    :param first: np.array(int)
+        The first sentence of each window.
+    :param last: np.array(int)
+        The last sentence of each window.
+    :return: np.array(int)
+        The number of elements in each window, 0 for empty windows.
+    """
+    size = len(prefix_sums) - 1
+    first = np.clip(first, 0, size)
+    last = np.clip(last + 1, 0, size)
+    return np.maximum(prefix_sums[last] - prefix_sums[first], 0)
+
+
+def attribution_features_baseline_batch(sentence_indices, in_quotes, sentences, quotes, speakers, cue_verbs):
+    """
+    First feature extraction model for author prediction. Extracts the following features for every named entity in an
+    article at once, the other speakers of each named entity being all the others in the list.
 
     Boolean features:
         * Whether or not the speaker is the subject of the sentence
@@ -30,181 +71,126 @@ def attribution_features_baseline(article, sentences, quotes, speaker, other_spe
         * Number of other speakers within 6 sentences above it
         * Number of other speakers within 6 sentences below it
 
-    :param article: models.Article
-        The article from which the quote and speakers are taken.
+    The sentence of each speaker, the quotes and the other speakers in windows of sentences are found using indexes
+    computed once for the article, instead of scanning the sentences and quotes for each speaker. The values are
+    identical to the ones computed for each speaker separately, including the following edge cases of the original
+    implementation:
+        * A reported speech in the first sentence of the article isn't considered as the closest one above a speaker.
+        * The other speakers within n sentences above a speaker are only counted until the first other speaker that
+          isn't above it, in the order of the list (and symmetrically below it).
+
+    :param sentence_indices: list(int)
+        The index of the last token of each sentence in the article, as in article.sentences['sentences']
+    :param in_quotes: list(int):
+        List of boolean values indicating whether each token in the article is in between quotes or not, as in
+        article.in_quotes['in_quotes']
     :param sentences: list(spaCy.Doc)
         the spaCy.Doc for each sentence in the article.
     :param quotes: list(int)
-        The indices of other sentences that are quotes in the article.
-    :param speaker: dict.
-        The speaker. Has keys 'name', 'full_name', 'start', 'end', as described in the database.
-    :param other_speakers: list(dict)
-        The list of other speakers in the article.
+        The indices of the sentences that are quotes in the article, in increasing order.
+    :param speakers: list(dict)
+        The speakers in the article. Each has keys 'name', 'full_name', 'start', 'end', as described in the database.
     :param cue_verbs: list(string).
-        The sentence to extract features from.
+        The list of all "cue verbs", which are verbs that often introduce reported speech.
     :return: np.array
-        The features extracted
+        The features extracted for each speaker, of shape (len(speakers), NUM_FEATURES).
     """
-    speaker_sent_index, speaker_first_token_index, relative_token_indices = speaker_information(article, speaker)
+    num_speakers = len(speakers)
+    if num_speakers == 0:
+        return np.zeros((0, NUM_FEATURES), dtype=np.int64)
+
+    # Per-article indexes
+    speaker_sents, sent_starts = speaker_sentences(sentence_indices, speakers)
+    quotes = np.asarray(quotes, dtype=np.int64)
+    num_sentences = max([len(sentence_indices), int(speaker_sents.max())] + quotes.tolist()) + 1
+    quote_sentences = np.zeros(num_sentences, dtype=np.int64)
+    quote_sentences[quotes] = 1
+    quote_prefix_sums = np.concatenate(([0], np.cumsum(quote_sentences)))
+    speaker_prefix_sums = np.concatenate(([0], np.cumsum(np.bincount(speaker_sents, minlength=num_sentences))))
+    sentence_cue_verb = {}
+    sentence_parataxis = {}
+    for sent in set(speaker_sents.tolist()):
+        sentence_cue_verb[sent] = int(any(token.lemma_ in cue_verbs for token in sentences[sent]))
+        sentence_parataxis[sent] = int(any(token.dep_ == 'parataxis' for token in sentences[sent]))
 
     # Boolean features
-
     def speaker_dep(dep):
-        for index in relative_token_indices:
-            if sentences[speaker_sent_index][index].dep_ == dep:
-                return 1
-        return 0
-
-    def speaker_with_cue_verb():
-        tokens = sentences[speaker_sent_index]
-        for token in tokens:
-            if token.lemma_ in cue_verbs:
-                return 1
-        return 0
-
-    def speaker_with_rs():
-        return int(speaker_sent_index in quotes)
-
-    def contains_parataxis():
-        tokens = sentences[speaker_sent_index]
-        for token in tokens:
-            if token.dep_ == 'parataxis':
-                return 1
-        return 0
-
-    def speaker_in_quotes():
-        return article.in_quotes['in_quotes'][speaker_first_token_index] == 1
-
-    def rs_before_speaker():
-        if len(quotes) == 0:
-            return 0
-        return int(quotes[0] < speaker_sent_index)
-
-    def rs_after_speaker():
-        if len(quotes) == 0:
-            return 0
-        return int(quotes[-1] > speaker_sent_index)
-
-    # Other features
-    other_speaker_sentences = [speaker_information(article, other_speaker)[0] for other_speaker in other_speakers]
-
-    def closest_rs_above():
-        if len(quotes) == 0 or quotes[0] >= speaker_sent_index:
-            return None
-        else:
-            i = -1
-            while i < len(quotes) - 1 and quotes[i + 1] < speaker_sent_index:
-                i += 1
-
-            return quotes[i]
-
-    index_closest_rs_above = closest_rs_above()
-
-    def dist_to_closest_rs_above():
-        if index_closest_rs_above:
-            return speaker_sent_index - index_closest_rs_above
-        else:
-            return 100
-
-    def closest_rs_below():
-        if len(quotes) == 0 or quotes[-1] <= speaker_sent_index:
-            return None
-        else:
-            i = len(quotes)
-            while i > 0 and quotes[i - 1] > speaker_sent_index:
-                i -= 1
-
-            return quotes[i]
-
-    index_closest_rs_below = closest_rs_below()
-
-    def dist_to_closest_rs_below():
-        if index_closest_rs_below:
-            return index_closest_rs_below - speaker_sent_index
-        else:
-            return 100
-
-    def speakers_between_quote_above():
-        if index_closest_rs_above:
-            other_speakers_between = 0
-            for other_sent_index in other_speaker_sentences:
-                if index_closest_rs_above <= other_sent_index < speaker_sent_index:
-                    other_speakers_between += 1
-            return other_speakers_between
-        else:
-            return 0
-
-    def speakers_between_quote_below():
-        if index_closest_rs_below:
-            other_speakers_between = 0
-            for other_sent_index in other_speaker_sentences:
-                if index_closest_rs_below >= other_sent_index > speaker_sent_index:
-                    other_speakers_between += 1
-            return other_speakers_between
-        else:
-            return 0
+        values = []
+        for speaker, sent, sent_start in zip(speakers, speaker_sents, sent_starts):
+            tokens = sentences[sent]
+            values.append(int(any(tokens[i - sent_start].dep_ == dep
+                                  for i in range(speaker['start'], speaker['end'] + 1))))
+        return np.array(values, dtype=np.int64)
+
+    speaker_with_cue_verb = np.array([sentence_cue_verb[sent] for sent in speaker_sents], dtype=np.int64)
+    speaker_with_rs = quote_sentences[speaker_sents]
+    contains_parataxis = np.array([sentence_parataxis[sent] for sent in speaker_sents], dtype=np.int64)
+    speaker_in_quotes = np.array([int(in_quotes[sent_start] == 1) for sent_start in sent_starts], dtype=np.int64)
+
+    has_quotes = len(quotes) > 0
+    rs_before_speaker = (quotes[0] < speaker_sents) if has_quotes else np.zeros(num_speakers, dtype=bool)
+    rs_after_speaker = (quotes[-1] > speaker_sents) if has_quotes else np.zeros(num_speakers, dtype=bool)
+
+    # Closest reported speech above and below each speaker, 0 if there is none
+    above_positions = np.searchsorted(quotes, speaker_sents, side='left')
+    below_positions = np.searchsorted(quotes, speaker_sents, side='right')
+    closest_rs_above = np.zeros(num_speakers, dtype=np.int64)
+    closest_rs_below = np.zeros(num_speakers, dtype=np.int64)
+    if has_quotes:
+        closest_rs_above = np.where(above_positions > 0, quotes[np.maximum(above_positions - 1, 0)], 0)
+        closest_rs_below = np.where(below_positions < len(quotes),
+                                    quotes[np.minimum(below_positions, len(quotes) - 1)], 0)
+    # A reported speech in the first sentence is the same as no reported speech
+    has_rs_above = closest_rs_above != 0
+    has_rs_below = closest_rs_below != 0
+
+    dist_to_closest_rs_above = np.where(has_rs_above, speaker_sents - closest_rs_above, 100)
+    dist_to_closest_rs_below = np.where(has_rs_below, closest_rs_below - speaker_sents, 100)
+
+    # The speaker itself is never in these windows, as they don't contain its sentence
+    speakers_between_quote_above = np.where(
+        has_rs_above, window_counts(speaker_prefix_sums, closest_rs_above, speaker_sents - 1), 0)
+    speakers_between_quote_below = np.where(
+        has_rs_below, window_counts(speaker_prefix_sums, speaker_sents + 1, closest_rs_below), 0)
 
     def quotes_n_above(n):
-        if len(quotes) == 0 or quotes[0] >= speaker_sent_index:
-            return 0
-
-        quotes_n_above_speak = 0
-        i = 0
-        while i < len(quotes) and quotes[i] < speaker_sent_index:
-            if 0 < speaker_sent_index - quotes[i] <= n:
-                quotes_n_above_speak += 1
-            i += 1
-        return quotes_n_above_speak
+        return window_counts(quote_prefix_sums, speaker_sents - n, speaker_sents - 1)
 
     def quotes_n_below(n):
-        if len(quotes) == 0 or quotes[-1] <= speaker_sent_index:
-            return 0
-
-        quotes_n_below_speak = 0
-        i = len(quotes) - 1
-        while i >= 0 and quotes[i] > speaker_sent_index:
-            if 0 < quotes[i] - speaker_sent_index <= n:
-                quotes_n_below_speak += 1
-            i -= 1
-        return quotes_n_below_speak
+        return window_counts(quote_prefix_sums, speaker_sents + 1, speaker_sents + n)
+
+    # distances[i, j]: number of sentences from speaker i to speaker j
+    distances = speaker_sents[np.newaxis, :] - speaker_sents[:, np.newaxis]
+    others = ~np.eye(num_speakers, dtype=bool)
+    positions = np.arange(num_speakers)
+    # The other speakers are scanned from the start of the list until one isn't above the speaker
+    not_above = others & (distances >= 0)
+    first_not_above = np.where(not_above.any(axis=1), not_above.argmax(axis=1), num_speakers)
+    scanned_above = others & (positions[np.newaxis, :] < first_not_above[:, np.newaxis])
+    # The other speakers are scanned from the end of the list until one isn't below the speaker
+    not_below = others & (distances <= 0)
+    last_not_below = np.where(not_below.any(axis=1), num_speakers - 1 - not_below[:, ::-1].argmax(axis=1), -1)
+    scanned_below = others & (positions[np.newaxis, :] > last_not_below[:, np.newaxis])
 
     def speakers_n_above(n):
-        if len(other_speaker_sentences) == 0 or other_speaker_sentences[0] >= speaker_sent_index:
-            return 0
-
-        speakers_n_above_speak = 0
-        i = 0
-        while i < len(other_speaker_sentences) and other_speaker_sentences[i] < speaker_sent_index:
-            if 0 < speaker_sent_index - other_speaker_sentences[i] <= n:
-                speakers_n_above_speak += 1
-            i += 1
-        return speakers_n_above_speak
+        return (scanned_above & (distances < 0) & (distances >= -n)).sum(axis=1)
 
     def speakers_n_below(n):
-        if len(other_speaker_sentences) == 0 or other_speaker_sentences[-1] <= speaker_sent_index:
-            return 0
-
-        speakers_n_below_speak = 0
-        i = len(other_speaker_sentences) - 1
-        while i >= 0 and other_speaker_sentences[i] > speaker_sent_index:
-            if 0 < other_speaker_sentences[i] - speaker_sent_index <= n:
-                speakers_n_below_speak += 1
-            i -= 1
-        return speakers_n_below_speak
-
-    return np.array([
+        return (scanned_below & (distances > 0) & (distances <= n)).sum(axis=1)
+
+    return np.column_stack([
         speaker_dep('nsubj'),
         speaker_dep('obj'),
-        speaker_with_cue_verb(),
-        speaker_with_rs(),
-        contains_parataxis(),
-        speaker_in_quotes(),
-        rs_before_speaker(),
-        rs_after_speaker(),
-        dist_to_closest_rs_above(),
-        dist_to_closest_rs_below(),
-        speakers_between_quote_above(),
-        speakers_between_quote_below(),
+        speaker_with_cue_verb,
+        speaker_with_rs,
+        contains_parataxis,
+        speaker_in_quotes,
+        rs_before_speaker,
+        rs_after_speaker,
+        dist_to_closest_rs_above,
+        dist_to_closest_rs_below,
+        speakers_between_quote_above,
+        speakers_between_quote_below,
         quotes_n_above(3),
         quotes_n_below(3),
         quotes_n_above(6),
@@ -213,37 +199,58 @@ def attribution_features_baseline(article, sentences, quotes, speaker, other_spe
         speakers_n_below(3),
         speakers_n_above(6),
         speakers_n_below(6),
-    ])
+    ]).astype(np.int64)
 
 
-def attribution_features_baseline_no_db(sentence_indices, in_quotes, sentences, quotes, speaker, other_speakers,
-                                        cue_verbs):
+def article_attribution_features_baseline(article, sentences, quotes, speakers, cue_verbs):
     """
-    First feature extraction model for author prediction. Extracts the following features for a named entity.
+    Extracts the features of attribution_features_baseline_batch for every named entity in an article.
 
-    Boolean features:
-        * Whether or not the speaker is the subject of the sentence
-        * Whether or not the speaker is the object of the sentence
-        * Whether or not the speaker is in a sentence containing a cue verb
-        * Whether or not the speaker is in a sentence containing a reported speech
-        * Whether or not the speaker is in a sentence containing a parataxis
-        * Whether or not the speaker is between quotation marks
-        * Whether there is any reported speech above the speaker
-        * Whether there is any reported speech below the speaker
+    :param article: models.Article
+        The article from which the quotes and speakers are taken.
+    :param sentences: list(spaCy.Doc)
+        the spaCy.Doc for each sentence in the article.
+    :param quotes: list(int)
+        The indices of the sentences that are quotes in the article, in increasing order.
+    :param speakers: list(dict)
+        The speakers in the article. Each has keys 'name', 'full_name', 'start', 'end', as described in the database.
+    :param cue_verbs: list(string).
+        The list of all "cue verbs", which are verbs that often introduce reported speech.
+    :return: np.array
+        The features extracted for each speaker, of shape (len(speakers), NUM_FEATURES).
+    """
+    return attribution_features_baseline_batch(article.sentences['sentences'], article.in_quotes['in_quotes'],
+                                               sentences, quotes, speakers, cue_verbs)
 
-    Other features:
-        * Number of sentences between the speaker and the closest reported speech sentence above it. 100 if none.
-        * Number of sentences between the speaker and the closest reported speech sentence below it. 100 if none.
-        * Number of other speakers between it and the closest quote above it.
-        * Number of other speakers between it and the closest quote below it.
-        * Number of quotes within 3 sentences above it
-        * Number of quotes within 3 sentences below it
-        * Number of quotes within 6 sentences above it
-        * Number of quotes within 6 sentences below it
-        * Number of other speakers within 3 sentences above it
-        * Number of other speakers within 3 sentences below it
-        * Number of other speakers within 6 sentences above it
-        * Number of other speakers within 6 sentences below it
+
+def attribution_features_baseline(article, sentences, quotes, speaker, other_speakers, cue_verbs):
+    """
+    First feature extraction model for author prediction. Extracts the features of
+    attribution_features_baseline_batch for a single named entity.
+
+    :param article: models.Article
+        The article from which the quote and speakers are taken.
+    :param sentences: list(spaCy.Doc)
+        the spaCy.Doc for each sentence in the article.
+    :param quotes: list(int)
+        The indices of other sentences that are quotes in the article.
+    :param speaker: dict.
+        The speaker. Has keys 'name', 'full_name', 'start', 'end', as described in the database.
+    :param other_speakers: list(dict)
+        The list of other speakers in the article.
+    :param cue_verbs: list(string).
+        The sentence to extract features from.
+    :return: np.array
+        The features extracted
+    """
+    return article_attribution_features_baseline(article, sentences, quotes, [speaker] + other_speakers, cue_verbs)[0]
+
+
+def attribution_features_baseline_no_db(sentence_indices, in_quotes, sentences, quotes, speaker, other_speakers,
+                                        cue_verbs):
+    """
+    First feature extraction model for author prediction. Extracts the features of
+    attribution_features_baseline_batch for a single named entity.
 
     :param sentence_indices: list(int)
         The index of the first token of each sentence in the article, as in article.sentences['sentences']
@@ -263,174 +270,5 @@ def attribution_features_baseline_no_db(sentence_indices, in_quotes, sentences,
     :return: np.array
         The features extracted
     """
-    speaker_sent_index, speaker_first_token_index, relative_token_indices =\
-        speaker_information_no_db(sentence_indices, speaker)
-
-    # Boolean features
-
-    def speaker_dep(dep):
-        for index in relative_token_indices:
-            if sentences[speaker_sent_index][index].dep_ == dep:
-                return 1
-        return 0
-
-    def speaker_with_cue_verb():
-        tokens = sentences[speaker_sent_index]
-        for token in tokens:
-            if token.lemma_ in cue_verbs:
-                return 1
-        return 0
-
-    def speaker_with_rs():
-        return int(speaker_sent_index in quotes)
-
-    def contains_parataxis():
-        tokens = sentences[speaker_sent_index]
-        for token in tokens:
-            if token.dep_ == 'parataxis':
-                return 1
-        return 0
-
-    def speaker_in_quotes():
-        return in_quotes[speaker_first_token_index] == 1
-
-    def rs_before_speaker():
-        if len(quotes) == 0:
-            return 0
-        return int(quotes[0] < speaker_sent_index)
-
-    def rs_after_speaker():
-        if len(quotes) == 0:
-            return 0
-        return int(quotes[-1] > speaker_sent_index)
-
-    # Other features
-    other_speaker_sentences = [speaker_information_no_db(sentence_indices, other_speaker)[0]
-                               for other_speaker in other_speakers]
-
-    def closest_rs_above():
-        if len(quotes) == 0 or quotes[0] >= speaker_sent_index:
-            return None
-        else:
-            i = -1
-            while i < len(quotes) - 1 and quotes[i + 1] < speaker_sent_index:
-                i += 1
-
-            return quotes[i]
-
-    index_closest_rs_above = closest_rs_above()
-
-    def dist_to_closest_rs_above():
-        if index_closest_rs_above:
-            return speaker_sent_index - index_closest_rs_above
-        else:
-            return 100
-
-    def closest_rs_below():
-        if len(quotes) == 0 or quotes[-1] <= speaker_sent_index:
-            return None
-        else:
-            i = len(quotes)
-            while i > 0 and quotes[i - 1] > speaker_sent_index:
-                i -= 1
-
-            return quotes[i]
-
-    index_closest_rs_below = closest_rs_below()
-
-    def dist_to_closest_rs_below():
-        if index_closest_rs_below:
-            return index_closest_rs_below - speaker_sent_index
-        else:
-            return 100
-
-    def speakers_between_quote_above():
-        if index_closest_rs_above:
-            other_speakers_between = 0
-            for other_sent_index in other_speaker_sentences:
-                if index_closest_rs_above <= other_sent_index < speaker_sent_index:
-                    other_speakers_between += 1
-            return other_speakers_between
-        else:
-            return 0
-
-    def speakers_between_quote_below():
-        if index_closest_rs_below:
-            other_speakers_between = 0
-            for other_sent_index in other_speaker_sentences:
-                if index_closest_rs_below >= other_sent_index > speaker_sent_index:
-                    other_speakers_between += 1
-            return other_speakers_between
-        else:
-            return 0
-
-    def quotes_n_above(n):
-        if len(quotes) == 0 or quotes[0] >= speaker_sent_index:
-            return 0
-
-        quotes_n_above_speak = 0
-        i = 0
-        while i < len(quotes) and quotes[i] < speaker_sent_index:
-            if 0 < speaker_sent_index - quotes[i] <= n:
-                quotes_n_above_speak += 1
-            i += 1
-        return quotes_n_above_speak
-
-    def quotes_n_below(n):
-        if len(quotes) == 0 or quotes[-1] <= speaker_sent_index:
-            return 0
-
-        quotes_n_below_speak = 0
-        i = len(quotes) - 1
-        while i >= 0 and quotes[i] > speaker_sent_index:
-            if 0 < quotes[i] - speaker_sent_index <= n:
-                quotes_n_below_speak += 1
-            i -= 1
-        return quotes_n_below_speak
-
-    def speakers_n_above(n):
-        if len(other_speaker_sentences) == 0 or other_speaker_sentences[0] >= speaker_sent_index:
-            return 0
-
-        speakers_n_above_speak = 0
-        i = 0
-        while i < len(other_speaker_sentences) and other_speaker_sentences[i] < speaker_sent_index:
-            if 0 < speaker_sent_index - other_speaker_sentences[i] <= n:
-                speakers_n_above_speak += 1
-            i += 1
-        return speakers_n_above_speak
-
-    def speakers_n_below(n):
-        if len(other_speaker_sentences) == 0 or other_speaker_sentences[-1] <= speaker_sent_index:
-            return 0
-
-        speakers_n_below_speak = 0
-        i = len(other_speaker_sentences) - 1
-        while i >= 0 and other_speaker_sentences[i] > speaker_sent_index:
-            if 0 < other_speaker_sentences[i] - speaker_sent_index <= n:
-                speakers_n_below_speak += 1
-            i -= 1
-        return speakers_n_below_speak
-
-    return np.array([
-        speaker_dep('nsubj'),
-        speaker_dep('obj'),
-        speaker_with_cue_verb(),
-        speaker_with_rs(),
-        contains_parataxis(),
-        speaker_in_quotes(),
-        rs_before_speaker(),
-        rs_after_speaker(),
-        dist_to_closest_rs_above(),
-        dist_to_closest_rs_below(),
-        speakers_between_quote_above(),
-        speakers_between_quote_below(),
-        quotes_n_above(3),
-        quotes_n_below(3),
-        quotes_n_above(6),
-        quotes_n_below(6),
-        speakers_n_above(3),
-        speakers_n_below(3),
-        speakers_n_above(6),
-        speakers_n_below(6),
-    ])
+    return attribution_features_baseline_batch(sentence_indices, in_quotes, sentences, quotes,
+                                               [speaker] + other_speakers, cue_verbs)[0]
@@ -2,7 +2,7 @@ import numpy as np
 from sklearn.metrics import precision_recall_fscore_support
 
 from backend.db_management import load_labeled_articles, load_quote_authors
-from backend.helpers import aggregate_label
+from backend.helpers import aggregate_articles_labels
 from backend.ml.helpers import find_true_author_index, extract_speaker_names, evaluate_speaker_extraction
 from backend.ml.scoring import Results
 
@@ -80,11 +80,12 @@ def baseline_quote_detection(nlp):
     y = []
     y_pred = []
     train_articles, train_sentences, _, _ = load_labeled_articles(nlp)
+    articles_labels = aggregate_articles_labels(train_articles)
     for index, article in enumerate(train_articles):
         article_sentences = train_sentences[index]
         sentence_start = 0
         for sentence_index, end in enumerate(article.sentences['sentences']):
-            sentence_labels, sentence_authors, _ = aggregate_label(article, sentence_index)
+            sentence_labels, sentence_authors, _ = articles_labels[article.id][sentence_index]
             true_value = int(sum(sentence_labels) > 0)
             y.append(true_value)
 
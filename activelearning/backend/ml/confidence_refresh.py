@@ -0,0 +1,244 @@
+import json
+import os
+import time
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from backend.db_management import iter_unlabeled_sentences
+from backend.helpers import rebuild_pending_tasks
+from backend.ml.feature_expansion import PolynomialExpansion
+from backend.ml.helpers import classifier_version
+from backend.ml.quote_detection_feature_extraction import feature_extraction_batch, NUM_FEATURES
+from backend.models import Article, UserLabel
+
+"""
+Recomputes the confidence of a trained quote detection model in its predictions for the sentences of all articles that
+aren't fully labeled, so that the hardest sentences are given to users to label first.
+
+Each article is stamped with the version of the model that computed its confidences. The time of the last refresh is
+stored, so that an incremental refresh only rescores the articles that received new labels since then, and the articles
+whose confidences were computed by another model.
+"""
+
+
+""" The number of articles updated in the database at once. """
+UPDATE_CHUNK_SIZE = 500
+
+
+""" The file in which the state of the last refresh is stored. """
+REFRESH_STATE_PATH = 'data/confidence_refresh.json'
+
+
+def scores_to_confidences(scores, proba):
+    """
+    Maps the output of a quote detection model for each sentence to the confidence it has in its prediction, and to
+    the prediction. The mapping only depends on the score of each sentence, so that confidences computed in different
+    refreshes can be compared.
+
+    :param scores: np.ndarray
+        The probability that each sentence contains a quote (if proba), or its distance to the separating hyperplane.
+    :param proba: boolean
+        Whether the scores are probability estimates.
+    :return: np.ndarray, np.ndarray
+        The confidence for each sentence, and the prediction in {0, 1} for each sentence.
+    """
+    if proba:
+        # Map the probability that a sentence is a quote to a confidence:
+        #   * probability is 0.5: model has no clue, confidence 0
+        #   * probability is 0 or 1: model knows, confidence 1
+        return 2 * np.abs(0.5 - scores), np.round(scores).astype(int)
+    # When using hinge loss, the distance to the separating hyperplane is mapped to the confidence a logistic model with
+    # the same decision function would have, which is 2 * |sigmoid(distance) - 0.5|
+    return np.tanh(np.abs(scores) / 2), (scores > 0).astype(int)
+
+
+def refresh_confidences(trained_model, nlp, cue_verbs, proba, exp_degree=2, article_ids=None, model_version='',
+                        chunk_size=UPDATE_CHUNK_SIZE):
+    """
+    Predicts whether each sentence of all articles that aren't fully labeled contains a quote, and stores the model's
+    confidence in its predictions in the database. The articles are streamed while their features are extracted,
+    predictions are made for all sentences at once, and the articles are locked and updated in chunks.
+
+    :param trained_model: sklearn.linear_model.SGDClassifier
+        A trained model to predict probabilities for sentences.
+    :param nlp: spaCy.Language
+        The language model used to tokenize the text.
+    :param cue_verbs: list(string)
+        The list of all "cue verbs", which are verbs that often introduce reported speech.
+    :param proba: boolean
+        Whether or not to use probability estimates.
+    :param exp_degree: int
+        The degree of the polynomial expansion of the features.
+    :param article_ids: list(int)
+        If defined, only the confidences of these articles are refreshed.
+    :param model_version: string
+        The version of the model, stored in each refreshed article.
+    :param chunk_size: int
+        The number of articles updated in the database at once.
+    :return: dict(string, float), int
+        The time taken by each stage in seconds, and the number of articles refreshed.
+    """
+    timings = {}
+
+    # Features of the sentences of all articles, keeping only the values needed to update each article
+    start = time.perf_counter()
+    article_features = []
+    articles = []
+    for article, sentence_docs, in_quotes in iter_unlabeled_sentences(nlp, article_ids):
+        article_features.append(feature_extraction_batch(sentence_docs, cue_verbs, in_quotes))
+        articles.append(article.id)
+    timings['features'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    poly = PolynomialExpansion(exp_degree, interaction_only=True, include_bias=True)
+    X = poly.transform(np.concatenate(article_features) if len(article_features) > 0
+                       else np.zeros((0, NUM_FEATURES)))
+    timings['expansion'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    scores = np.zeros(0)
+    if X.shape[0] > 0:
+        scores = trained_model.predict_proba(X)[:, 1] if proba else trained_model.decision_function(X)
+    timings['prediction'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    confidences, predictions = scores_to_confidences(scores, proba)
+    article_ends = np.cumsum([len(features) for features in article_features])[:-1]
+    article_scores = dict(zip(articles, zip(np.split(confidences, article_ends), np.split(predictions, article_ends))))
+    timings['confidences'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(0, len(articles), chunk_size):
+        chunk = articles[i:i + chunk_size]
+        with transaction.atomic():
+            # Locks the articles and reads their labels again, so that labels added since the articles were streamed
+            # aren't overwritten. The articles are locked in the order of their ids, like in every chunk.
+            locked = Article.objects\
+                .select_for_update()\
+                .defer('parsed', 'text', 'tokens', 'people')\
+                .filter(id__in=chunk)\
+                .order_by('id')
+            updated = []
+            rejected = []
+            for article in locked:
+                article_confidences, article_predictions = article_scores[article.id]
+                # For sentences in the article that are fully labeled, the confidence is 1
+                new_confidences = np.maximum(article.labeled['labeled'], article_confidences).tolist()
+                # Same validation as change_confidence
+                if len(new_confidences) == 0 or min(new_confidences) < 0 or max(new_confidences) > 1:
+                    rejected.append(article.id)
+                    continue
+                article.confidence['confidence'] = new_confidences
+                article.confidence['predictions'] = article_predictions.tolist()
+                article.confidence['min_confidence'] = min(new_confidences)
+                article.min_confidence = article.confidence['min_confidence']
+                article.confidence_version = model_version
+                updated.append(article)
+            Article.objects.bulk_update(updated, ['confidence', 'min_confidence', 'confidence_version'])
+            # The tasks given to users depend on the confidences
+            rebuild_pending_tasks(updated)
+            # The confidences of the other articles are kept, but they were still computed by this model
+            Article.objects.filter(id__in=rejected).update(confidence_version=model_version)
+    timings['update'] = time.perf_counter() - start
+    return timings, len(articles)
+
+
+def load_refresh_state(path=REFRESH_STATE_PATH):
+    """
+    Loads the state of the last refresh of the confidences.
+
+    :param path: string
+        The path of the file in which the state is stored.
+    :return: dict
+        The 'watermark' (the time at which the last refresh started) and the 'model_version' used in the last refresh,
+        or None if there wasn't any.
+    """
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'r') as f:
+        state = json.load(f)
+    state['watermark'] = parse_datetime(state['watermark'])
+    return state
+
+
+def save_refresh_state(watermark, model_version, path=REFRESH_STATE_PATH):
+    """
+    Saves the state of a refresh of the confidences.
+
+    :param watermark: datetime.datetime
+        The time at which the refresh started. Labels created after it weren't taken into account.
+    :param model_version: string
+        The version of the model used.
+    :param path: string
+        The path of the file in which the state is stored.
+    """
+    # Writes to a temporary file first, so that a refresh reading the state never sees a partially written file
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump({
+            'watermark': watermark.isoformat(),
+            'model_version': model_version,
+        }, f)
+    os.replace(temp_path, path)
+
+
+def stale_article_ids(model_version, since):
+    """
+    Finds the articles that aren't fully labeled and whose confidences need to be recomputed.
+
+    :param model_version: string
+        The version of the current model.
+    :param since: datetime.datetime
+        The time of the last refresh.
+    :return: set(int)
+        The ids of the articles whose confidences were computed by another model, or that received labels since the
+        last refresh.
+    """
+    stale = Article.objects\
+        .filter(fully_labeled=0)\
+        .exclude(confidence_version=model_version)\
+        .values_list('id', flat=True)
+    labeled = UserLabel.objects\
+        .filter(created_at__gte=since, article__fully_labeled=0)\
+        .values_list('article_id', flat=True)\
+        .distinct()
+    return set(stale) | set(labeled)
+
+
+def update_confidences(trained_model, nlp, cue_verbs, exp_degree=2, incremental=False, state_path=REFRESH_STATE_PATH):
+    """
+    Refreshes the confidences of the articles that aren't fully labeled, and stores the state of the refresh.
+
+    :param trained_model: sklearn.linear_model.SGDClassifier
+        A trained model to predict probabilities for sentences.
+    :param nlp: spaCy.Language
+        The language model used to tokenize the text.
+    :param cue_verbs: list(string)
+        The list of all "cue verbs", which are verbs that often introduce reported speech.
+    :param exp_degree: int
+        The degree of the polynomial expansion of the features.
+    :param incremental: boolean
+        If true and a previous refresh was done, only the articles with stale confidences are refreshed. Otherwise, all
+        articles are refreshed.
+    :param state_path: string
+        The path of the file in which the state of the refresh is stored.
+    :return: dict(string, float), int
+        The time taken by each stage in seconds, and the number of articles refreshed.
+    """
+    # Labels created while the refresh is running will be used in the next one
+    watermark = timezone.now()
+    model_version = classifier_version(trained_model)
+    proba = trained_model.loss == 'log'
+
+    article_ids = None
+    state = load_refresh_state(state_path) if incremental else None
+    if state is not None:
+        article_ids = stale_article_ids(model_version, state['watermark'])
+
+    timings, refreshed = refresh_confidences(trained_model, nlp, cue_verbs, proba, exp_degree, article_ids,
+                                             model_version)
+    save_refresh_state(watermark, model_version, state_path)
+    return timings, refreshed
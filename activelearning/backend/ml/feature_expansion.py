@@ -0,0 +1,77 @@
+from itertools import chain, combinations, combinations_with_replacement
+
+import numpy as np
+
+"""
+Polynomial feature expansion computed on whole feature matrices.
+"""
+
+
+class PolynomialExpansion:
+    """
+    Expands features into polynomial features, in the same way as sklearn.preprocessing.PolynomialFeatures.
+
+    The models are trained on features where each group of `base_dimensionality` consecutive features is expanded
+    independently (historically with `poly.fit_transform(features.reshape((-1, 1))).reshape((-1,))`). The combinations
+    of indices are computed once, and the expansion is applied to all the rows of a matrix at once. The values are
+    identical to the ones computed by PolynomialFeatures, so models trained on them can still be used.
+    """
+
+    def __init__(self, degree, interaction_only=True, include_bias=True, base_dimensionality=1):
+        """
+        Initializes the expansion.
+
+        :param degree: int
+            The maximal degree of the polynomial features.
+        :param interaction_only: boolean
+            If true, only products of distinct features are computed.
+        :param include_bias: boolean
+            If true, a bias column (feature in which all polynomial powers are zero) is added.
+        :param base_dimensionality: int
+            The number of consecutive features that are expanded together.
+        """
+        self.degree = degree
+        self.interaction_only = interaction_only
+        self.include_bias = include_bias
+        self.base_dimensionality = base_dimensionality
+
+        # Same order as sklearn.preprocessing.PolynomialFeatures
+        comb = combinations if interaction_only else combinations_with_replacement
+        start = int(not include_bias)
+        self.combinations = list(chain.from_iterable(
+            comb(range(base_dimensionality), i) for i in range(start, degree + 1)
+        ))
+        self.n_output_features = len(self.combinations)
+
+    def transform(self, X):
+        """
+        Expands the features of each row of a matrix.
+
+        :param X: np.ndarray
+            The features to expand, of shape (n_samples, n_features), or of shape (n_features,) for a single sample.
+            n_features needs to be a multiple of the base dimensionality.
+        :return: np.ndarray
+            The expanded features, of shape (n_samples, n_features / base_dimensionality * n_output_features), or of
+            shape (n_features / base_dimensionality * n_output_features,) for a single sample.
+        """
+        X = np.asarray(X)
+        if X.dtype not in (np.float64, np.float32, np.float16):
+            X = X.astype(np.float64)
+        single_sample = X.ndim == 1
+        n_samples = 1 if single_sample else X.shape[0]
+        n_groups = X.shape[-1] // self.base_dimensionality
+        groups = X.reshape((n_samples, n_groups, self.base_dimensionality))
+
+        expanded = np.empty(groups.shape[:2] + (self.n_output_features,), dtype=X.dtype)
+        for index, combination in enumerate(self.combinations):
+            if len(combination) == 0:
+                expanded[:, :, index] = 1
+            else:
+                # Products are taken from left to right, like numpy.prod
+                expanded[:, :, index] = groups[:, :, combination[0]]
+                for feature in combination[1:]:
+                    expanded[:, :, index] *= groups[:, :, feature]
+
+        if single_sample:
+            return expanded.reshape((-1,))
+        return expanded.reshape((n_samples, n_groups * self.n_output_features))
@@ -0,0 +1,166 @@
+import json
+import os
+
+import numpy as np
+from django.db.models import Count, Max
+from joblib import hash as joblib_hash
+
+from backend.models import Article, UserLabel
+
+"""
+Stores the feature matrices of the training datasets on disk, so that they are only extracted again when the labeled
+articles or the feature extraction change.
+
+Each dataset is stored as two .npy files (the features and the labels) and a JSON manifest containing the row range of
+each article, the version of the feature extraction and the version of the labeled corpus the features were extracted
+from. The features are opened as memory-mapped arrays, so they are only read from disk when they are used.
+"""
+
+
+""" The directory in which the datasets are stored. """
+FEATURE_STORE_PATH = 'data/features'
+
+
+""" Incremented whenever the feature extraction changes, so that the features stored previously are extracted again. """
+FEATURE_EXTRACTOR_VERSION = 1
+
+
+def feature_version(name, cue_verbs, poly=None, **parameters):
+    """
+    Computes the version of the features extracted for a dataset.
+
+    :param name: string
+        The name of the dataset.
+    :param cue_verbs: list(string)
+        The list of all "cue verbs", which are verbs that often introduce reported speech.
+    :param poly: backend.ml.feature_expansion.PolynomialExpansion
+        If defined, the expansion used to expand the features.
+    :param parameters: dict
+        Any other parameter of the feature extraction.
+    :return: string
+        The version of the features.
+    """
+    expansion = None
+    if poly is not None:
+        expansion = (poly.degree, poly.interaction_only, poly.include_bias, poly.base_dimensionality)
+    return joblib_hash((FEATURE_EXTRACTOR_VERSION, name, sorted(cue_verbs), expansion, sorted(parameters.items())))
+
+
+def corpus_version():
+    """
+    Computes the version of the labeled corpus, which changes whenever an article becomes fully labeled or a fully
+    labeled article receives a new label.
+
+    :return: string
+        The version of the corpus.
+    """
+    article_ids = sorted(Article.objects.filter(fully_labeled=1).values_list('id', flat=True))
+    labels = UserLabel.objects.filter(article__fully_labeled=1).aggregate(count=Count('id'), last=Max('id'))
+    return joblib_hash((article_ids, labels['count'], labels['last']))
+
+
+class FeatureStore:
+    """ The features, labels and article row ranges of a dataset, stored on disk """
+
+    def __init__(self, name, directory=FEATURE_STORE_PATH):
+        """
+        Initializes the store.
+
+        :param name: string
+            The name of the dataset.
+        :param directory: string
+            The directory in which the dataset is stored.
+        """
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, f'{name}.json')
+        self.features_path = os.path.join(directory, f'{name}_features.npy')
+        self.labels_path = os.path.join(directory, f'{name}_labels.npy')
+
+    def load(self, version, corpus):
+        """
+        Opens the stored dataset, if it was extracted with the same version of the features from the same corpus.
+
+        :param version: string
+            The version of the features, as returned by feature_version.
+        :param corpus: string
+            The version of the corpus, as returned by corpus_version.
+        :return: Optional(np.memmap, np.array(int), dict(int, tuple))
+            The memory-mapped features, the labels and the row ranges of each article (in the order in which they were
+            stored), or None if the dataset needs to be extracted again.
+        """
+        if not os.path.isfile(self.manifest_path):
+            return None
+        with open(self.manifest_path, 'r') as f:
+            manifest = json.load(f)
+        if manifest['feature_version'] != version or manifest['corpus_version'] != corpus:
+            return None
+        features = np.load(self.features_path, mmap_mode='r')
+        labels = np.load(self.labels_path)
+        article_features = {int(article_id): tuple(rows) for article_id, rows in manifest['articles']}
+        return features, labels, article_features
+
+    def save(self, version, corpus, features, labels, article_features):
+        """
+        Stores a dataset, replacing the one previously stored.
+
+        :param version: string
+            The version of the features, as returned by feature_version.
+        :param corpus: string
+            The version of the corpus, as returned by corpus_version.
+        :param features: np.array
+            The feature matrix.
+        :param labels: np.array(int)
+            The labels.
+        :param article_features: dict(int, tuple)
+            The first and last row of each article, followed by any other value stored for the article.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        # The manifest is written last, so that a store being replaced is never opened
+        if os.path.isfile(self.manifest_path):
+            os.remove(self.manifest_path)
+        self._replace(self.features_path, lambda f: np.save(f, features))
+        self._replace(self.labels_path, lambda f: np.save(f, labels))
+        manifest = {
+            'feature_version': version,
+            'corpus_version': corpus,
+            'shape': list(features.shape),
+            # Stored as a list, to keep the order of the articles
+            'articles': [[article_id, list(rows)] for article_id, rows in article_features.items()],
+        }
+        self._replace(self.manifest_path, lambda f: f.write(json.dumps(manifest).encode('utf-8')))
+
+    @staticmethod
+    def _replace(path, write):
+        """ Writes a file through a temporary file, so that it's never partially written. """
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            write(f)
+        os.replace(temp_path, path)
+
+
+def load_dataset(name, dataset_class, extract, version, directory=FEATURE_STORE_PATH):
+    """
+    Opens a stored dataset, or extracts its features and stores them if the stored ones are outdated.
+
+    :param name: string
+        The name of the dataset.
+    :param dataset_class: class
+        The subclass of ArrayDataset of the dataset.
+    :param extract: function
+        The method, without parameters, that extracts the features and returns the dataset.
+    :param version: string
+        The version of the features, as returned by feature_version.
+    :param directory: string
+        The directory in which the dataset is stored.
+    :return: ArrayDataset, boolean
+        The dataset, whose features are memory-mapped, and whether it was loaded from the store.
+    """
+    store = FeatureStore(name, directory)
+    corpus = corpus_version()
+    stored = store.load(version, corpus)
+    loaded = stored is not None
+    if not loaded:
+        dataset = extract()
+        store.save(version, corpus, dataset.features, dataset.labels, dataset.article_features)
+        stored = store.load(version, corpus)
+    return dataset_class.from_arrays(*stored), loaded
@@ -1,5 +1,8 @@
+import os
+import threading
+
 import numpy as np
-from joblib import dump, load
+from joblib import dump, load, hash as joblib_hash
 
 
 def find_true_author_index(true_author, mentions):
@@ -148,12 +151,17 @@ def balance_classes(X, y):
 
 def save_model(classifier, filepath):
     """
+    Saves a trained model. It is first written to a temporary file that then replaces the previous model, so that
+    processes loading the model while it is being saved never read a partially written file.
 
-    :param classifier:
-    :param filepath:
-    :return:
+    :param classifier: sklearn.linear_model.SGDClassifier
+        The trained model.
+    :param filepath: string
+        The path to the file in which to save the model.
     """
-    dump(classifier, filepath)
+    temp_path = f'{filepath}.{os.getpid()}.tmp'
+    dump(classifier, temp_path)
+    os.replace(temp_path, filepath)
 
 
 def load_model(filepath):
@@ -163,3 +171,85 @@ def load_model(filepath):
     :return:
     """
     return load(filepath)
+
+
+def classifier_version(classifier):
+    """
+    Computes a string identifying the weights of a trained model, which changes every time the model is retrained.
+
+    :param classifier: sklearn.linear_model.SGDClassifier
+        The trained model.
+    :return: string
+        The hash of the model.
+    """
+    return joblib_hash(classifier)
+
+
+class ModelRegistry:
+    """
+    Keeps the trained models in memory, so that each weights file is only read from disk once per process. A model is
+    reloaded when the modification time of its file changes, so that models retrained with `manage.py train` are used
+    without restarting the process.
+    """
+
+    def __init__(self):
+        # For each filepath, the modification time of the file when it was loaded and the model.
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def get(self, filepath):
+        """
+        Returns the model saved in a file, only loading it from disk if it isn't in memory or if the file changed since
+        it was loaded.
+
+        :param filepath: string
+            The path to the file containing the model.
+        :return: sklearn.linear_model.SGDClassifier
+            The model.
+        """
+        mtime = os.path.getmtime(filepath)
+        with self._lock:
+            cached = self._models.get(filepath)
+            if cached is None or cached[0] != mtime:
+                cached = (mtime, load_model(filepath))
+                self._models[filepath] = cached
+            return cached[1]
+
+    def version(self, filepath):
+        """
+        Returns the version of a model currently held in memory, which is the modification time of the file it was
+        loaded from.
+
+        :param filepath: string
+            The path to the file containing the model.
+        :return: float
+            The modification time of the file when the model was loaded, or None if it isn't loaded.
+        """
+        with self._lock:
+            cached = self._models.get(filepath)
+        if cached is None:
+            return None
+        return cached[0]
+
+    def clear(self):
+        """
+        Removes all models from memory.
+        """
+        with self._lock:
+            self._models = {}
+
+
+""" The models loaded by the current process. """
+model_registry = ModelRegistry()
+
+
+def load_cached_model(filepath):
+    """
+    Loads a model through the registry of models kept in memory by the current process.
+
+    :param filepath: string
+        The path to the file containing the model.
+    :return: sklearn.linear_model.SGDClassifier
+        The model.
+    """
+    return model_registry.get(filepath)
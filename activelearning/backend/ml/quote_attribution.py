@@ -1,9 +1,9 @@
 import numpy as np
 from sklearn.linear_model import SGDClassifier
 from sklearn.model_selection import KFold
-from sklearn.preprocessing import PolynomialFeatures
 
 from backend.db_management import load_labeled_articles, load_quote_authors
+from backend.ml.feature_expansion import PolynomialExpansion
 from backend.ml.helpers import extract_speaker_names, evaluate_speaker_extraction
 from backend.ml.quote_attribution_dataset import QuoteAttributionDataset, subset, subset_ovo, \
     attribution_loader
@@ -12,7 +12,7 @@ from backend.ml.scoring import Results
 from backend.ml.sgd import train, evaluate
 
 
-def load_data(nlp, cue_verbs, extraction_method, ovo, poly):
+def load_data(nlp, cue_verbs, extraction_method, ovo, poly, max_candidates=None):
     """
     Loads the datasets to perform quote attribution.
 
@@ -24,8 +24,10 @@ def load_data(nlp, cue_verbs, extraction_method, ovo, poly):
         The feature extraction method to use.
     :param ovo: boolean
         Whether to load the One vs One model or not.
-    :param poly: sklearn.preprocessing.PolynomialFeatures
+    :param poly: backend.ml.feature_expansion.PolynomialExpansion
         If defined, used to perform feature extraction.
+    :param max_candidates: int
+        For the One vs One model, if defined, the number of mentions closest to each quote that are candidate authors.
     :return: np.array(dict), np.array(int), QuoteAttributionDataset
         * Array of dicts containing training and test quotes, respectively. Keys:
             * 'article': models.Article, the article containing the quote
@@ -38,7 +40,7 @@ def load_data(nlp, cue_verbs, extraction_method, ovo, poly):
     quote_detection_dataset = QuoteDetectionDataset(train_articles, train_sentences, cue_verbs, poly)
     train_dicts, _ = load_quote_authors(nlp)
     quote_attribution_dataset = QuoteAttributionDataset(train_dicts, quote_detection_dataset, cue_verbs,
-                                                        extraction_method, ovo, poly)
+                                                        extraction_method, ovo, poly, max_candidates)
 
     return np.array(train_dicts), quote_attribution_dataset
 
@@ -82,36 +84,30 @@ def predict_quote_author_ovo(trained_model, quote_features, num_mentions, proba=
 
     :param trained_model: SGDClassifier
         The classifier to use to predict the author of the quote.
-    :param quote_features: list(np.array)
-        The features for each mention in the article.
+    :param quote_features: np.array
+        The features for each pair of candidate authors of the quote.
     :param num_mentions: int
-        The number of mentions in the article containing the quote.
+        The number of candidate authors of the quote.
     :param proba: boolean
         Whether or not to use probability estimates to predict the author.
     :return: int
-        The index of the predicted speaker in the mentions of the article.
+        The index of the predicted speaker in the candidates of the quote.
     """
-
-    mention_wins = num_mentions * [0]
-
-    for m1_index in range(num_mentions):
-        for m2_index in range(num_mentions):
-            if m1_index != m2_index:
-                m1_m2_features_index = m1_index * (num_mentions - 1) + m2_index - int(m1_index < m2_index)
-                m1_m2_features = quote_features[m1_m2_features_index]
-                if proba:
-                    prediction = trained_model.predict_proba(m1_m2_features.reshape((1, -1)))
-                    mention_wins[m1_index] += prediction[0, 0]
-                    mention_wins[m2_index] += prediction[0, 1]
-                    """
-                    prediction = trained_model.predict(m1_m2_features.reshape((1, -1)))
-                    mention_wins[m1_index] += 1 - prediction[0]
-                    mention_wins[m2_index] += prediction[0]
-                    """
-                else:
-                    confidence = trained_model.decision_function(m1_m2_features.reshape((1, -1)))
-                    mention_wins[m1_index] += (confidence[0] < 0)
-                    mention_wins[m2_index] += (confidence[0] > 0)
+    # The candidates of each pair, in the order of the features
+    first, second = np.nonzero(~np.eye(num_mentions, dtype=bool))
+    mention_wins = np.zeros(num_mentions)
+    if len(first) == 0:
+        return 0
+
+    # Predictions for all pairs at once
+    if proba:
+        prediction = trained_model.predict_proba(np.asarray(quote_features))
+        np.add.at(mention_wins, first, prediction[:, 0])
+        np.add.at(mention_wins, second, prediction[:, 1])
+    else:
+        confidence = trained_model.decision_function(np.asarray(quote_features))
+        np.add.at(mention_wins, first, confidence < 0)
+        np.add.at(mention_wins, second, confidence > 0)
 
     return np.argmax(mention_wins)
 
@@ -139,17 +135,11 @@ def predict_authors(trained_model, dataset, article, ovo=False, proba=False):
     for quote_id in range(num_quotes):
         quote_features, quote_labels = dataset.get_quote_mention_features(article.id, quote_id)
         if ovo:
-            true_speaker = -1
-            m_index = 0
-            while true_speaker == -1:
-                if quote_labels[m_index] == 0:
-                    true_speaker = 0
-                elif quote_labels[m_index] == 1:
-                    true_speaker = m_index
-                else:
-                    m_index += 1
+            # num_mentions is the number of candidates of each quote, which are indices of mentions in the article
+            candidates, true_speaker = dataset.get_quote_candidates(article.id, quote_id)
             true_speaker_indices.append(true_speaker)
-            predicted_speaker = predict_quote_author_ovo(trained_model, quote_features, num_mentions, proba)
+            predicted_candidate = predict_quote_author_ovo(trained_model, quote_features, num_mentions, proba)
+            predicted_speaker = int(candidates[predicted_candidate])
         else:
             true_speaker = -1
             for mention_index, label in enumerate(quote_labels):
@@ -168,7 +158,8 @@ def predict_authors(trained_model, dataset, article, ovo=False, proba=False):
     return true_speaker_indices, predicted_speaker_indices, precision, recall
 
 
-def evaluate_quote_attribution(loss, penalty, alpha, extraction_method, max_iter, nlp, cue_verbs, cv_folds=5, ovo=False):
+def evaluate_quote_attribution(loss, penalty, alpha, extraction_method, max_iter, nlp, cue_verbs, cv_folds=5, ovo=False,
+                               max_candidates=None):
     """
     Evaluates the quote attribution model, on the following metrics:
 
@@ -200,6 +191,9 @@ def evaluate_quote_attribution(loss, penalty, alpha, extraction_method, max_iter
         The number of cross-validation folds to perform.
     :param ovo: boolean
         Whether to load the One vs One model or not.
+    :param max_candidates: int
+        For the One vs One model, if defined, only the max_candidates mentions closest to each quote (and the weasel)
+        are candidate authors of the quote.
     :return: dict, dict
         * A dictionary for the training and test sets, containing the keys:
             * 'results': Result, The results for the model
@@ -209,8 +203,8 @@ def evaluate_quote_attribution(loss, penalty, alpha, extraction_method, max_iter
             * 'f1': float, The f1 score in article speaker extraction for the model
     """
     proba = loss == 'log'
-    poly = PolynomialFeatures(2, interaction_only=False, include_bias=True)
-    article_dicts, attribution_dataset = load_data(nlp, cue_verbs, extraction_method, ovo, poly)
+    poly = PolynomialExpansion(2, interaction_only=False, include_bias=True)
+    article_dicts, attribution_dataset = load_data(nlp, cue_verbs, extraction_method, ovo, poly, max_candidates)
 
     kf = KFold(n_splits=cv_folds)
 
@@ -1,7 +1,6 @@
 import numpy as np
-from torch.utils.data import Dataset, DataLoader, Subset
-from torch.utils.data.sampler import WeightedRandomSampler
 
+from backend.ml.array_dataset import ArrayDataset, ArrayLoader, article_rows, balanced_weights, subset_rows
 from backend.ml.helpers import find_true_author_index
 from backend.ml.quote_attribution_feature_extraction import *
 
@@ -21,7 +20,7 @@ def parse_article(article_dict, quote_dataset, extraction_method, cue_verbs, pol
         The list of all "cue verbs", which are verbs that often introduce reported speech.
     :param extraction_method: int
         The feature extraction method to use.
-    :param poly: sklearn.preprocessing.PolynomialFeatures
+    :param poly: backend.ml.feature_expansion.PolynomialExpansion
         If defined, used for feature expansion.
     :return: list(np.array), list(int), int, int
         * The features for each (quote, speaker) pair in the article. The features for the i-th quote in the article
@@ -45,6 +44,7 @@ def parse_article(article_dict, quote_dataset, extraction_method, cue_verbs, pol
         # The quote detection features for this sentence
         quote_features = quote_dataset.get_sentence_features(article_dict['article'].id, sent_index)
 
+        mention_features = []
         for j, mention in enumerate(mentions):
             article = article_dict['article']
             sentences = article_dict['sentences']
@@ -63,12 +63,15 @@ def parse_article(article_dict, quote_dataset, extraction_method, cue_verbs, pol
                 ne_features = attribution_features_baseline_expanded(article, sentences, sent_index, mention, other_quotes, other_speakers, cue_verbs)
 
             quote_mention_features = np.concatenate((quote_features, ne_features), axis=0)
-            if poly:
-                quote_mention_features = poly.fit_transform(quote_mention_features.reshape((-1, 1))).reshape((-1,))
             label = int(true_mention_index == j)
-            features.append(quote_mention_features)
+            mention_features.append(quote_mention_features)
             labels.append(label)
 
+        # Expands the features of all mentions for this quote at once
+        if poly and len(mention_features) > 0:
+            mention_features = list(poly.transform(np.array(mention_features)))
+        features += mention_features
+
         # Create weasel feature:
         weasel_feature = np.zeros(features[-1].shape[0])
         weasel_feature[:len(quote_features)] = quote_features
@@ -79,9 +82,11 @@ def parse_article(article_dict, quote_dataset, extraction_method, cue_verbs, pol
     return features, labels, len(article_dict['quotes']), len(mentions) + 1
 
 
-def parse_article_ovo(article_dict, quote_dataset, extraction_method, cue_verbs, use_quote_features=False, poly=None):
+def parse_article_ovo(article_dict, quote_dataset, extraction_method, cue_verbs, use_quote_features=False, poly=None,
+                      max_candidates=None):
     """
-    Creates feature vectors for each sentence in the article from the raw data.
+    Creates feature vectors for each pair of candidate authors of each quote in the article from the raw data. The
+    features of each (quote, mention) are computed once, and the features of the pairs are built from them.
 
     :param article_dict: dict
         A dict containing information about the fully labeled article. Keys:
@@ -96,73 +101,77 @@ def parse_article_ovo(article_dict, quote_dataset, extraction_method, cue_verbs,
         The list of all "cue verbs", which are verbs that often introduce reported speech.
     :param use_quote_features: boolean
         Whether to add the features for quote detection of the sentence containing the quote to the dataset.
-    :param poly: sklearn.preprocessing.PolynomialFeatures
+    :param poly: backend.ml.feature_expansion.PolynomialExpansion
         If defined, used for feature expansion.
-    :return: list(np.array), list(int), int, int
-        * The features for each (quote, speaker) pair in the article. The features for the i-th quote in the article
-        and the j-th mention is at index [i * (num_mentions + 1) + j].
-        * The label for each (quote, speaker) pair in the article. The label for the i-th quote in the article
-        and the j-th mention is at index [i * (num_mentions + 1) + j].
+    :param max_candidates: int
+        If defined, only the max_candidates mentions closest to each quote (and the weasel) are candidate authors of
+        the quote. Otherwise, all mentions are.
+    :return: list(np.array), list(int), int, int, np.array(int), np.array(int)
+        * The features for each pair of candidates of each quote in the article. The features for the i-th quote in
+        the article and the candidates j and k are at index
+        [i * num_candidates * (num_candidates - 1) + j * (num_candidates - 1) + k - int(j < k)].
+        * The label for each pair of candidates, at the same index: 0 if the first candidate is the author, 1 if the
+        second one is, and 2 if neither is.
         * The number of quotes in the article
-        * The number of mentions in the article (num_mentions).
+        * The number of candidates for each quote (num_candidates), including the weasel, which is the last one.
+        * The index of the mention of each candidate of each quote, the weasel being len(mentions).
+        * The index of the mention of the true author of each quote, len(mentions) if it isn't a mention.
     """
-    features = []
-    labels = []
-    mentions = article_dict['article'].people['mentions']
-    mentions_with_weasel = mentions + [None]
+    article = article_dict['article']
+    mentions = article.people['mentions']
+    quotes = article_dict['quotes']
+    num_mentions = len(mentions)
 
-    for i, sent_index in enumerate(article_dict['quotes']):
+    true_indices = []
+    for true_author in article_dict['authors'][:len(quotes)]:
         # List of indices of the tokens of the true author of the quote
-        true_author = article_dict['authors'][i]
         true_index = find_true_author_index(true_author, mentions)
-        if true_index == -1:
-            true_index = len(mentions)
-
-        # Index of other quotes in the article
-        other_quotes = article_dict['quotes'][:i] + article_dict['quotes'][i + 1:]
-        
-        # The quote detection features for this sentence
-        quote_features = quote_dataset.get_sentence_features(article_dict['article'].id, sent_index)
-
-        # Mention features for single mentions
-        single_features = []
-        for m in mentions_with_weasel:
-            article = article_dict['article']
-            s_docs = article_dict['sentences']
-            if extraction_method == 1:
-                single_features.append(attribution_features_ovo_1(article, s_docs, sent_index, m, cue_verbs))
-            elif extraction_method == 2:
-                single_features.append(attribution_features_ovo_2(article, s_docs, sent_index, m, cue_verbs))
-            else:
-                single_features.append(attribution_features_ovo_3(article, s_docs, sent_index, m, cue_verbs,
-                                                                  other_quotes))
-
-        for m1_index, f1 in enumerate(single_features):
-            for m2_index, f2 in enumerate(single_features):
-                if m1_index != m2_index:
-                    m1_m2_features = np.concatenate((f1, f2), axis=0)
-                    if use_quote_features:
-                        m1_m2_features = np.concatenate((quote_features, m1_m2_features), axis=0)
-                    if poly:
-                        m1_m2_features = poly.fit_transform(m1_m2_features.reshape((-1, 1))).reshape((-1,))
-
-                    if true_index == m1_index:
-                        label = 0
-                    elif true_index == m2_index:
-                        label = 1
-                    else:
-                        # No good choice
-                        label = 2
-                    features.append(m1_m2_features)
-                    labels.append(label)
-
-    return features, labels, len(article_dict['quotes']), len(mentions_with_weasel)
-
-
-class QuoteAttributionDataset(Dataset):
+        true_indices.append(num_mentions if true_index == -1 else true_index)
+    true_indices = np.array(true_indices, dtype=np.int64)
+
+    candidates = np.tile(np.arange(num_mentions + 1), (len(quotes), 1))
+    if len(quotes) == 0:
+        num_candidates = num_mentions + 1 if max_candidates is None else min(num_mentions, max_candidates) + 1
+        return [], [], 0, num_candidates, candidates[:, :num_candidates], true_indices
+
+    # Features of each mention (and the weasel) for each quote, shape (num_quotes, num_mentions + 1, num_features)
+    mention_features = attribution_features_ovo_batch(article.sentences['sentences'], article_dict['sentences'],
+                                                      quotes, mentions, cue_verbs, extraction_method)
+
+    if max_candidates is not None and num_mentions > max_candidates:
+        # The second feature is the number of sentences between the quote and the mention
+        distances = np.abs(mention_features[:, :-1, 1])
+        nearest = np.sort(np.argsort(distances, axis=1, kind='stable')[:, :max_candidates], axis=1)
+        candidates = np.concatenate((nearest, np.full((len(quotes), 1), num_mentions)), axis=1)
+    num_candidates = candidates.shape[1]
+    candidate_features = np.take_along_axis(mention_features, candidates[:, :, np.newaxis], axis=1)
+
+    # All ordered pairs of distinct candidates, the first candidate changing the slowest
+    first, second = np.nonzero(~np.eye(num_candidates, dtype=bool))
+    pair_features = np.concatenate((candidate_features[:, first], candidate_features[:, second]), axis=2)
+    if use_quote_features:
+        # The quote detection features of the sentence of each quote
+        quote_features = np.array([quote_dataset.get_sentence_features(article.id, sent_index)
+                                   for sent_index in quotes])
+        quote_features = np.repeat(quote_features[:, np.newaxis], len(first), axis=1)
+        pair_features = np.concatenate((quote_features, pair_features), axis=2)
+    pair_features = pair_features.reshape((-1, pair_features.shape[2]))
+
+    # Expands the features of all pairs at once
+    if poly and len(pair_features) > 0:
+        pair_features = poly.transform(pair_features)
+
+    is_author = candidates == true_indices[:, np.newaxis]
+    labels = np.where(is_author[:, first], 0, np.where(is_author[:, second], 1, 2)).reshape((-1,))
+
+    return list(pair_features), labels.tolist(), len(quotes), num_candidates, candidates, true_indices
+
+
+class QuoteAttributionDataset(ArrayDataset):
     """ Dataset comprised of labeled articles, with features extracted for quote attribution """
 
-    def __init__(self, article_dicts, quote_dataset, cue_verbs, extraction_method, ovo=False, poly=None):
+    def __init__(self, article_dicts, quote_dataset, cue_verbs, extraction_method, ovo=False, poly=None,
+                 max_candidates=None):
         """
         Initializes the dataset.
 
@@ -179,49 +188,44 @@ class QuoteAttributionDataset(Dataset):
             The feature extraction method to use.
         :param ovo: boolean
             Whether or not to load one-vs-one features
-        :param poly: sklearn.preprocessing.PolynomialFeatures
+        :param poly: backend.ml.feature_expansion.PolynomialExpansion
             If defined, used for feature expansion.
+        :param max_candidates: int
+            When loading one-vs-one features, if defined, only the max_candidates mentions closest to each quote (and
+            the weasel) are candidate authors of the quote.
         """
         self.ovo = ovo
-        self.features = []
-        self.labels = []
+        features = []
+        labels = []
         # Keys: article id,
         # Values:
         #   (first feature in the article,
         #    last feature in the article,
         #    number of quotes in the article,
         #    number of mentions in the article (including the weasel, which is the last one))
+        # For one-vs-one features, the number of mentions is the number of candidates of each quote.
         self.article_features = {}
+        # Keys: article id,
+        # Values: (the index of the mention of each candidate of each quote, the index of the mention of the true author
+        #          of each quote), only for one-vs-one features
+        self.quote_candidates = {}
 
         for a_dict in article_dicts:
             if ovo:
-                a_features, a_labels, a_quotes, a_mentions = parse_article_ovo(a_dict, quote_dataset, extraction_method,
-                                                                               cue_verbs, poly=poly)
+                a_features, a_labels, a_quotes, a_mentions, a_candidates, a_authors = \
+                    parse_article_ovo(a_dict, quote_dataset, extraction_method, cue_verbs, poly=poly,
+                                      max_candidates=max_candidates)
+                self.quote_candidates[a_dict['article'].id] = (a_candidates, a_authors)
             else:
                 a_features, a_labels, a_quotes, a_mentions = parse_article(a_dict, quote_dataset, extraction_method,
                                                                            cue_verbs, poly=poly)
-            first_feature = len(self.features)
-            self.features += a_features
-            last_feature = len(self.features) - 1
-            self.labels += a_labels
+            first_feature = len(features)
+            features += a_features
+            last_feature = len(features) - 1
+            labels += a_labels
             self.article_features[a_dict['article'].id] = (first_feature, last_feature, a_quotes, a_mentions)
 
-        self.feature_dimensionality = self.features[0].shape
-        self.length = len(self.features)
-
-    def __getitem__(self, index):
-        """
-        Finds the item at a given index of the dataset.
-
-        :param index: int.
-            The index at which we want the data.
-        :return: np.array, np.array
-            The features and label for the datapoint
-        """
-        return self.features[index], self.labels[index]
-
-    def __len__(self):
-        return self.length
+        super().__init__(features, labels)
 
     def get_article_indices(self, article_id):
         """
@@ -267,6 +271,21 @@ class QuoteAttributionDataset(Dataset):
             next_q_start = q_start + num_mentions
         return self.features[q_start:next_q_start], self.labels[q_start:next_q_start]
 
+    def get_quote_candidates(self, article_id, quote_index):
+        """
+        Finds the candidate authors of a quote, when using one-vs-one features.
+
+        :param article_id: int
+            The unique id of the article that contains the quote.
+        :param quote_index: int
+            The index of the quote in the article.
+        :return: np.array(int), int
+            The index of the mention of each candidate (the weasel being the number of mentions in the article), and
+            the index of the mention of the true author of the quote.
+        """
+        candidates, true_authors = self.quote_candidates[article_id]
+        return candidates[quote_index], int(true_authors[quote_index])
+
 
 def subset(dataset, article_indices):
     """
@@ -276,28 +295,27 @@ def subset(dataset, article_indices):
         The dataset from which to take a subset.
     :param article_indices: list(int)
         The indices of the articles to keep in the subset.
-    :return:
+    :return: ArrayDataset
+        The subset.
     """
-    indices = []
-    for a_id in article_indices:
-        indices += dataset.get_article_indices(a_id)
-    return Subset(dataset, indices)
+    article_ranges = [dataset.get_article_features(a_id)[:2] for a_id in article_indices]
+    return subset_rows(dataset, article_rows(article_ranges))
 
 
 def subset_ovo(dataset, article_indices):
     """
+    Returns a subset of a one-vs-one dataset containing the features for only some articles.
 
-    :param dataset:
-    :param article_indices:
-    :return:
+    :param dataset: QuoteAttributionDataset
+        The dataset from which to take a subset.
+    :param article_indices: list(int)
+        The indices of the articles to keep in the subset.
+    :return: ArrayDataset
+        The subset.
     """
-    indices = []
-    for a_id in article_indices:
-        for feature_index in dataset.get_article_indices(a_id):
-            # Don't add feature vectors with no true label to the dataset.
-            if dataset[feature_index][1] < 2:
-                indices.append(feature_index)
-    return Subset(dataset, indices)
+    rows = article_rows([dataset.get_article_features(a_id)[:2] for a_id in article_indices])
+    # Don't add feature vectors with no true label to the dataset.
+    return subset_rows(dataset, rows[dataset.labels[rows] < 2])
 
 
 def sampler_weights(dataset):
@@ -306,23 +324,10 @@ def sampler_weights(dataset):
 
     :param dataset: Dataset
         The dataset to find the weights for
-    :return: list(float), int
+    :return: np.array(float), int
         The weights for each index in the dataset and the total number of samples in an epoch.
     """
-    class_counts = [0, 0]
-    for index in range(len(dataset)):
-        _, label = dataset[index]
-        class_counts[label] += 1
-
-    divisor = 2 * class_counts[0] * class_counts[1]
-    sample_weights = (class_counts[1] / divisor, class_counts[0] / divisor)
-    weights = []
-    for index in range(len(dataset)):
-        _, label = dataset[index]
-        weights.append(sample_weights[label])
-
-    num_samples = 2 * min(class_counts[0], class_counts[1])
-    return weights, num_samples
+    return balanced_weights(dataset.labels)
 
 
 def sampler_weights_ovo(dataset):
@@ -331,27 +336,11 @@ def sampler_weights_ovo(dataset):
 
     :param dataset: Dataset
         The dataset to find the weights for
-    :return: list(float), int
+    :return: np.array(float), int
         The weights for each index in the dataset and the total number of samples in an epoch.
     """
-    # Class 0, 1, 2
-    class_counts = [0, 0, 0]
-    for index in range(len(dataset)):
-        _, label = dataset[index]
-        class_counts[label] += 1
-
-    divisor = 2 * class_counts[0] * class_counts[1]
-    sample_weights = (class_counts[1] / divisor, class_counts[0] / divisor)
-    weights = []
-    for index in range(len(dataset)):
-        _, label = dataset[index]
-        if label < 2:
-            weights.append(sample_weights[label])
-        else:
-            weights.append(0)
-
-    num_samples = 2 * min(class_counts[0], class_counts[1])
-    return weights, num_samples
+    # Datapoints of class 2 are never sampled
+    return balanced_weights(dataset.labels)
 
 
 def attribution_loader(dataset, train=True, batch_size=None):
@@ -365,14 +354,13 @@ def attribution_loader(dataset, train=True, batch_size=None):
         Whether to load a training or testing dataloader.
     :param batch_size: int.
         The batch size. The default is None, where the batch size is the size of the data.
-    :return: torch.utils.data.DataLoader
-        DataLoader for quote detection.
+    :return: ArrayLoader
+        Loader for quote detection.
     """
     if batch_size is None:
         batch_size = len(dataset)
     if train:
         weights, num_samples = sampler_weights(dataset)
-        sampler = WeightedRandomSampler(weights=weights, num_samples=num_samples, replacement=True)
-        return DataLoader(dataset=dataset, batch_size=batch_size, sampler=sampler)
+        return ArrayLoader(dataset, batch_size, weights, num_samples)
     else:
-        return DataLoader(dataset=dataset, batch_size=batch_size, shuffle=False)
+        return ArrayLoader(dataset, batch_size)
@@ -1,3 +1,5 @@
+from bisect import bisect_left
+
 import numpy as np
 
 
@@ -475,3 +477,69 @@ def attribution_features_ovo_3(article, sentences, quote_index, speaker, cue_ver
         quote_in_between_proportion,
         child_of_cue_verb(),
     ])), axis=0)
+
+
+def attribution_features_ovo_batch(sentence_indices, sentences, quotes, mentions, cue_verbs, extraction_method):
+    """
+    Extracts the features of attribution_features_ovo_1, attribution_features_ovo_2 or attribution_features_ovo_3 for
+    every quote and every mention of an article at once, the other quotes of each quote being all the others in the
+    list. The features that only depend on the mention are computed once per mention instead of once per quote.
+
+    :param sentence_indices: list(int)
+        The index of the last token of each sentence in the article, as in article.sentences['sentences']
+    :param sentences: list(spaCy.Doc)
+        the spaCy.Doc for each sentence in the article.
+    :param quotes: list(int)
+        The indices of the sentences containing quotes in the article.
+    :param mentions: list(dict)
+        The mentions in the article. Each has keys 'name', 'full_name', 'start', 'end', as described in the database.
+    :param cue_verbs: list(string).
+        The list of all "cue verbs", which are verbs that often introduce reported speech.
+    :param extraction_method: int
+        The feature extraction method to use: 1, 2, or 3 for any other value.
+    :return: np.array
+        The features, of shape (len(quotes), len(mentions) + 1, num_features). The last mention of each quote is the
+        weasel, whose features are all 0.
+    """
+    num_features = {1: 3, 2: 5}.get(extraction_method, 8)
+    features = np.zeros((len(quotes), len(mentions) + 1, num_features))
+    if len(quotes) == 0 or len(mentions) == 0:
+        return features
+
+    # Features that only depend on the mention
+    speaker_sents = np.array([bisect_left(sentence_indices, mention['end']) for mention in mentions], dtype=np.int64)
+    mention_features = []
+    for mention, sent in zip(mentions, speaker_sents):
+        sent_start = sentence_indices[sent - 1] + 1 if sent > 0 else 0
+        rel_token_indices = [i - sent_start for i in range(mention['start'], mention['end'] + 1)]
+        tokens = sentences[sent]
+        cue_verb_tokens = [token for token in tokens if token.lemma_ in cue_verbs]
+        mention_features.append([
+            int(len(cue_verb_tokens) > 0),
+            int(any(tokens[index].dep_ == 'nsubj' for index in rel_token_indices)),
+            int(any(tokens[index].dep_ == 'obj' for index in rel_token_indices)),
+            int(any(child.i in rel_token_indices for token in cue_verb_tokens for child in token.children)),
+        ])
+    mention_features = np.array(mention_features)
+
+    # Features that depend on the quote
+    quotes = np.asarray(quotes, dtype=np.int64)
+    distances = quotes[:, np.newaxis] - speaker_sents[np.newaxis, :]
+    features[:, :-1, 0] = 1
+    features[:, :-1, 1] = distances
+    features[:, :-1, 2] = mention_features[:, 0]
+    if num_features >= 5:
+        features[:, :-1, 3] = mention_features[:, 1]
+        features[:, :-1, 4] = mention_features[:, 2]
+    if num_features >= 8:
+        num_sentences = max(int(quotes.max()), int(speaker_sents.max())) + 1
+        quote_prefix_sums = np.concatenate(([0], np.cumsum(np.bincount(quotes, minlength=num_sentences))))
+        # Quotes strictly between the speaker and the quote
+        first = np.minimum(quotes[:, np.newaxis], speaker_sents[np.newaxis, :]) + 1
+        last = np.maximum(quotes[:, np.newaxis], speaker_sents[np.newaxis, :])
+        quotes_in_between = np.maximum(quote_prefix_sums[last] - quote_prefix_sums[np.minimum(first, last)], 0)
+        gaps = np.abs(distances) - 1
+        features[:, :-1, 5] = quotes_in_between
+        features[:, :-1, 6] = np.where(gaps < 1, 1, quotes_in_between / np.maximum(gaps, 1))
+        features[:, :-1, 7] = mention_features[:, 3]
+    return features
@@ -1,29 +1,41 @@
 import numpy as np
 from sklearn.linear_model import SGDClassifier
-from sklearn.preprocessing import PolynomialFeatures
 
-from backend.db_management import load_labeled_articles
+from backend.db_management import load_labeled_articles, load_labeled_article_ids
+from backend.ml.feature_expansion import PolynomialExpansion
+from backend.ml.feature_store import FEATURE_STORE_PATH, feature_version, load_dataset
 from backend.ml.quote_detection_dataset import QuoteDetectionDataset, detection_loader, subset
-from backend.ml.quote_detection_feature_extraction import feature_extraction
-from backend.ml.sgd import train, cross_validate
+from backend.ml.quote_detection_feature_extraction import feature_extraction_batch
+from backend.ml.sgd import train, cross_validate, cross_validate_grid
 
 
-def load_data(nlp, cue_verbs, poly):
+def load_data(nlp, cue_verbs, poly, store_path=FEATURE_STORE_PATH):
     """
-    Loads all labeled articles from the database and extracts feature vectors for them.
+    Loads all labeled articles from the database and extracts feature vectors for them. The features are stored, and
+    only extracted again when the labeled articles change.
 
     :param nlp: spaCy.Language
         The language model used to tokenize the text.
     :param cue_verbs: list(string)
         The list of all "cue verbs", which are verbs that often introduce reported speech.
-    :param poly: sklearn.preprocessing.PolynomialFeatures
+    :param poly: backend.ml.feature_expansion.PolynomialExpansion
         If defined, used to perform feature extraction.
+    :param store_path: string
+        The directory in which the features are stored. If None, the features are always extracted.
     :return: list(int), QuoteDetectionDataset
         The ids of all articles in the dataset, and the dataset.
     """
-    train_articles, train_sentences, _, _ = load_labeled_articles(nlp)
-    quote_detection_dataset = QuoteDetectionDataset(train_articles, train_sentences, cue_verbs, poly=poly)
-    train_article_ids = np.array(list(map(lambda a: a.id, train_articles)))
+    def extract():
+        train_articles, train_sentences, _, _ = load_labeled_articles(nlp)
+        return QuoteDetectionDataset(train_articles, train_sentences, cue_verbs, poly=poly)
+
+    if store_path is None:
+        quote_detection_dataset = extract()
+    else:
+        version = feature_version('quote_detection', cue_verbs, poly)
+        quote_detection_dataset, _ = load_dataset(f'quote_detection_{poly.degree if poly else 1}',
+                                                  QuoteDetectionDataset, extract, version, store_path)
+    train_article_ids = np.array(list(quote_detection_dataset.article_features.keys()))
     return train_article_ids, quote_detection_dataset
 
 
@@ -41,18 +53,14 @@ def predict_quotes(trained_model, sentences, cue_verbs, in_quotes, proba=False,
         Whether each token in each sentence is between quotes or not.
     :param proba: boolean
         Whether or not to use probability estimates to predict the author.
-    :param poly: sklearn.preprocessing.PolynomialFeatures
+    :param poly: backend.ml.feature_expansion.PolynomialExpansion
         If defined, used to perform feature extraction.
     :return: np.array()
         The probability for each sentence.
     """
-    features = []
-    for i, sentence in enumerate(sentences):
-        sentence_features = feature_extraction(sentence, cue_verbs, in_quotes[i])
-        if poly:
-            sentence_features = poly.fit_transform(sentence_features.reshape((-1, 1))).reshape((-1,))
-        features.append(sentence_features)
-    X = np.array(features)
+    X = feature_extraction_batch(sentences, cue_verbs, in_quotes)
+    if poly:
+        X = poly.transform(X)
     if proba:
         predictions = trained_model.predict_proba(X)[:, 1]
     else:
@@ -80,7 +88,7 @@ def train_quote_detection(loss, penalty, alpha, max_iter, nlp, cue_verbs, exp_de
     :return: sklearn.linear_model.SGDClassifier
         The trained classifier
     """
-    poly = PolynomialFeatures(exp_degree, interaction_only=True, include_bias=True)
+    poly = PolynomialExpansion(exp_degree, interaction_only=True, include_bias=True)
     article_ids, quote_detection_dataset = load_data(nlp, cue_verbs, poly=poly)
     classifier = SGDClassifier(loss=loss, alpha=alpha, penalty=penalty)
     dataloader = detection_loader(quote_detection_dataset, train=True, batch_size=10)
@@ -89,6 +97,51 @@ def train_quote_detection(loss, penalty, alpha, max_iter, nlp, cue_verbs, exp_de
     return classifier
 
 
+def update_quote_detection(trained_model, max_iter, nlp, cue_verbs, since, exp_degree=2, rehearsal=1.0):
+    """
+    Continues training a quote detection model with partial_fit, on the articles that were labeled since it was
+    trained. To avoid forgetting what was learned on the other articles, a random sample of them is replayed with the
+    new ones.
+
+    :param trained_model: sklearn.linear_model.SGDClassifier
+        The model to update.
+    :param max_iter: int
+        The maximum number of epochs to train for
+    :param nlp: spaCy.Language
+        The language model used to tokenize the text.
+    :param cue_verbs: list(string)
+        The list of all "cue verbs", which are verbs that often introduce reported speech.
+    :param since: datetime.datetime
+        The time at which the model started being trained.
+    :param exp_degree: int
+        The degree of the polynomial expansion the model was trained with.
+    :param rehearsal: float
+        The number of previously labeled articles to replay for each new article.
+    :return: sklearn.linear_model.SGDClassifier
+        The updated classifier, or None if there was nothing to update it with.
+    """
+    new_ids = load_labeled_article_ids(since)
+    # Only articles of the training set are replayed, as the ones of the test set would be discarded when loaded
+    old_ids = list(load_labeled_article_ids(training_set=True) - new_ids)
+    rehearsal_size = min(len(old_ids), int(np.ceil(rehearsal * len(new_ids))))
+    rehearsal_ids = np.random.choice(old_ids, rehearsal_size, replace=False).tolist() if rehearsal_size > 0 else []
+
+    train_articles, train_sentences, _, _ = load_labeled_articles(nlp, list(new_ids) + rehearsal_ids)
+    # Nothing new to learn from if all the new articles were assigned to the test set
+    if not any(article.id in new_ids for article in train_articles):
+        return None
+
+    poly = PolynomialExpansion(exp_degree, interaction_only=True, include_bias=True)
+    quote_detection_dataset = QuoteDetectionDataset(train_articles, train_sentences, cue_verbs, poly=poly)
+    # The classes can't be balanced if the new sentences only contain one of them
+    if len(set(quote_detection_dataset.labels)) < 2:
+        return None
+    dataloader = detection_loader(quote_detection_dataset, train=True, batch_size=10)
+    eval_dataloader = detection_loader(quote_detection_dataset, train=False, batch_size=len(quote_detection_dataset))
+    classifier, accuracy = train(trained_model, dataloader, eval_dataloader, max_iter)
+    return classifier
+
+
 def evaluate_unlabeled_sentences(trained_model, sentences, cue_verbs, in_quotes, proba=False, exp_degree=2):
     """
     Uses a trained quote detection model to predict whether new sentences are also quotes.
@@ -106,7 +159,7 @@ def evaluate_unlabeled_sentences(trained_model, sentences, cue_verbs, in_quotes,
     :return: np.array()
         The probability that each sentence contains a quote.
     """
-    poly = PolynomialFeatures(exp_degree, interaction_only=True, include_bias=True)
+    poly = PolynomialExpansion(exp_degree, interaction_only=True, include_bias=True)
     return predict_quotes(trained_model, sentences, cue_verbs, in_quotes, proba=proba, poly=poly)
 
 
@@ -131,7 +184,7 @@ def evaluate_quote_detection(loss, penalty, alpha, max_iter, nlp, cue_verbs, cv_
     :return: QuoteDetectionDataset
         The dataset that was used for quote detection.
     """
-    poly = PolynomialFeatures(exp_degree, interaction_only=True, include_bias=True)
+    poly = PolynomialExpansion(exp_degree, interaction_only=True, include_bias=True)
     article_ids, quote_detection_dataset = load_data(nlp, cue_verbs, poly)
 
     train_results, test_results = cross_validate(loss=loss,
@@ -148,3 +201,35 @@ def evaluate_quote_detection(loss, penalty, alpha, max_iter, nlp, cue_verbs, cv_
     return train_results, test_results
 
 
+def evaluate_quote_detection_grid(parameters, max_iter, nlp, cue_verbs, cv_folds=5, exp_degree=2, jobs=1):
+    """
+    Evaluates quote detection models with different hyperparameters using cross-validation. The dataset is only built
+    once, and the folds of all models are trained in parallel.
+
+    :param parameters: list(Tuple(string, string, float))
+        The loss, penalty and regularization term of each model.
+    :param max_iter: int
+        The maximum number of epochs to train for
+    :param nlp: spaCy.Language
+        The language model used to tokenize the text.
+    :param cue_verbs: list(string)
+        The list of all "cue verbs", which are verbs that often introduce reported speech.
+    :param cv_folds: int
+        The number of cross-validation folds to perform for each model.
+    :param exp_degree: int
+        The degree of the polynomial expansion of the features.
+    :param jobs: int
+        The number of processes training folds.
+    :return: list(Tuple(Results, Results))
+        The training and test results of each model.
+    """
+    poly = PolynomialExpansion(exp_degree, interaction_only=True, include_bias=True)
+    article_ids, quote_detection_dataset = load_data(nlp, cue_verbs, poly)
+    return cross_validate_grid(parameters=parameters,
+                               split_ids=article_ids,
+                               dataset=quote_detection_dataset,
+                               subset=subset,
+                               dataloader=detection_loader,
+                               max_iter=max_iter,
+                               cv_folds=cv_folds,
+                               jobs=jobs)
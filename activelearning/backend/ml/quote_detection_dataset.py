@@ -1,11 +1,9 @@
-from torch.utils.data import Dataset, DataLoader, Subset
-from torch.utils.data.sampler import WeightedRandomSampler
+from backend.helpers import aggregate_article_labels, aggregate_articles_labels
+from backend.ml.array_dataset import ArrayDataset, ArrayLoader, article_rows, balanced_weights, subset_rows
+from backend.ml.quote_detection_feature_extraction import feature_extraction_batch
 
-from backend.helpers import aggregate_label
-from backend.ml.quote_detection_feature_extraction import feature_extraction
 
-
-def parse_article(article, sentences, cue_verbs, poly=None):
+def parse_article(article, sentences, cue_verbs, poly=None, article_labels=None):
     """
     Creates feature vectors for each sentence in the article from the raw data.
 
@@ -15,31 +13,35 @@ def parse_article(article, sentences, cue_verbs, poly=None):
         the spaCy.Doc for each sentence in the article.
     :param cue_verbs: list(string)
         The list of all "cue verbs", which are verbs that often introduce reported speech.
-    :param poly: sklearn.preprocessing.PolynomialFeatures
+    :param poly: backend.ml.feature_expansion.PolynomialExpansion
         If defined, used for feature expansion.
+    :param article_labels: list(Tuple(list(int), list(int), float))
+        The consensus labels of each sentence in the article, as returned by aggregate_article_labels. If None, they are
+        loaded from the database.
     """
-    article_features = []
-    article_labels = []
+    if article_labels is None:
+        article_labels = aggregate_article_labels(article)
+    article_in_quotes = []
+    labels = []
     sentence_start = 0
     for sentence_index, end in enumerate(article.sentences['sentences']):
-        # Compute sentence features
-        sentence = sentences[sentence_index]
-        in_quotes = article.in_quotes['in_quotes'][sentence_start:end + 1]
-        features = feature_extraction(sentence, cue_verbs, in_quotes)
-        if poly:
-            features = poly.fit_transform(features.reshape((-1, 1))).reshape((-1,))
+        article_in_quotes.append(article.in_quotes['in_quotes'][sentence_start:end + 1])
         # Compute sentence label
-        sentence_labels, sentence_authors, _ = aggregate_label(article, sentence_index)
+        sentence_labels, sentence_authors, _ = article_labels[sentence_index]
         label = int(sum(sentence_labels) > 0)
-        # Adds the sentence and label to the dataset
-        article_features.append(features)
-        article_labels.append(label)
+        labels.append(label)
         sentence_start = end + 1
 
-    return article_features, article_labels
+    # Computes the features of all sentences at once
+    num_sentences = len(labels)
+    article_features = feature_extraction_batch(sentences[:num_sentences], cue_verbs, article_in_quotes)
+    if poly:
+        article_features = poly.transform(article_features)
+
+    return list(article_features), labels
 
 
-class QuoteDetectionDataset(Dataset):
+class QuoteDetectionDataset(ArrayDataset):
     """ Dataset comprised of labeled articles """
 
     def __init__(self, articles, sentences, cue_verbs, poly=None):
@@ -52,37 +54,24 @@ class QuoteDetectionDataset(Dataset):
             the spaCy.Doc for each sentence in each article.
         :param cue_verbs: list(string)
             The list of all "cue verbs", which are verbs that often introduce reported speech.
-        :param poly: sklearn.preprocessing.PolynomialFeatures
+        :param poly: backend.ml.feature_expansion.PolynomialExpansion
             If defined, used for feature expansion.
         """
-        self.features = []
-        self.labels = []
+        features = []
+        labels = []
         self.article_features = {}
         total_sentences = 0
+        articles_labels = aggregate_articles_labels(articles)
 
         for index, article in enumerate(articles):
-            article_features, article_labels = parse_article(article, sentences[index], cue_verbs, poly)
-            self.features += article_features
-            self.labels += article_labels
+            article_features, article_labels = parse_article(article, sentences[index], cue_verbs, poly,
+                                                             articles_labels[article.id])
+            features += article_features
+            labels += article_labels
             self.article_features[article.id] = (total_sentences, total_sentences + len(article_labels) - 1)
             total_sentences += len(article_labels)
 
-        self.feature_dimensionality = self.features[0].shape
-        self.length = len(self.features)
-
-    def __getitem__(self, index):
-        """
-        Finds the item at a given index of the dataset.
-
-        :param index: int.
-            The index at which we want the data.
-        :return: np.array, np.array
-            The features and label for the datapoint
-        """
-        return self.features[index], self.labels[index]
-
-    def __len__(self):
-        return self.length
+        super().__init__(features, labels)
 
     def get_article_indices(self, article_id):
         """
@@ -118,12 +107,10 @@ def subset(dataset, article_indices):
         The dataset from which to take a subset.
     :param article_indices: list(int)
         The indices of the articles to keep in the subset.
-    :return:
+    :return: ArrayDataset
+        The subset.
     """
-    indices = []
-    for a_id in article_indices:
-        indices += dataset.get_article_indices(a_id)
-    return Subset(dataset, indices)
+    return subset_rows(dataset, article_rows([dataset.article_features[a_id] for a_id in article_indices]))
 
 
 def sampler_weights(dataset):
@@ -132,23 +119,10 @@ def sampler_weights(dataset):
 
     :param dataset: Dataset
         The dataset to find the weights for
-    :return: list(float), int
+    :return: np.array(float), int
         The weights for each index in the dataset and the total number of samples in an epoch.
     """
-    class_counts = [0, 0]
-    for index in range(len(dataset)):
-        _, label = dataset[index]
-        class_counts[label] += 1
-
-    divisor = 2 * class_counts[0] * class_counts[1]
-    sample_weights = (class_counts[1] / divisor, class_counts[0] / divisor)
-    weights = []
-    for index in range(len(dataset)):
-        _, label = dataset[index]
-        weights.append(sample_weights[label])
-
-    num_samples = 2 * min(class_counts[0], class_counts[1])
-    return weights, num_samples
+    return balanced_weights(dataset.labels)
 
 
 def detection_loader(dataset, train=True, batch_size=None):
@@ -163,14 +137,13 @@ def detection_loader(dataset, train=True, batch_size=None):
         Whether to load a training or testing dataloader.
     :param batch_size: int.
         The batch size. The default is None, where the batch size is the size of the data.
-    :return: torch.utils.data.DataLoader
-        DataLoader for quote detection.
+    :return: ArrayLoader
+        Loader for quote detection.
     """
     if batch_size is None:
         batch_size = len(dataset)
     if train:
         weights, num_samples = sampler_weights(dataset)
-        sampler = WeightedRandomSampler(weights=weights, num_samples=num_samples, replacement=True)
-        return DataLoader(dataset=dataset, batch_size=batch_size, sampler=sampler)
+        return ArrayLoader(dataset, batch_size, weights, num_samples)
     else:
-        return DataLoader(dataset=dataset, batch_size=batch_size, shuffle=False)
+        return ArrayLoader(dataset, batch_size)
@@ -1,4 +1,13 @@
 import numpy as np
+from spacy.attrs import POS, DEP, LEMMA, LOWER, ENT_IOB, ENT_TYPE
+
+
+""" The number of features extracted for each sentence. """
+NUM_FEATURES = 13
+
+
+""" The value of ENT_IOB for the first token of a named entity. """
+ENT_IOB_BEGIN = 3
 
 
 def feature_extraction(sentence, cue_verbs, in_quotes):
@@ -14,63 +23,77 @@ def feature_extraction(sentence, cue_verbs, in_quotes):
     :return: np.array
         The features extracted.
     """
-    sentence_length = len(sentence)
-    contains_quote = int('"' in sentence.text)
-    tokens_inside_quote = sum(in_quotes)
-    contains_named_entity = int(len(sentence.ents) > 0)
-    contains_per_named_entity = int(len([ne for ne in sentence.ents if ne.label_ == 'PER']) > 0)
-    sentence_inside_quotes = int(len(in_quotes) == sum(in_quotes))
-    inside_quote_proportion = sum(in_quotes)/len(in_quotes)
+    return feature_extraction_batch([sentence], cue_verbs, [in_quotes])[0]
 
-    def contains_cue_verb():
-        for token in sentence:
-            if token.lemma_ in cue_verbs:
-                return 1
-        return 0
 
-    def contains_pronoun():
-        for token in sentence:
-            if token.pos_ == 'PRON':
-                return 1
-        return 0
+def feature_extraction_batch(sentences, cue_verbs, in_quotes):
+    """
+    Gets the same features as feature_extraction for many sentences at once. The attributes of the tokens of all
+    sentences are loaded once, and all features are computed with numpy operations on them. The proportion of tokens
+    inside quotes of an empty sentence is 0.
+
+    :param sentences: list(spaCy.doc).
+        The sentences to extract features from.
+    :param cue_verbs: list(string).
+        The list of all "cue verbs", which are verbs that often introduce reported speech.
+    :param in_quotes: list(list(int)).
+        For each sentence, whether each token in the sentence is between quotes or not. Needs to have the same length
+        as the sentence.
+    :return: np.ndarray
+        The features extracted, of shape (len(sentences), NUM_FEATURES). Row i contains the same values as
+        feature_extraction(sentences[i], cue_verbs, in_quotes[i]).
+    """
+    num_sentences = len(sentences)
+    if num_sentences == 0:
+        return np.zeros((0, NUM_FEATURES))
 
-    def contains_parataxis():
-        for token in sentence:
-            if token.dep_ == 'parataxis':
-                return 1
-        return 0
+    # The attributes of all tokens, along with the index of the sentence they belong to
+    attributes = [POS, DEP, LEMMA, LOWER, ENT_IOB, ENT_TYPE]
+    lengths = np.array([len(sentence) for sentence in sentences])
+    tokens = np.concatenate([sentence.to_array(attributes).reshape((-1, len(attributes))) for sentence in sentences])
+    token_sentence = np.repeat(np.arange(num_sentences), lengths)
+    pos, dep, lemma, lower, ent_iob, ent_type = tokens.T
+    tokens_in_quotes = np.concatenate([np.asarray(iq, dtype=np.int64).reshape((-1,)) for iq in in_quotes])
+    in_quotes_lengths = np.array([len(iq) for iq in in_quotes])
 
-    def number_of_verbs():
-        verbs = 0
-        for token in sentence:
-            if token.pos_ == 'VERB':
-                verbs += 1
-        return verbs
+    # The hashes of the strings the attributes are compared to
+    strings = sentences[0].vocab.strings
+    cue_verb_hashes = np.array([strings[verb] for verb in cue_verbs], dtype=np.uint64)
 
-    def verb_inside_quotes():
-        for index, token in enumerate(sentence):
-            if token.pos_ == 'VERB' and in_quotes[index] == 1:
-                return 1
-        return 0
+    def count(mask):
+        return np.bincount(token_sentence[mask], minlength=num_sentences)
 
-    def contains_selon():
-        for token in sentence:
-            if token.text.lower() == 'selon':
-                return True
-        return False
+    is_verb = pos == strings['VERB']
+    entity_starts = ent_iob == ENT_IOB_BEGIN
+    tokens_inside_quote = np.bincount(np.repeat(np.arange(num_sentences), in_quotes_lengths), weights=tokens_in_quotes,
+                                      minlength=num_sentences)
 
-    return np.array([
-        sentence_length,
-        contains_quote,
-        tokens_inside_quote,
-        contains_named_entity,
-        contains_per_named_entity,
-        contains_cue_verb(),
-        contains_pronoun(),
-        contains_parataxis(),
-        number_of_verbs(),
-        verb_inside_quotes(),
-        sentence_inside_quotes,
-        inside_quote_proportion,
-        contains_selon(),
-    ])
\ No newline at end of file
+    features = np.empty((num_sentences, NUM_FEATURES))
+    # sentence_length
+    features[:, 0] = lengths
+    # contains_quote
+    features[:, 1] = [int('"' in sentence.text) for sentence in sentences]
+    # tokens_inside_quote
+    features[:, 2] = tokens_inside_quote
+    # contains_named_entity
+    features[:, 3] = count(entity_starts) > 0
+    # contains_per_named_entity
+    features[:, 4] = count(entity_starts & (ent_type == strings['PER'])) > 0
+    # contains_cue_verb
+    features[:, 5] = count(np.isin(lemma, cue_verb_hashes)) > 0
+    # contains_pronoun
+    features[:, 6] = count(pos == strings['PRON']) > 0
+    # contains_parataxis
+    features[:, 7] = count(dep == strings['parataxis']) > 0
+    # number_of_verbs
+    features[:, 8] = count(is_verb)
+    # verb_inside_quotes
+    features[:, 9] = count(is_verb & (tokens_in_quotes == 1)) > 0
+    # sentence_inside_quotes
+    features[:, 10] = in_quotes_lengths == tokens_inside_quote
+    # inside_quote_proportion
+    features[:, 11] = np.divide(tokens_inside_quote, in_quotes_lengths, out=np.zeros(num_sentences),
+                                where=in_quotes_lengths > 0)
+    # contains_selon
+    features[:, 12] = count(lower == strings['selon']) > 0
+    return features
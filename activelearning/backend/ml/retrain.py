@@ -0,0 +1,150 @@
+import json
+import os
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from backend.extraction_pipeline import path_quote_detection_weights, path_author_attribution_weights, \
+    author_prediction_poly_degree, quote_detection_poly_degree
+from backend.ml.author_prediction import evaluate_author_prediction_test
+from backend.ml.confidence_refresh import update_confidences
+from backend.ml.helpers import save_model, load_model, classifier_version
+from backend.ml.quote_detection import train_quote_detection, update_quote_detection
+
+"""
+Trains the quote detection and author prediction models on all fully labeled articles, replaces the models used by the
+application and recomputes the confidences of unlabeled articles.
+
+Once both models are saved, the version of the models is published, so that other processes can know which models are
+in use and when they were trained.
+"""
+
+
+""" The file in which the version of the trained models is published. """
+MODEL_VERSION_PATH = 'data/model_version.json'
+
+
+def publish_model_version(quote_detection_model, author_prediction_model, trained_at, path=MODEL_VERSION_PATH):
+    """
+    Publishes the version of the trained models.
+
+    :param quote_detection_model: sklearn.linear_model.SGDClassifier
+        The trained quote detection model.
+    :param author_prediction_model: sklearn.linear_model.SGDClassifier
+        The trained author prediction model.
+    :param trained_at: datetime.datetime
+        The time at which training started. Labels created after it weren't used to train the models.
+    :param path: string
+        The path of the file in which the version is published.
+    :return: string
+        The version of the models.
+    """
+    quote_detection_version = classifier_version(quote_detection_model)
+    author_prediction_version = classifier_version(author_prediction_model)
+    version = f'{quote_detection_version[:12]}-{author_prediction_version[:12]}'
+    # Writes to a temporary file first, so that a process reading the version never sees a partially written file
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump({
+            'version': version,
+            'quote_detection': quote_detection_version,
+            'author_prediction': author_prediction_version,
+            'trained_at': trained_at.isoformat(),
+        }, f)
+    os.replace(temp_path, path)
+    return version
+
+
+def read_model_version(path=MODEL_VERSION_PATH):
+    """
+    Reads the version of the trained models.
+
+    :param path: string
+        The path of the file in which the version is published.
+    :return: dict
+        The 'version' of the models, the versions of the 'quote_detection' and 'author_prediction' models, and the time
+        at which they started being trained ('trained_at'), or None if no models were published.
+    """
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'r') as f:
+        published = json.load(f)
+    published['trained_at'] = parse_datetime(published['trained_at'])
+    return published
+
+
+def train_models(nlp, cue_verbs, max_epochs=500, qd_loss='log', qd_penalty='l2', qd_alpha=0.01, ap_loss='hinge',
+                 ap_penalty='l1', ap_alpha=0.01, incremental=False, rehearsal=1.0):
+    """
+    Trains both models, saves them and refreshes the confidences of all articles that aren't fully labeled.
+
+    In incremental mode, the current quote detection model is only updated with the articles labeled since it was
+    trained, and the current author prediction model is kept. If there is nothing to update it with, the models are
+    published again with their previous training time. The models are trained from scratch if they were never
+    published.
+
+    :param nlp: spaCy.Language
+        The language model used to tokenize the text.
+    :param cue_verbs: list(string)
+        The list of all "cue verbs", which are verbs that often introduce reported speech.
+    :param max_epochs: int
+        The maximum number of epochs to train for.
+    :param qd_loss: string
+        One of {'log', 'hinge'}. The loss to use for quote detection.
+    :param qd_penalty: string
+        One of {'l1', 'l2'}. The penalty to use for quote detection.
+    :param qd_alpha: float
+        The regularization to use for quote detection.
+    :param ap_loss: string
+        One of {'log', 'hinge'}. The loss to use for author prediction.
+    :param ap_penalty: string
+        One of {'l1', 'l2'}. The penalty to use for author prediction.
+    :param ap_alpha: float
+        The regularization to use for author prediction.
+    :param incremental: boolean
+        Whether to update the current models instead of training new ones.
+    :param rehearsal: float
+        In incremental mode, the number of previously labeled articles to replay for each new article.
+    :return: string
+        The version of the trained models.
+    """
+    trained_at = timezone.now()
+    qd_ed = quote_detection_poly_degree
+    published = read_model_version() if incremental else None
+
+    if published is not None:
+        print(f'Updating quote detection with the articles labeled since {published["trained_at"]}...')
+        qd_current_model = load_model(path_quote_detection_weights)
+        qd_trained_model = update_quote_detection(qd_current_model, max_epochs, nlp, cue_verbs,
+                                                  published['trained_at'], qd_ed, rehearsal)
+        if qd_trained_model is None:
+            # The new labels weren't trained on, so the training time is kept for them to be used in the next update
+            print('Nothing to update quote detection with, keeping the current model\n')
+            qd_trained_model = qd_current_model
+            trained_at = published['trained_at']
+        else:
+            save_model(qd_trained_model, path_quote_detection_weights)
+            print(f'Saved trained model at {path_quote_detection_weights}\n')
+        ap_trained_model = load_model(path_author_attribution_weights)
+    else:
+        print('Training quote detection...')
+        qd_trained_model = train_quote_detection(qd_loss, qd_penalty, qd_alpha, max_epochs, nlp, cue_verbs, qd_ed)
+        save_model(qd_trained_model, path_quote_detection_weights)
+        print(f'Saved trained model at {path_quote_detection_weights}\n')
+
+        print("Training author prediction...")
+        ap_ed = author_prediction_poly_degree
+        ap_trained_model, _, _, _, _, _ =\
+            evaluate_author_prediction_test(ap_loss, ap_penalty, ap_alpha, max_epochs, nlp, cue_verbs, ap_ed)
+        save_model(ap_trained_model, path_author_attribution_weights)
+        print(f'Saved trained model at {path_author_attribution_weights}\n')
+
+    version = publish_model_version(qd_trained_model, ap_trained_model, trained_at)
+    print(f'Published model version {version}\n')
+
+    print('Evaluating all unlabeled quotes...')
+    timings, refreshed = update_confidences(qd_trained_model, nlp, cue_verbs, qd_ed)
+    print(f'Refreshed the confidences of {refreshed} article(s)')
+    for stage, duration in timings.items():
+        print(f'    {stage}: {duration:.2f}s')
+    return version
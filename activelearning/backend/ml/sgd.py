@@ -1,4 +1,7 @@
+from multiprocessing import Pool
+
 import numpy as np
+from django import db
 from sklearn.linear_model import SGDClassifier
 from sklearn.metrics import precision_recall_fscore_support
 from sklearn.model_selection import KFold
@@ -6,16 +9,63 @@ from sklearn.model_selection import KFold
 from backend.ml.scoring import Results
 
 
+""" The data shared by all jobs run by a worker process. """
+worker_data = None
+
+
+def init_worker(data):
+    """
+    Stores the data shared by all jobs in each worker process.
+
+    :param data: object
+        The data shared by all jobs.
+    """
+    global worker_data
+    worker_data = data
+    # The worker processes are copies of the same process, so they need their own random state
+    np.random.seed()
+
+
+def run_job(job):
+    """ Unpacks a job and runs it on the data of the worker process, for use with Pool.map. """
+    function, args = job
+    return function(worker_data, *args)
+
+
+def run_jobs(function, data, jobs_args, jobs=1):
+    """
+    Runs jobs sharing the same data, either in the current process or in a pool of processes. The data is only sent
+    once to each process.
+
+    :param function: function
+        The module level function run by each job, with parameters (data, *args).
+    :param data: object
+        The data shared by all jobs.
+    :param jobs_args: list(tuple)
+        The arguments of each job.
+    :param jobs: int
+        The number of processes running jobs.
+    :return: list
+        The result of each job.
+    """
+    if jobs <= 1:
+        return [function(data, *args) for args in jobs_args]
+    # The worker processes can't share the database connection of this process
+    db.connections.close_all()
+    with Pool(processes=jobs, initializer=init_worker, initargs=(data,)) as pool:
+        return pool.map(run_job, [(function, args) for args in jobs_args])
+
+
 def train(classifier, dataloader, eval_dataloader, max_iter, print_prefix=''):
     """
     Trains a classifier using SGD.
 
     :param classifier: SGDClassifier
         The classifier to train.
-    :param dataloader: Dataloader
-        The dataloader containing the data to train the classifier on.
-    :param eval_dataloader: Dataloader
-        The dataloader to use to evaluate the model after each epoch. Should return a single matrix.
+    :param dataloader: backend.ml.array_dataset.ArrayLoader
+        The loader containing the data to train the classifier on. Each iteration is an epoch of mini-batches.
+    :param eval_dataloader: backend.ml.array_dataset.ArrayLoader
+        The loader to use to evaluate the model after each epoch. Should return a single matrix.
     :param max_iter: int
         The number of epochs to run SGD for.
     :param print_prefix: String
@@ -56,12 +106,12 @@ def cross_validate(loss, penalty, split_ids, dataset, subset, dataloader, alpha,
         One of {'l1', 'l2}. The penalty to use for training
     :param split_ids: list(int)
         The ids of the articles in the dataset. Used to split them into subsets for cross-validation.
-    :param dataset: torch.utils.data.Dataset
+    :param dataset: backend.ml.array_dataset.ArrayDataset
         The dataset to use for cross-validation.
     :param subset: function
         The method, with parameters (dataset, ids), used to split the dataset into two subsets using article ids.
     :param dataloader: function
-        The method, with parameters (dataset, train, batch_size) that returns a Dataloader.
+        The method, with parameters (dataset, train, batch_size) that returns an ArrayLoader.
     :param alpha: float
         The regularization term.
     :param max_iter: int
@@ -76,27 +126,98 @@ def cross_validate(loss, penalty, split_ids, dataset, subset, dataloader, alpha,
     train_results = Results()
     test_results = Results()
 
+    data = (split_ids, dataset, subset, dataloader)
     for n, (train_indices, test_indices) in enumerate(kf.split(split_ids)):
         new_prefix = prefix + f'{int(100 * n/cv_folds)}% {10 * n // cv_folds * "█"}'.ljust(20)
-        # Create the model
-        classifier = SGDClassifier(loss=loss, alpha=alpha, penalty=penalty, warm_start=True)
+        train_scores, test_scores = cross_validation_fold(data, loss, penalty, alpha, max_iter, train_indices,
+                                                          test_indices, new_prefix)
+        train_results.add_scores(train_scores)
+        test_results.add_scores(test_scores)
 
-        # Split the dataset into train and test
-        train_ids = split_ids[train_indices]
-        train_dataset = subset(dataset, train_ids)
-        train_loader = dataloader(train_dataset, train=True, batch_size=10)
+    return train_results, test_results
 
-        test_ids = split_ids[test_indices]
-        test_dataset = subset(dataset, test_ids)
-        test_loader = dataloader(test_dataset, train=False, batch_size=len(test_dataset))
 
-        classifier, _ = train(classifier, train_loader, test_loader, max_iter, new_prefix)
+def cross_validate_grid(parameters, split_ids, dataset, subset, dataloader, max_iter, cv_folds, jobs=1):
+    """
+    Performs cross-validation for several models on a dataset, training the folds of all models in parallel.
 
-        train_loader = dataloader(train_dataset, train=False, batch_size=len(train_dataset))
-        train_results.add_scores(evaluate(classifier, train_loader))
-        test_results.add_scores(evaluate(classifier, test_loader))
+    :param parameters: list(Tuple(string, string, float))
+        The loss, penalty and regularization term of each model.
+    :param split_ids: list(int)
+        The ids of the articles in the dataset. Used to split them into subsets for cross-validation.
+    :param dataset: backend.ml.array_dataset.ArrayDataset
+        The dataset to use for cross-validation.
+    :param subset: function
+        The method, with parameters (dataset, ids), used to split the dataset into two subsets using article ids.
+    :param dataloader: function
+        The method, with parameters (dataset, train, batch_size) that returns an ArrayLoader.
+    :param max_iter: int
+        The maximum number of epochs to train on.
+    :param cv_folds: int
+        The number of cross-validation folds to perform.
+    :param jobs: int
+        The number of processes training folds.
+    :return: list(Tuple(Results, Results))
+        The results on the training and test sets for each model
+    """
+    folds = list(KFold(n_splits=cv_folds).split(split_ids))
+    jobs_args = [(loss, penalty, alpha, max_iter, train_indices, test_indices)
+                 for loss, penalty, alpha in parameters for train_indices, test_indices in folds]
+    scores = iter(run_jobs(cross_validation_fold, (split_ids, dataset, subset, dataloader), jobs_args, jobs))
+
+    results = []
+    for _ in parameters:
+        train_results = Results()
+        test_results = Results()
+        for _ in folds:
+            train_scores, test_scores = next(scores)
+            train_results.add_scores(train_scores)
+            test_results.add_scores(test_scores)
+        results.append((train_results, test_results))
+    return results
+
+
+def cross_validation_fold(data, loss, penalty, alpha, max_iter, train_indices, test_indices, prefix=''):
+    """
+    Trains a model on a cross-validation fold, and evaluates it.
 
-    return train_results, test_results
+    :param data: Tuple(list(int), backend.ml.array_dataset.ArrayDataset, function, function)
+        The ids of the articles in the dataset, the dataset, and the subset and dataloader methods, as used in
+        cross_validate.
+    :param loss: string
+        One of {'log', 'hinge'}. The loss function to use.
+    :param penalty: string
+        One of {'l1', 'l2}. The penalty to use for training
+    :param alpha: float
+        The regularization term.
+    :param max_iter: int
+        The maximum number of epochs to train on.
+    :param train_indices: np.array(int)
+        The indices of the articles of the training set in split_ids.
+    :param test_indices: np.array(int)
+        The indices of the articles of the test set in split_ids.
+    :param prefix: String
+        The prefix to the string indicating the progression of the training
+    :return: dict, dict
+        The scores on the training and test sets, as returned by evaluate.
+    """
+    split_ids, dataset, subset, dataloader = data
+    # Create the model
+    classifier = SGDClassifier(loss=loss, alpha=alpha, penalty=penalty, warm_start=True)
+
+    # Split the dataset into train and test
+    train_ids = split_ids[train_indices]
+    train_dataset = subset(dataset, train_ids)
+    train_loader = dataloader(train_dataset, train=True, batch_size=10)
+
+    test_ids = split_ids[test_indices]
+    test_dataset = subset(dataset, test_ids)
+    test_loader = dataloader(test_dataset, train=False, batch_size=len(test_dataset))
+
+    classifier, _ = train(classifier, train_loader, test_loader, max_iter, prefix)
+
+    train_loader = dataloader(train_dataset, train=False, batch_size=len(train_dataset))
+    return evaluate(classifier, train_loader), evaluate(classifier, test_loader)
 
 
 def evaluate(classifier, dataloader):
@@ -105,8 +226,8 @@ def evaluate(classifier, dataloader):
 
     :param classifier: SGDClassifier
         The classifier to evaluate.
-    :param dataloader: Dataloader
-        The dataloader containing the data to evaluate the classifier on.
+    :param dataloader: backend.ml.array_dataset.ArrayLoader
+        The loader containing the data to evaluate the classifier on.
     :return: dict
         A dictionary containing the scores of the classifier on the dataset contained in the dataloader. Keys:
             * 'accuracy': the model's accuracy
@@ -1,6 +1,8 @@
 from django.contrib.postgres.fields import JSONField
 from django.db import models
-from django.db.models.fields import TextField, IntegerField, BooleanField, CharField
+from django.db.models.fields import TextField, IntegerField, BooleanField, CharField, FloatField
+
+from backend.fields import BitListField, Int32ListField
 
 
 class Article(models.Model):
@@ -14,14 +16,14 @@ class Article(models.Model):
     people = JSONField()
     # Article text surrounded by a list of tokens
     tokens = JSONField()
-    # List of all sentence indices that are the ends of paragraphs
-    paragraphs = JSONField()
-    # List of all token indices that are the ends of sentences
-    sentences = JSONField()
+    # List of all sentence indices that are the ends of paragraphs, stored as 32 bits integers
+    paragraphs = Int32ListField(key='paragraphs')
+    # List of all token indices that are the ends of sentences, stored as 32 bits integers
+    sentences = Int32ListField(key='sentences')
     # List of boolean values {0, 1} representing if a sentence is fully labeled or
     labeled = JSONField()
-    # List of boolean values {0, 1} representing if a token is in between quotes or not
-    in_quotes = JSONField()
+    # List of boolean values {0, 1} representing if a token is in between quotes or not, stored as a bit per token
+    in_quotes = BitListField(key='in_quotes')
     # List of values, where value j is in (0, 1) representing the confidence of the current ML models predictions in
     # deciding if sentence j is a quote or not. 1 means absolute confidence, while 0 means completely unsure.
     confidence = JSONField()
@@ -31,6 +33,51 @@ class Article(models.Model):
     source = CharField(max_length=200)
     # Date of instance creation
     created_at = models.DateTimeField(auto_now_add=True)
+    # The serialized spaCy.Doc of each sentence in the article, so that it doesn't need to be parsed again. Should be
+    # deferred when loading articles that aren't used to extract features.
+    parsed = models.BinaryField(null=True, blank=True, editable=False)
+    # Copies of labeled['fully_labeled'] and confidence['min_confidence'], so that they can be used in indexed filters.
+    # They are updated from the JSON fields in save().
+    fully_labeled = IntegerField(default=0, editable=False)
+    min_confidence = FloatField(default=0, editable=False)
+    # The version of the quote detection model that computed the confidences, so that stale confidences can be found
+    confidence_version = CharField(max_length=64, blank=True, default='', editable=False)
+
+    class Meta:
+        indexes = [
+            # Used to find the articles with stale confidences
+            models.Index(fields=['fully_labeled', 'confidence_version'], name='article_confidence_version_idx'),
+        ]
+
+    def sync_promoted_fields(self):
+        """
+        Copies the values of the JSON fields used in filters to their own columns. Needs to be called before the
+        article is saved with bulk_create or bulk_update, as they don't call save().
+
+        :return: list(string)
+            The names of the columns that were updated.
+        """
+        deferred = self.get_deferred_fields()
+        updated = []
+        if 'labeled' not in deferred:
+            self.fully_labeled = self.labeled['fully_labeled']
+            updated.append('fully_labeled')
+        if 'confidence' not in deferred:
+            self.min_confidence = self.confidence['min_confidence']
+            updated.append('min_confidence')
+        return updated
+
+    def save(self, *args, **kwargs):
+        updated = self.sync_promoted_fields()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            if 'labeled' in update_fields and 'fully_labeled' in updated:
+                update_fields.add('fully_labeled')
+            if 'confidence' in update_fields and 'min_confidence' in updated:
+                update_fields.add('min_confidence')
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f'Article id: {self.id}'
@@ -54,7 +101,68 @@ class UserLabel(models.Model):
     admin_label = BooleanField()
     # Date of instance creation
     created_at = models.DateTimeField(auto_now_add=True)
+    # If the user didn't know how to label the sentence (labels['labels'] is empty). Updated from the labels in save().
+    is_empty_label = BooleanField(default=False, editable=False)
+
+    class Meta:
+        indexes = [
+            # Used to check if a user already labeled a sentence
+            models.Index(fields=['session_id', 'article', 'sentence_index'], name='userlabel_session_idx'),
+            # Used to aggregate the valid labels of sentences
+            models.Index(fields=['article', 'is_empty_label', 'sentence_index'], name='userlabel_sentence_idx'),
+        ]
+
+    def sync_promoted_fields(self):
+        """
+        Copies the values of the JSON fields used in filters to their own columns. Needs to be called before the label
+        is saved with bulk_create or bulk_update, as they don't call save().
+        """
+        self.is_empty_label = self.labels['labels'] == []
+
+    def save(self, *args, **kwargs):
+        self.sync_promoted_fields()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'labels' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'is_empty_label'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f'Label id: {self.id}, Session id: {self.session_id}, {self.article}, Sentence Number: ' \
                f'{self.sentence_index}'
+
+
+class PendingTask(models.Model):
+    """
+    A paragraph or sentence of an article that still needs to be labelled. There is a row for every task that can be
+    given to a user, which is kept up to date when the labels or confidences of the article change, so that finding the
+    next labelling task is a single index scan.
+    """
+    PARAGRAPH = 'paragraph'
+    SENTENCE = 'sentence'
+
+    # The article containing the paragraph or sentence
+    article = models.ForeignKey(Article, on_delete=models.CASCADE)
+    # The newspaper in which the article was published
+    source = CharField(max_length=200)
+    # The minimum confidence of the article, as tasks from the hardest articles are given first
+    article_confidence = FloatField()
+    # The order in which tasks are given inside an article. The task for a whole paragraph comes before the tasks for
+    # each of its sentences.
+    position = IntegerField()
+    # If the whole paragraph (PARAGRAPH) or only some sentences (SENTENCE) need to be labelled
+    task = CharField(max_length=20)
+    # The index of the paragraph in the article
+    paragraph = IntegerField()
+    # The index of the first and last sentences to label. A user that already labeled the first sentence isn't given
+    # the task
+    first_sentence = IntegerField()
+    last_sentence = IntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['source', 'article_confidence', 'article', 'position'], name='pendingtask_source_idx'),
+            models.Index(fields=['article_confidence', 'article', 'position'], name='pendingtask_order_idx'),
+        ]
+
+    def __str__(self):
+        return f'Pending task: {self.article}, {self.task} {self.first_sentence}-{self.last_sentence}'
@@ -1,9 +1,11 @@
-import random
+from io import StringIO
 
 import spacy
+from django.core.management import call_command
 from django.test import TestCase
 
-from backend.db_management import add_user_label_to_db, add_article_to_db, load_hardest_articles
+from backend.db_management import add_user_label_to_db, add_user_labels_to_db, add_article_to_db, add_tags_to_db, \
+    labelling_tasks, request_labelling_task, COUNT_THRESHOLD
 from backend.frontend_parsing.frontend_to_postgre import *
 from backend.frontend_parsing.postgre_to_frontend import *
 from backend.helpers import *
@@ -227,6 +229,53 @@ class TaskParsingTestCase(TestCase):
         self.assertEquals(label_1.author_index['author_index'], author_index_1)
 
 
+class RefreshStatusTestCase(TestCase):
+
+    def setUp(self):
+        # Add the articles to the database
+        self.a1 = add_article_to_db('../data/article01.xml', nlp, 'Heidi.News')
+        self.a2 = add_article_to_db('../data/article02clean.xml', nlp, 'Heidi.News')
+
+    def test_refresh_status(self):
+        """Checks that the labeled status of articles is recomputed from their user labels"""
+        # Sentence 0 is labeled by an admin, sentence 1 by enough users, sentence 2 by too few and sentence 3 skipped
+        add_user_label_to_db(0, self.a1.id, 0, [0, 0, 0], [], True)
+        for user_id in range(COUNT_THRESHOLD):
+            add_user_label_to_db(user_id, self.a1.id, 1, [0, 1, 1], [0], False)
+        add_user_label_to_db(0, self.a1.id, 2, [0, 0, 0], [], False)
+        add_user_label_to_db(0, self.a1.id, 3, [], [], False)
+        num_sentences = len(self.a2.sentences['sentences'])
+        add_user_labels_to_db(0, self.a2.id, [(s_id, [0], []) for s_id in range(num_sentences)], True)
+
+        # The stored status of both articles is out of date
+        for article, fully_labeled in [(self.a1, 1), (self.a2, 0)]:
+            num_sentences = len(article.sentences['sentences'])
+            Article.objects.filter(id=article.id).update(
+                labeled={'labeled': num_sentences * [fully_labeled], 'fully_labeled': fully_labeled},
+                fully_labeled=fully_labeled,
+            )
+
+        out = StringIO()
+        call_command('refreshstatus', stdout=out)
+        self.assertIn('refreshed the status of 2 article(s)', out.getvalue())
+
+        a1 = Article.objects.get(id=self.a1.id)
+        self.assertEquals(a1.labeled['labeled'][:4], [1, 1, 0, 0])
+        self.assertEquals(sum(a1.labeled['labeled']), 2)
+        self.assertEquals(a1.labeled['fully_labeled'], 0)
+        self.assertEquals(a1.fully_labeled, 0)
+        self.assertEquals(a1.min_confidence, a1.confidence['min_confidence'])
+        self.assertEquals(a1.confidence['predictions'], len(a1.sentences['sentences']) * [0])
+        self.assertTrue(PendingTask.objects.filter(article=a1, first_sentence=2).exists())
+
+        a2 = Article.objects.get(id=self.a2.id)
+        self.assertEquals(sum(a2.labeled['labeled']), len(a2.sentences['sentences']))
+        self.assertEquals(a2.labeled['fully_labeled'], 1)
+        self.assertEquals(a2.fully_labeled, 1)
+        self.assertEquals(list(Article.objects.filter(fully_labeled=1)), [a2])
+        self.assertFalse(PendingTask.objects.filter(article=a2).exists())
+
+
 class TaskLoadingTestCase(TestCase):
 
     def setUp(self):
@@ -282,23 +331,84 @@ class TaskLoadingTestCase(TestCase):
                                          ". ", "Comme ", "camouflage ", "vis-à-vis ", "des ", "proies", ", ", "il ",
                                          "y ", "a ", "mieux", "!"])
 
-    def test_load_hardest_articles(self):
-        """Checks that the method to extract the hardest articles to predict works"""
-        # Generate new confidence numbers, between 0 and 10000
-        # (It will be between 0 and 100 in reality but more variance is needed here)
-        confidences = []
-        for (i, a) in enumerate(Article.objects.all()):
-            old_confidences = a.confidence['confidence']
-            new_confidences = [random.randint(0, 10000) for _ in old_confidences]
-            min_confidence = min(new_confidences)
-            a.confidence = {'confidence': new_confidences, 'min_confidence': min_confidence}
-            a.save()
-            confidences.append(min_confidence)
-
-        confidences.sort(key=lambda x: x)
-        confidences = confidences[:2]
-
-        for i, a in enumerate(load_hardest_articles(2)):
-            min_conf = a.confidence['min_confidence']
-            self.assertEquals(min_conf, confidences[i])
-        return
+    def test_pending_tasks(self):
+        """Checks that the pending labelling tasks are kept up to date when an article is labeled"""
+        tasks = PendingTask.objects.filter(article=self.a1).order_by('position')
+        expected = pending_task_fields(Article.objects.get(id=self.a1.id))
+        self.assertEquals(len(tasks), len(expected))
+        for task, fields in zip(tasks, expected):
+            self.assertEquals(task.first_sentence, fields['first_sentence'])
+            self.assertEquals(task.last_sentence, fields['last_sentence'])
+            self.assertEquals(task.task, fields['task'])
+
+        # Once a sentence is labeled by an admin, it isn't a task anymore
+        add_user_label_to_db(1, self.a1.id, 0, [0, 0, 0], [], True)
+        sentence_tasks = PendingTask.objects.filter(article=self.a1, task=PendingTask.SENTENCE)
+        self.assertFalse(sentence_tasks.filter(first_sentence=0).exists())
+        self.assertEquals(len(sentence_tasks), len(self.a1.sentences['sentences']) - 1)
+
+    def test_labelling_tasks(self):
+        """Checks that tasks are given from the hardest article first, except the ones the session already labeled"""
+        for article, confidence in [(self.a1, 0.5), (self.a2, 0.1), (self.a3, 0.3)]:
+            num_sentences = len(article.sentences['sentences'])
+            change_confidence(article.id, num_sentences * [confidence], num_sentences * [0])
+        tasks = list(labelling_tasks('session'))
+        self.assertEquals(len(tasks), PendingTask.objects.count())
+        self.assertEquals(tasks[0].article_id, self.a2.id)
+        self.assertEquals(tasks[-1].article_id, self.a1.id)
+        order = [(task.article_confidence, task.article_id, task.position) for task in tasks]
+        self.assertEquals(order, sorted(order))
+        self.assertEquals(request_labelling_task('session')['article_id'], self.a2.id)
+
+        # The sentence still needs other labels, but isn't given again to the session that labeled it
+        add_user_label_to_db('session', self.a2.id, 0, [0, 0, 0], [], False)
+        self.assertTrue(PendingTask.objects.filter(article=self.a2, first_sentence=0).exists())
+        self.assertFalse(labelling_tasks('session').filter(article=self.a2, first_sentence=0).exists())
+        self.assertTrue(labelling_tasks('other').filter(article=self.a2, first_sentence=0).exists())
+        self.assertEquals(labelling_tasks('session', 'Parisien').count(), 0)
+
+    def test_no_labelling_task(self):
+        """Checks that no task is given once all articles are fully labeled"""
+        for article in [self.a1, self.a2, self.a3]:
+            num_sentences = len(article.sentences['sentences'])
+            add_user_labels_to_db(0, article.id, [(s_id, [0], []) for s_id in range(num_sentences)], True)
+        self.assertEquals(labelling_tasks('session').count(), 0)
+        self.assertIsNone(request_labelling_task('session'))
+
+    def test_promoted_fields(self):
+        """Checks that the columns copied from the JSON fields are kept in sync with them"""
+        num_sentences = len(self.a1.sentences['sentences'])
+        change_confidence(self.a1.id, num_sentences * [0.5], num_sentences * [0])
+        article = Article.objects.get(id=self.a1.id)
+        self.assertEquals(article.min_confidence, 0.5)
+        self.assertEquals(article.fully_labeled, 0)
+
+        for s_id in range(num_sentences):
+            add_user_label_to_db(1, self.a1.id, s_id, [0], [], True)
+        self.assertEquals(Article.objects.get(id=self.a1.id).fully_labeled, 1)
+        self.assertEquals(list(Article.objects.filter(fully_labeled=1)), [self.a1])
+
+        label = add_user_label_to_db(2, self.a1.id, 0, [], [], False)
+        self.assertTrue(UserLabel.objects.get(id=label.id).is_empty_label)
+        self.assertEquals(UserLabel.objects.filter(article=self.a1, is_empty_label=False).count(), num_sentences)
+
+    def test_add_user_labels(self):
+        """Checks that labels for several sentences are added at once, and that the sentences become labeled"""
+        sentence_labels = [(0, [0, 0, 0], []), (1, [0, 1, 1], [0]), (2, [], [])]
+        for user_id in range(COUNT_THRESHOLD):
+            userlabels = add_user_labels_to_db(user_id, self.a1.id, sentence_labels, False)
+            self.assertEquals([userlabel.sentence_index for userlabel in userlabels], [0, 1, 2])
+        self.assertEquals(UserLabel.objects.filter(article=self.a1).count(), 3 * COUNT_THRESHOLD)
+        labeled = Article.objects.get(id=self.a1.id).labeled['labeled']
+        self.assertEquals(labeled[:3], [1, 1, 0])
+        self.assertIsNone(add_user_labels_to_db(0, -1, sentence_labels, False))
+
+    def test_add_tags(self):
+        """Checks that the tags of a task are split into the sentences of the locked article"""
+        first_end, second_end = self.a1.sentences['sentences'][:2]
+        tags = (first_end + 1) * [0] + (second_end - first_end) * [1]
+        userlabels = add_tags_to_db(0, self.a1.id, [0, 1], 0, 1, tags, [0], False)
+        self.assertEquals([userlabel.sentence_index for userlabel in userlabels], [0, 1])
+        self.assertEquals(sum(userlabels[1].labels['labels']), second_end - first_end)
+        self.assertIsNone(add_tags_to_db(0, -1, [0, 1], 0, 1, tags, [0], False))
+        self.assertIsNone(reset_confidences(-1, 0, 1))
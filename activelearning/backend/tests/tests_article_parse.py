@@ -5,6 +5,8 @@ from django.test import TestCase
 
 from backend.db_management import add_article_to_db
 from backend.models import Article
+from backend.xml_parsing.doc_cache import load_sentence_docs
+from backend.xml_parsing.xml_to_postgre import extract_sentence_spans
 
 
 class ArticleParsingTestCase(TestCase):
@@ -57,3 +59,16 @@ class ArticleParsingTestCase(TestCase):
         confidence = parsed_article['confidence']
         self.assertEqual(article.confidence['confidence'], confidence)
         self.assertEqual(article.confidence['min_confidence'], 0)
+
+    def test_articles_parsed(self):
+        article = Article.objects.all()[0]
+        self.assertIsNotNone(article.parsed)
+        sentence_docs = load_sentence_docs(article, self.nlp)
+        expected_docs = extract_sentence_spans(article.text, self.nlp)
+        self.assertEqual(len(sentence_docs), len(article.sentences['sentences']))
+        for doc, expected in zip(sentence_docs, expected_docs):
+            self.assertEqual([t.text for t in doc], [t.text for t in expected])
+            self.assertEqual([t.lemma_ for t in doc], [t.lemma_ for t in expected])
+            self.assertEqual([t.dep_ for t in doc], [t.dep_ for t in expected])
+            self.assertEqual([(e.start, e.end, e.label_) for e in doc.ents],
+                             [(e.start, e.end, e.label_) for e in expected.ents])
@@ -1,5 +1,6 @@
 from django.test import TestCase
 
+from backend.fields import BitListField, Int32ListField
 from backend.helpers import *
 
 
@@ -127,6 +128,29 @@ class LabelConsensusTestCase(TestCase):
         self.assertEquals(consensus, 2/3)
 
 
+class LabelConsensusBatchTestCase(TestCase):
+    """ Test class for the label_consensus_batch method in the helpers file """
+
+    def test_same_as_label_consensus(self):
+        """ Tests that the consensus of each sentence is the same as the one computed one sentence at a time """
+        sentences_labels = [
+            [],
+            [[0, 0, 1, 1, 0]],
+            [[0, 0, 1, 1, 0], [0, 1, 1, 1, 0], [0, 1, 1, 1, 0]],
+            [[0, 0, 1, 1, 0], [0, 1, 1, 1, 0]],
+            [[0, 1, 1, 1, 0], [0, 1, 1, 1, 0], [0, 1, 1, 1, 0]],
+        ]
+        sentences_authors = [
+            [],
+            [[4, 5]],
+            [[4, 5], [7], [7]],
+            [[4, 5], [5]],
+            [[4, 5], [7], []],
+        ]
+        expected = [label_consensus(labels, authors) for labels, authors in zip(sentences_labels, sentences_authors)]
+        self.assertEquals(label_consensus_batch(sentences_labels, sentences_authors), expected)
+
+
 class IsSentenceLabelledTestCase(TestCase):
     """ Test class for the is_sentence_labelled method in the helpers file """
 
@@ -151,6 +175,58 @@ class ChangeConfidenceTestCase(TestCase):
         self.assertEquals(1, 1)
 
 
+class AggregateArticleLabelsTestCase(TestCase):
+    """ Test class for the aggregate_article_labels method in the helpers file """
+
+    def setUp(self):
+        self.article = Article.objects.create(
+            name='Test', text='', people={'people': [], 'mentions': []}, tokens={'tokens': 6 * ['a ']},
+            paragraphs={'paragraphs': [2]}, sentences={'sentences': [1, 3, 5]},
+            labeled={'labeled': [0, 0, 0], 'fully_labeled': 0}, in_quotes={'in_quotes': 6 * [0]},
+            confidence={'confidence': [0, 0, 0], 'predictions': [0, 0, 0], 'min_confidence': 0},
+            admin_article=False, source='Heidi.News',
+        )
+        userlabels = [
+            ('a', 0, [1, 1], [4]),
+            ('b', 0, [1, 1], [4]),
+            ('c', 0, [0, 1], [5]),
+            ('a', 2, [0, 0], []),
+            ('b', 2, [], []),
+        ]
+        for session_id, sentence_index, labels, authors in userlabels:
+            UserLabel.objects.create(article=self.article, session_id=session_id, labels={'labels': labels},
+                                     sentence_index=sentence_index, author_index={'author_index': authors},
+                                     admin_label=False)
+
+    def test_same_as_aggregate_label(self):
+        """ Tests that the labels of each sentence are the same as the ones computed one sentence at a time. """
+        article_labels = aggregate_article_labels(self.article)
+        self.assertEquals(len(article_labels), 3)
+        for sentence_index, sentence_labels in enumerate(article_labels):
+            self.assertEquals(sentence_labels, aggregate_label(self.article, sentence_index))
+        self.assertEquals(article_labels[1], ([], [], 0))
+        self.assertEquals(aggregate_articles_labels([self.article]), {self.article.id: article_labels})
+
+
+class PackedListFieldTestCase(TestCase):
+    """ Tests that the packed fields store the same values as the JSON fields they replace """
+
+    def test_1_bit_list(self):
+        field = BitListField(key='in_quotes')
+        for values in [[], [1], [0, 1, 1, 0, 0, 0, 0, 0, 1], [1] * 17]:
+            packed = field.get_prep_value({'in_quotes': values})
+            self.assertEquals(len(packed), 4 + (len(values) + 7) // 8)
+            self.assertEquals(field.from_db_value(packed, None, None), {'in_quotes': values})
+            self.assertEquals(field.to_python(packed), {'in_quotes': values})
+
+    def test_2_int32_list(self):
+        field = Int32ListField(key='sentences')
+        for values in [[], [12], [3, 17, 250, 70000]]:
+            packed = field.get_prep_value({'sentences': values})
+            self.assertEquals(len(packed), 4 * len(values))
+            self.assertEquals(field.from_db_value(memoryview(packed), None, None), {'sentences': values})
+
+
 class QuoteStartSentenceTestCase(TestCase):
     """ Test class for the quote_start_sentence method in the helpers file """
 
@@ -1,11 +1,32 @@
 import csv
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
 
+import numpy as np
+import spacy
 from django.test import TestCase
+from django.utils import timezone
+from sklearn.linear_model import SGDClassifier
+from sklearn.preprocessing import PolynomialFeatures
+from spacy.tokens import Doc, Span
 
 from backend.db_management import add_article_to_db, add_user_label_to_db, \
-    load_sentence_labels, load_unlabeled_sentences
+    load_labeled_articles, load_sentence_labels, load_unlabeled_sentences
 from backend.helpers import change_confidence
-from backend.ml.quote_detection import evaluate_quote_detection, train_quote_detection, predict_quotes
+from backend.ml.array_dataset import ArrayDataset, ArrayLoader, article_rows, balanced_weights, subset_rows
+from backend.ml.author_prediction_feature_extraction import attribution_features_baseline_batch
+from backend.ml.confidence_refresh import scores_to_confidences
+from backend.ml.feature_expansion import PolynomialExpansion
+from backend.ml.feature_store import FeatureStore
+from backend.ml.helpers import ModelRegistry, save_model
+from backend.ml.quote_attribution_dataset import parse_article_ovo
+from backend.ml.quote_attribution_feature_extraction import attribution_features_ovo_3
+from backend.ml.quote_detection import evaluate_quote_detection, train_quote_detection, predict_quotes, \
+    update_quote_detection
+from backend.ml.quote_detection_feature_extraction import feature_extraction_batch
+from backend.ml.retrain import train_models
 from backend.models import Article
 from backend.xml_parsing.helpers import load_nlp
 
@@ -299,6 +320,20 @@ def add_correct_labels(test_article, test_article_id):
         add_user_label_to_db(0000, test_article_id, index, labels, authors, True)
 
 
+def assign_test_set(article_id, test_set):
+    """
+    Assigns a fully labeled article to the test or training set, instead of leaving it to chance.
+
+    :param article_id: int
+        The id of the article.
+    :param test_set: int
+        1 to assign the article to the test set, 0 to assign it to the training set.
+    """
+    article = Article.objects.get(id=article_id)
+    article.labeled['test_set'] = test_set
+    article.save(update_fields=['labeled'])
+
+
 """ The language model. """
 nlp = load_nlp()
 
@@ -380,4 +415,309 @@ class QuoteDetectionTestCase(TestCase):
             print(f'\nConfidences for article 3: {article_3.confidence["confidence"]}\n'
                   f'Minimum Confidence: {conf}\n')
 
-        print('\nFinished Test 1\n\n\n')
\ No newline at end of file
+        print('\nFinished Test 1\n\n\n')
+
+
+class IncrementalQuoteDetectionTestCase(TestCase):
+    """ Case where the quote detection model is updated with the articles labeled since it was trained """
+
+    def setUp(self):
+        self.a1 = add_article_to_db('../data/test_article_1.xml', nlp, 'Heidi.News')
+        self.a2 = add_article_to_db('../data/test_article_2.xml', nlp, 'Heidi.News')
+        self.a3 = add_article_to_db('../data/test_article_3.xml', nlp, 'Heidi.News')
+        with open('../data/cue_verbs.csv', 'r') as f:
+            reader = csv.reader(f)
+            self.cue_verbs = set(list(reader)[0])
+
+        add_correct_labels(TEST_1, self.a1.id)
+        add_correct_labels(TEST_2, self.a2.id)
+        assign_test_set(self.a1.id, 0)
+        assign_test_set(self.a2.id, 0)
+        self.model = update_quote_detection(SGDClassifier(alpha=0.01), 5, nlp, self.cue_verbs, None)
+        self.since = timezone.now()
+
+    def test_warm_start(self):
+        coef = self.model.coef_.copy()
+        steps = self.model.t_
+        add_correct_labels(TEST_3, self.a3.id)
+        assign_test_set(self.a3.id, 0)
+        updated = update_quote_detection(self.model, 5, nlp, self.cue_verbs, self.since)
+        # The model keeps being trained from its current weights
+        self.assertIs(updated, self.model)
+        self.assertGreater(updated.t_, steps)
+        self.assertFalse(np.array_equal(updated.coef_, coef))
+
+    def test_rehearsal_from_training_set(self):
+        assign_test_set(self.a1.id, 1)
+        add_correct_labels(TEST_3, self.a3.id)
+        assign_test_set(self.a3.id, 0)
+        with mock.patch('backend.ml.quote_detection.load_labeled_articles', wraps=load_labeled_articles) as load:
+            update_quote_detection(self.model, 5, nlp, self.cue_verbs, self.since, rehearsal=2.0)
+        _, article_ids = load.call_args[0]
+        self.assertEqual(sorted(article_ids), sorted([self.a2.id, self.a3.id]))
+
+    def test_skipped_update(self):
+        # No article was labeled since the model was trained
+        self.assertIsNone(update_quote_detection(self.model, 5, nlp, self.cue_verbs, self.since))
+        # The new article doesn't contain any quote, and no previous article is replayed
+        for index, labels in enumerate(TEST_3['labels']):
+            add_user_label_to_db(0000, self.a3.id, index, len(labels) * [0], [], True)
+        assign_test_set(self.a3.id, 0)
+        self.assertIsNone(update_quote_detection(self.model, 5, nlp, self.cue_verbs, self.since, rehearsal=0))
+
+    def test_trained_at_kept_when_skipped(self):
+        published = {'version': 'version', 'trained_at': self.since}
+        with mock.patch('backend.ml.retrain.read_model_version', return_value=published), \
+                mock.patch('backend.ml.retrain.load_model', return_value=self.model), \
+                mock.patch('backend.ml.retrain.save_model') as save, \
+                mock.patch('backend.ml.retrain.publish_model_version', return_value='version') as publish, \
+                mock.patch('backend.ml.retrain.update_confidences', return_value=({}, 0)):
+            train_models(nlp, self.cue_verbs, 5, incremental=True)
+        save.assert_not_called()
+        publish.assert_called_once_with(self.model, self.model, self.since)
+
+
+class ModelRegistryTestCase(TestCase):
+    """ Case where the trained models are kept in memory """
+
+    def test_model_reloaded_on_change(self):
+        registry = ModelRegistry()
+        with tempfile.TemporaryDirectory() as directory:
+            filepath = os.path.join(directory, 'weights.joblib')
+            save_model([1, 2, 3], filepath)
+            model = registry.get(filepath)
+            self.assertEquals(model, [1, 2, 3])
+            # The model isn't loaded again if the file didn't change
+            self.assertIs(registry.get(filepath), model)
+            # The model is loaded again once the file changes
+            save_model([4, 5, 6], filepath)
+            version = registry.version(filepath)
+            os.utime(filepath, (version + 1, version + 1))
+            self.assertEquals(registry.get(filepath), [4, 5, 6])
+            self.assertEquals(registry.version(filepath), version + 1)
+            # Models are replaced without leaving temporary files
+            self.assertEquals(os.listdir(directory), ['weights.joblib'])
+
+
+class PolynomialExpansionTestCase(TestCase):
+    """ Case where features are expanded for a whole matrix at once """
+
+    def test_identical_to_polynomial_features(self):
+        X = np.array([[0, 3, 1, 7, 2], [5, 1, 0, 2, 9], [1, 1, 4, 0, 3]])
+        for degree, interaction_only in [(2, True), (5, True), (2, False)]:
+            poly = PolynomialFeatures(degree, interaction_only=interaction_only, include_bias=True)
+            expected = np.array([poly.fit_transform(x.reshape((-1, 1))).reshape((-1,)) for x in X])
+            expansion = PolynomialExpansion(degree, interaction_only=interaction_only, include_bias=True)
+            self.assertTrue(np.array_equal(expansion.transform(X), expected))
+            self.assertTrue(np.array_equal(expansion.transform(X[0]), expected[0]))
+
+
+class ScoresToConfidencesTestCase(TestCase):
+    """ Case where the outputs of a model are mapped to confidences """
+
+    def test_probabilities(self):
+        confidences, predictions = scores_to_confidences(np.array([0.5, 0.1, 0.9, 1]), proba=True)
+        np.testing.assert_allclose(confidences, [0, 0.8, 0.8, 1])
+        self.assertEqual(predictions.tolist(), [0, 0, 1, 1])
+
+    def test_hinge_independent_of_other_scores(self):
+        scores = np.array([-2, 0, 0.5, 40])
+        confidences, predictions = scores_to_confidences(scores, proba=False)
+        # Same confidences as the probabilities of a logistic model with the same scores
+        np.testing.assert_allclose(confidences, 2 * np.abs(1 / (1 + np.exp(-scores)) - 0.5))
+        self.assertEqual(predictions.tolist(), [0, 0, 1, 1])
+        # Scoring a sentence on its own gives it the same confidence
+        confidences_alone, _ = scores_to_confidences(scores[:1], proba=False)
+        self.assertEqual(confidences_alone[0], confidences[0])
+
+
+class ArrayLoaderTestCase(TestCase):
+    """ Case where mini-batches are loaded from a dense dataset """
+
+    def test_balanced_batches(self):
+        dataset = ArrayDataset([np.full(3, i) for i in range(8)], [0, 1, 0, 0, 2, 1, 0, 0])
+        self.assertEqual(dataset.features.dtype, np.float32)
+        weights, num_samples = balanced_weights(dataset.labels)
+        self.assertEqual(num_samples, 4)
+        # Datapoints of a class other than 0 and 1 are never sampled
+        self.assertEqual(weights[4], 0)
+        loader = ArrayLoader(dataset, 3, weights, num_samples)
+        self.assertEqual(len(loader), 2)
+        batches = list(loader)
+        self.assertEqual([len(y) for _, y in batches], [3, 1])
+        for X, y in batches:
+            self.assertTrue(np.array_equal(X[:, 0], dataset.features[X[:, 0].astype(int), 0]))
+            self.assertTrue(np.array_equal(y, dataset.labels[X[:, 0].astype(int)]))
+
+    def test_subset_in_order(self):
+        dataset = ArrayDataset([np.full(2, i) for i in range(6)], [0, 1, 0, 1, 0, 1])
+        subset = subset_rows(dataset, article_rows([(4, 5), (0, 1)]))
+        X, y = next(iter(ArrayLoader(subset)))
+        self.assertEqual(X[:, 0].tolist(), [4, 5, 0, 1])
+        self.assertEqual(y.tolist(), [0, 1, 0, 1])
+
+
+class FeatureStoreTestCase(TestCase):
+    """ Case where the features of a dataset are stored on disk """
+
+    def test_stored_dataset_reopened(self):
+        dataset = ArrayDataset([np.full(3, i) for i in range(5)], [0, 1, 1, 0, 1])
+        article_features = {7: (0, 1, 2), 3: (2, 4, 1)}
+        with tempfile.TemporaryDirectory() as directory:
+            store = FeatureStore('test', directory)
+            self.assertIsNone(store.load('features', 'corpus'))
+            store.save('features', 'corpus', dataset.features, dataset.labels, article_features)
+            features, labels, stored_article_features = store.load('features', 'corpus')
+            self.assertIsInstance(features, np.memmap)
+            self.assertTrue(np.array_equal(features, dataset.features))
+            self.assertEqual(labels.tolist(), [0, 1, 1, 0, 1])
+            # The order of the articles is kept
+            self.assertEqual(list(stored_article_features.items()), list(article_features.items()))
+            # The features are extracted again when the feature extraction or the corpus change
+            self.assertIsNone(store.load('other features', 'corpus'))
+            self.assertIsNone(store.load('features', 'other corpus'))
+            self.assertFalse(any(path.endswith('.tmp') for path in os.listdir(directory)))
+
+
+class AuthorPredictionFeaturesTestCase(TestCase):
+    """ Case where the author prediction features of all speakers in an article are extracted at once """
+
+    def test_identical_to_single_speaker(self):
+        def token(dep, lemma='a'):
+            return SimpleNamespace(dep_=dep, lemma_=lemma)
+
+        sentence_indices = [2, 5, 8, 11]
+        in_quotes = 3 * [0] + 3 * [1] + 6 * [0]
+        sentences = [
+            [token('nsubj', 'dire'), token('obj'), token('obj')],
+            [token('nsubj'), token('parataxis'), token('obj')],
+            [token('nsubj', 'dire'), token('obj'), token('obj')],
+            [token('obj'), token('nsubj'), token('punct')],
+        ]
+        quotes = [0, 2]
+        speakers = [{'start': 3, 'end': 3}, {'start': 9, 'end': 10}, {'start': 0, 'end': 1}]
+        features = attribution_features_baseline_batch(sentence_indices, in_quotes, sentences, quotes, speakers,
+                                                       {'dire'})
+        # Features computed by the original extraction, one speaker at a time
+        expected = [
+            [1, 0, 0, 0, 1, 1, 1, 1, 100, 1, 0, 0, 1, 1, 1, 1, 0, 0, 0, 0],
+            [1, 1, 0, 0, 0, 0, 1, 0, 1, 100, 0, 0, 2, 0, 2, 0, 2, 0, 2, 0],
+            [1, 1, 1, 1, 0, 0, 0, 1, 100, 2, 0, 1, 0, 1, 0, 1, 0, 2, 0, 2],
+        ]
+        self.assertEqual(features.shape, (3, 20))
+        self.assertEqual(features.tolist(), expected)
+
+
+class QuoteAttributionOvoTestCase(TestCase):
+    """ Case where the one-vs-one quote attribution features of all pairs of candidates are built at once """
+
+    def setUp(self):
+        sentences = [[SimpleNamespace(i=i, dep_='nsubj', lemma_='dire', children=[]) for i in range(3)]
+                     for _ in range(4)]
+        for sentence in sentences:
+            sentence[0].children = [sentence[1]]
+        mentions = [{'start': 1, 'end': 1}, {'start': 4, 'end': 5}, {'start': 9, 'end': 9}]
+        article = SimpleNamespace(id=1, sentences={'sentences': [2, 5, 8, 11]}, people={'mentions': mentions})
+        self.article_dict = {'article': article, 'sentences': sentences, 'quotes': [1, 3], 'authors': [[9], []]}
+
+    def test_identical_to_single_mention(self):
+        features, labels, num_quotes, num_candidates, _, true_indices = \
+            parse_article_ovo(self.article_dict, None, 3, {'dire'})
+        self.assertEqual((num_quotes, num_candidates), (2, 4))
+        self.assertEqual(len(features), 2 * 4 * 3)
+        self.assertEqual(true_indices.tolist(), [2, 3])
+        article = self.article_dict['article']
+        mentions = article.people['mentions'] + [None]
+        # Features of the pair of the first and third candidates of the second quote
+        single_1 = attribution_features_ovo_3(article, self.article_dict['sentences'], 3, mentions[0], {'dire'}, [1])
+        single_3 = attribution_features_ovo_3(article, self.article_dict['sentences'], 3, mentions[2], {'dire'}, [1])
+        self.assertTrue(np.array_equal(features[12 + 1], np.concatenate((single_1, single_3))))
+        # The weasel is the author of the second quote
+        self.assertEqual(labels[12:24], 3 * [2, 2, 1] + 3 * [0])
+
+    def test_nearest_candidates(self):
+        features, labels, _, num_candidates, candidates, _ = \
+            parse_article_ovo(self.article_dict, None, 2, {'dire'}, max_candidates=1)
+        self.assertEqual(num_candidates, 2)
+        self.assertEqual(len(features), 2 * 2)
+        # The nearest mention to each quote, and the weasel
+        self.assertEqual(candidates.tolist(), [[1, 3], [2, 3]])
+        self.assertEqual(labels, [2, 2, 1, 0])
+
+
+def reference_feature_extraction(sentence, cue_verbs, in_quotes):
+    """
+    Copy of the original quote detection feature extraction, which looped over the tokens of a single sentence, to
+    check that the batched extraction computes the same features.
+    """
+    def any_token(condition):
+        return int(any(condition(index, token) for index, token in enumerate(sentence)))
+
+    return np.array([
+        len(sentence),
+        int('"' in sentence.text),
+        sum(in_quotes),
+        int(len(sentence.ents) > 0),
+        int(len([ne for ne in sentence.ents if ne.label_ == 'PER']) > 0),
+        any_token(lambda _, token: token.lemma_ in cue_verbs),
+        any_token(lambda _, token: token.pos_ == 'PRON'),
+        any_token(lambda _, token: token.dep_ == 'parataxis'),
+        len([token for token in sentence if token.pos_ == 'VERB']),
+        any_token(lambda index, token: token.pos_ == 'VERB' and in_quotes[index] == 1),
+        int(len(in_quotes) == sum(in_quotes)),
+        sum(in_quotes) / len(in_quotes),
+        any_token(lambda _, token: token.text.lower() == 'selon'),
+    ])
+
+
+def make_sentence(vocab, words, pos, deps, lemmas, ents=()):
+    """ Creates an annotated sentence without a language model. """
+    sentence = Doc(vocab, words=words)
+    for token, token_pos, token_dep, token_lemma in zip(sentence, pos, deps, lemmas):
+        token.pos_ = token_pos
+        token.dep_ = token_dep
+        token.lemma_ = token_lemma
+    sentence.ents = [Span(sentence, start, end, label=label) for start, end, label in ents]
+    return sentence
+
+
+class QuoteDetectionFeaturesTestCase(TestCase):
+    """ Case where the quote detection features of many sentences are extracted at once """
+
+    def test_identical_to_single_sentence(self):
+        # The vocabulary of a blank French pipeline, which computes the lexical attributes of the tokens
+        vocab = spacy.blank('fr').vocab
+        sentences = [
+            # A quote
+            make_sentence(vocab, ['"', 'Il', 'pleut', '"', ',', 'dit', 'Marie', 'Curie', '.'],
+                          ['PUNCT', 'PRON', 'VERB', 'PUNCT', 'PUNCT', 'VERB', 'PROPN', 'PROPN', 'PUNCT'],
+                          ['punct', 'nsubj', 'parataxis', 'punct', 'punct', 'ROOT', 'nsubj', 'flat', 'punct'],
+                          ['"', 'il', 'pleuvoir', '"', ',', 'dire', 'Marie', 'Curie', '.'],
+                          [(6, 8, 'PER')]),
+            # A cue verb, without quotes
+            make_sentence(vocab, ['Selon', 'Genève', ',', 'elle', 'affirme', 'tout', '.'],
+                          ['ADP', 'PROPN', 'PUNCT', 'PRON', 'VERB', 'PRON', 'PUNCT'],
+                          ['case', 'obl', 'punct', 'nsubj', 'ROOT', 'obj', 'punct'],
+                          ['selon', 'Genève', ',', 'elle', 'affirmer', 'tout', '.'],
+                          [(1, 2, 'LOC')]),
+            # All tokens inside quotes
+            make_sentence(vocab, ['Nous', 'partirons', 'demain'],
+                          ['PRON', 'VERB', 'ADV'], ['nsubj', 'ROOT', 'advmod'], ['nous', 'partir', 'demain']),
+        ]
+        in_quotes = [[1, 1, 1, 1, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0, 0], [1, 1, 1]]
+        cue_verbs = {'dire', 'affirmer'}
+
+        features = feature_extraction_batch(sentences, cue_verbs, in_quotes)
+        self.assertEqual(features.shape, (3, 13))
+        for sentence_features, sentence, sentence_in_quotes in zip(features, sentences, in_quotes):
+            expected = reference_feature_extraction(sentence, cue_verbs, sentence_in_quotes)
+            self.assertTrue(np.array_equal(sentence_features, expected))
+
+        # An empty sentence has no tokens inside quotes, instead of dividing by 0
+        empty = Doc(vocab, words=[])
+        features = feature_extraction_batch(sentences[:1] + [empty], cue_verbs, in_quotes[:1] + [[]])
+        self.assertTrue(np.array_equal(features[0], reference_feature_extraction(sentences[0], cue_verbs,
+                                                                                 in_quotes[0])))
+        self.assertEqual(features[1, 0], 0)
+        self.assertEqual(features[1, 11], 0)
+        self.assertFalse(np.isnan(features).any())
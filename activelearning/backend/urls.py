@@ -1,6 +1,6 @@
 from django.urls import path
 
-from .views import submit_tags, load_content, load_above, load_below, become_admin, GetCounts
+from .views import submit_tags, load_content, load_above, load_below, become_admin, GetCounts, GetCountsBatch
 
 urlpatterns = [
     path('loadContent/', load_content),
@@ -9,4 +9,5 @@ urlpatterns = [
     path('submitTags/', submit_tags),
     path('admin_tagger/', become_admin),
     path('get_counts', GetCounts.as_view()),
+    path('get_counts_batch', GetCountsBatch.as_view()),
 ]
@@ -7,7 +7,6 @@ import traceback
 import uuid
 from xml.sax.saxutils import escape
 
-from django.core.exceptions import ObjectDoesNotExist
 from django.http import JsonResponse, QueryDict
 from django.views.decorators.csrf import csrf_exempt
 
@@ -18,13 +17,11 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework_api_key.permissions import HasAPIKey
 
-from backend.db_management import add_user_label_to_db, request_labelling_task
-from backend.extraction_pipeline import extract_people_quoted
-from backend.frontend_parsing.frontend_to_postgre import clean_user_labels
+from backend.db_management import add_tags_to_db, add_user_labels_to_db, request_labelling_task
+from backend.extraction_pipeline import extract_people_quoted, extract_people_quoted_batch
 from backend.frontend_parsing.postgre_to_frontend import load_paragraph_above, load_paragraph_below
-from backend.helpers import change_confidence
+from backend.helpers import reset_confidences
 from backend.xml_parsing.helpers import load_nlp
-from .models import Article
 
 
 logger = logging.getLogger(__name__)
@@ -164,34 +161,25 @@ def submit_tags(request):
             authors = data['authors']
             task = data['task']
 
-            try:
-                article = Article.objects.get(id=article_id)
-            except ObjectDoesNotExist:
-                return JsonResponse({'success': False, 'reason': 'Invalid Article ID'})
-
             if labels == []:
                 # The user didn't know how to annotate the sentence.
-                for s in sent_id:
-                    add_user_label_to_db(user_id, article_id, s, [], [], False)
+                userlabels = add_user_labels_to_db(user_id, article_id, [(s, [], []) for s in sent_id], False)
+                if userlabels is None:
+                    return JsonResponse({'success': False, 'reason': 'Invalid Article ID'})
             else:
                 # The user knew how to annotate the sentence.
                 if task == 'paragraph' and sum(labels) > 0:
                     # If the task was to label a paragraph, and the user answered that there were some quotes in the
                     # paragraph, reset the confidences for the whole paragraph to 0.
-                    sentence_confidences = article.confidence['confidence'].copy()
-                    sentence_confidences[first_sent:last_sent + 1] = (last_sent - first_sent + 1) * [0]
-                    change_confidence(article_id, sentence_confidences, article.confidence['predictions'])
+                    if reset_confidences(article_id, first_sent, last_sent) is None:
+                        return JsonResponse({'success': False, 'reason': 'Invalid Article ID'})
                 else:
-                    sentence_ends = article.sentences['sentences']
-                    clean_labels = clean_user_labels(sentence_ends, sent_id, first_sent, last_sent, labels, authors)
-                    logger.warn(clean_labels)
-                    found_quote = False
-                    for sentence in clean_labels:
-                        if sum(sentence['labels']) > 0:
-                            found_quote = True
-                        add_user_label_to_db(user_id, article_id, sentence['index'], sentence['labels'],
-                                             sentence['authors'], admin_tagger)
-                    if found_quote:
+                    # The tags are split into sentences once the article is locked
+                    userlabels = add_tags_to_db(user_id, article_id, sent_id, first_sent, last_sent, labels, authors,
+                                                admin_tagger)
+                    if userlabels is None:
+                        return JsonResponse({'success': False, 'reason': 'Invalid Article ID'})
+                    if any(sum(userlabel.labels['labels']) > 0 for userlabel in userlabels):
                         request.session['quote_count'] += 1
             return JsonResponse({'success': True})
         except KeyError:
@@ -272,18 +260,69 @@ def become_admin(request):
 nlp = load_nlp()
 detector = gender_detector.Detector()
 
-class GetCounts(APIView):
-    def post(self, request):
-        with open('data/cue_verbs.csv', 'r') as f:
-            reader = csv.reader(f)
-            cue_verbs = set(list(reader)[0])
-
-        template = """<?xml version='1.0' encoding='utf-8'?>
+""" The template used to transform raw text into an article in XML format. """
+ARTICLE_TEMPLATE = """<?xml version='1.0' encoding='utf-8'?>
             <article>
                <titre></titre>
                <p>{}</p>
             </article>"""
 
+""" The default number of paragraphs processed at once by the language model in get_counts_batch. """
+COUNTS_BATCH_SIZE = 100
+
+
+def load_cue_verbs():
+    """
+    Loads the list of cue verbs.
+
+    :return: set(string)
+        The set of all "cue verbs", which are verbs that often introduce reported speech.
+    """
+    with open('data/cue_verbs.csv', 'r') as f:
+        reader = csv.reader(f)
+        return set(list(reader)[0])
+
+
+def text_to_xml(t):
+    """
+    Cleans the raw text of an article and transforms it into an article in XML format.
+
+    :param t: string
+        The raw text of the article.
+    :return: string
+        The article in XML format.
+    """
+    clean_t = t.replace("\n", " ")
+    clean_t = clean_t.replace("\\n", " ")
+    clean_t = clean_t.replace("\\\n", " ")
+    clean_t = clean_t.replace("\t", " ")
+    clean_t = clean_t.replace("\\t", " ")
+    clean_t = clean_t.replace("\\\t", " ")
+    return ARTICLE_TEMPLATE.format(escape(clean_t))
+
+
+def count_genders(people):
+    """
+    Guesses the gender of each person from their first name, and counts the number of people of each gender.
+
+    :param people: list(string)
+        The full names of people.
+    :return: dict
+        The number of people for each gender.
+    """
+    first_names = [p.split(" ")[0] for p in people]
+    # FIXME currently we get the firstname by keeping all text before the first space. Might not work for all names
+    genders = [detector.get_gender(n) for n in first_names]
+    counts = defaultdict(int)
+    for key in genders:
+        counts[key] += 1
+    return counts
+
+
+class GetCounts(APIView):
+    def post(self, request):
+        cue_verbs = load_cue_verbs()
+
         # Clean article text
         if "text" not in request.data:
             # Check if data was passed through the form
@@ -294,22 +333,11 @@ class GetCounts(APIView):
         else:
             t = request.data["text"]
 
-        clean_t = t.replace("\n", " ")
-        clean_t = clean_t.replace("\\n", " ")
-        clean_t = clean_t.replace("\\\n", " ")
-        clean_t = clean_t.replace("\t", " ")
-        clean_t = clean_t.replace("\\t", " ")
-        clean_t = clean_t.replace("\\\t", " ")
-        xml_text = template.format(escape(clean_t))
+        xml_text = text_to_xml(t)
 
         # Get default genders
         people = extract_people_quoted(xml_text, nlp, cue_verbs, lazy_baseline=True)
-        first_names = [p.split(" ")[0] for p in people]
-        # FIXME currently we get the firstname by keeping all text before the first space. Might not work for all names
-        genders = [detector.get_gender(n) for n in first_names]
-        counts = defaultdict(int)
-        for key in genders:
-            counts[key] += 1
+        counts = count_genders(people)
 
         """
         # Check for optional gender dictionary
@@ -323,4 +351,37 @@ class GetCounts(APIView):
                 first_names_lower = [n.lower() for n in first_names]
         """
 
-        return Response({"people": people, "counts": counts}) 
+        return Response({"people": people, "counts": counts})
+
+
+class GetCountsBatch(APIView):
+    def post(self, request):
+        """
+        Finds the people cited in many articles at once, and counts them by gender. The request data must contain the
+        key 'texts', a list of the raw text of each article, and can contain the key 'batch_size', the number of
+        paragraphs the language model processes at once.
+
+        The response contains the key 'articles', a list containing a dict with keys 'people' and 'counts' for each
+        article (in the same order as 'texts'), and the key 'counts', the total counts over all articles.
+        """
+        if "texts" not in request.data:
+            raise ValueError(f'key "texts" missing: {request.data}')
+        texts = request.data["texts"]
+        if not isinstance(texts, list):
+            raise ValueError(f'"texts" must be a list, found: {type(texts)}')
+        batch_size = int(request.data.get("batch_size", COUNTS_BATCH_SIZE))
+
+        cue_verbs = load_cue_verbs()
+        xml_texts = [text_to_xml(t) for t in texts]
+        articles_people = extract_people_quoted_batch(xml_texts, nlp, cue_verbs, lazy_baseline=True,
+                                                      batch_size=batch_size)
+
+        articles = []
+        total_counts = defaultdict(int)
+        for people in articles_people:
+            counts = count_genders(people)
+            for key, value in counts.items():
+                total_counts[key] += value
+            articles.append({"people": people, "counts": counts})
+
+        return Response({"articles": articles, "counts": total_counts})
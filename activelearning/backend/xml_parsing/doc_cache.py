@@ -0,0 +1,104 @@
+import hashlib
+
+import spacy
+import srsly
+from spacy.tokens import Doc
+
+from backend.xml_parsing.xml_to_postgre import extract_sentence_spans
+
+"""
+Storage of the spaCy.Doc objects for the sentences of each article, so that articles only need to be parsed by the
+language model once instead of at every training or evaluation run.
+
+The parsed sentences are serialized along with a hash of the article's text and the version of the language model used
+to parse them, and are only used if both still match. They are stored in the `parsed` column of the article when it is
+added to the database, or the first time it's parsed if it was added before.
+"""
+
+
+def text_hash(article_text):
+    """
+    Computes the hash of the text of an article.
+
+    :param article_text: string
+        The article in XML format stored as a string.
+    :return: string
+        The hexadecimal sha1 hash of the text.
+    """
+    return hashlib.sha1(article_text.encode('utf-8')).hexdigest()
+
+
+def model_version(nlp):
+    """
+    Computes a string identifying a language model, so that articles parsed with a different model aren't used.
+
+    :param nlp: spaCy.Language
+        The language model used to tokenize the text.
+    :return: string
+        The version of the language model.
+    """
+    return f'{nlp.meta.get("lang")}_{nlp.meta.get("name")}-{nlp.meta.get("version")}|spacy-{spacy.__version__}|' \
+           f'{",".join(nlp.pipe_names)}'
+
+
+def serialize_sentence_docs(article_text, sentence_docs, nlp):
+    """
+    Serializes the parsed sentences of an article.
+
+    :param article_text: string
+        The article in XML format stored as a string.
+    :param sentence_docs: list(spaCy.Doc)
+        A Doc object for each sentence in the article.
+    :param nlp: spaCy.Language
+        The language model used to parse the article.
+    :return: bytes
+        The serialized sentences.
+    """
+    return srsly.msgpack_dumps({
+        'text_hash': text_hash(article_text),
+        'model_version': model_version(nlp),
+        'docs': [doc.to_bytes() for doc in sentence_docs],
+    })
+
+
+def deserialize_sentence_docs(data, article_text, nlp):
+    """
+    Deserializes the parsed sentences of an article.
+
+    :param data: bytes
+        The serialized sentences, as returned by serialize_sentence_docs.
+    :param article_text: string
+        The article in XML format stored as a string.
+    :param nlp: spaCy.Language
+        The language model used to parse the article.
+    :return: list(spaCy.Doc)
+        A Doc object for each sentence in the article, or None if the text of the article or the language model changed
+        since it was parsed.
+    """
+    data = srsly.msgpack_loads(bytes(data))
+    if data['text_hash'] != text_hash(article_text) or data['model_version'] != model_version(nlp):
+        return None
+    return [Doc(nlp.vocab).from_bytes(doc_bytes) for doc_bytes in data['docs']]
+
+
+def load_sentence_docs(article, nlp):
+    """
+    Loads the parsed sentences of an article from its `parsed` column. The article is only parsed if the column doesn't
+    contain its current parse, in which case the column is filled.
+
+    :param article: models.Article
+        The article for which to load the sentences.
+    :param nlp: spaCy.Language
+        The language model used to parse the article.
+    :return: list(spaCy.Doc)
+        A Doc object for each sentence in the article.
+    """
+    if article.parsed is not None:
+        sentence_docs = deserialize_sentence_docs(article.parsed, article.text, nlp)
+        if sentence_docs is not None:
+            return sentence_docs
+
+    sentence_docs = extract_sentence_spans(article.text, nlp)
+    article.parsed = serialize_sentence_docs(article.text, sentence_docs, nlp)
+    article.save(update_fields=['parsed'])
+    return sentence_docs
@@ -9,6 +9,10 @@ from backend.xml_parsing.named_entity_linking import extract_person_mentions
 QUOTES = ["«", "»", "“", "”", "„", "‹", "›", "‟", "〝", "〞"]
 
 
+""" The default number of paragraphs processed at once by the language model when parsing many articles. """
+DEFAULT_BATCH_SIZE = 100
+
+
 def normalize_quotes(text, default_quote='"', quotes=None):
     """
     Normalizes all quote chars in a text by a default quote char.
@@ -79,21 +83,14 @@ def extract_people(doc, start_index):
     return people
 
 
-def process_article(article_text, nlp):
+def parse_article_xml(article_text):
     """
-    Processes an article stored as an XML file, and returns all the information necessary
-    to store the article in the database.
+    Parses an article stored as an XML file, and extracts its title and the text of each of its paragraphs.
 
     :param article_text: string.
         The article in XML format stored as a string
-    :param nlp: spaCy.Language
-        The language model used to tokenize the text
-    :return: dictionary. (list(spaCy.Tokens), list(int), list(int), list((int, int)), list(int))
-        'tokens': list(spaCy.Tokens). A list of all the tokens in the article
-        'p': list(int). A list of the indices of sentences that are the last sentence of a paragraph.
-        's': list(int). A list of the indices of tokens that are the last token of a sentence.
-        'people': list(tuple). The first and last token of all Person Named Entities in the article.
-        'in_quotes': list(int). For each token, 1 if it's in between quotes, 0 if it's note.
+    :return: string, list(string).
+        The title of the article and the text of each paragraph in it.
     """
     root = ET.fromstring(article_text)
     # Tries to extract the article title
@@ -104,8 +101,24 @@ def process_article(article_text, nlp):
         article_name = 'No article title'
 
     # Extracts the article as a list of paragraphs
-    paragraphs = extract_paragraphs(root)
-    paragraphs = [nlp(p) for p in paragraphs]
+    return article_name, extract_paragraphs(root)
+
+
+def process_paragraphs(article_name, paragraphs):
+    """
+    Given the paragraphs of an article, already processed by the language model, computes all the information
+    necessary to store the article in the database.
+
+    :param article_name: string.
+        The title of the article.
+    :param paragraphs: list(spaCy.Doc).
+        The doc representation of each paragraph in the article.
+    :return: dictionary.
+        The same dictionary as process_article.
+    """
+    # The Doc for each sentence is created before the named entities are corrected, so that it's identical to the one
+    # created by extract_sentence_spans.
+    sentence_docs = extract_sentence_docs(paragraphs)
 
     # The full text as a list of tokens
     article_tokens = []
@@ -146,12 +159,74 @@ def process_article(article_text, nlp):
         'people': people,
         'mentions': mentions_found,
         'in_quotes': in_quotes,
+        'sentence_docs': sentence_docs,
     }
 
 
+def process_article(article_text, nlp):
+    """
+    Processes an article stored as an XML file, and returns all the information necessary
+    to store the article in the database.
+
+    :param article_text: string.
+        The article in XML format stored as a string
+    :param nlp: spaCy.Language
+        The language model used to tokenize the text
+    :return: dictionary. (list(spaCy.Tokens), list(int), list(int), list((int, int)), list(int), list(spaCy.Doc))
+        'tokens': list(spaCy.Tokens). A list of all the tokens in the article
+        'p': list(int). A list of the indices of sentences that are the last sentence of a paragraph.
+        's': list(int). A list of the indices of tokens that are the last token of a sentence.
+        'people': list(tuple). The first and last token of all Person Named Entities in the article.
+        'in_quotes': list(int). For each token, 1 if it's in between quotes, 0 if it's note.
+        'sentence_docs': list(spaCy.Doc). A Doc object for each sentence in the article, identical to the ones
+            returned by extract_sentence_spans, so that the article doesn't need to be parsed a second time.
+    """
+    article_name, paragraphs = parse_article_xml(article_text)
+    return process_paragraphs(article_name, [nlp(p) for p in paragraphs])
+
+
+def process_articles(article_texts, nlp, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Processes many articles stored as XML files. The paragraphs of all articles are streamed through the language model
+    together, which is much faster than processing each article separately.
+
+    :param article_texts: list(string).
+        The articles in XML format stored as strings
+    :param nlp: spaCy.Language
+        The language model used to tokenize the text
+    :param batch_size: int.
+        The number of paragraphs the language model processes at once.
+    :return: list(dictionary).
+        For each article, in the same order as article_texts, the dictionary returned by process_paragraphs.
+    """
+    parsed_articles = [parse_article_xml(article_text) for article_text in article_texts]
+    all_paragraphs = [p for _, paragraphs in parsed_articles for p in paragraphs]
+    paragraph_docs = nlp.pipe(all_paragraphs, batch_size=batch_size)
+
+    processed = []
+    for article_name, paragraphs in parsed_articles:
+        article_docs = [next(paragraph_docs) for _ in paragraphs]
+        processed.append(process_paragraphs(article_name, article_docs))
+    return processed
+
+
+def extract_sentence_docs(paragraphs):
+    """
+    Computes a Doc object for each sentence in the paragraphs of an article.
+
+    :param paragraphs: list(spaCy.Doc).
+        The doc representation of each paragraph in the article.
+    :return: list(spaCy.Doc)
+        A Doc object for each sentence in the article.
+    """
+    return [sent.as_doc() for p in paragraphs for sent in p.sents]
+
+
 def extract_sentence_spans(article_text, nlp):
     """
-    Given the xml string for an article, computes a Span object for each sentence in the article.
+    Given the xml string for an article, computes a Span object for each sentence in the article. If the rest of the
+    information about the article is also needed, use the 'sentence_docs' returned by process_article instead of
+    parsing the article twice.
 
     :param article_text: string.
         The article in XML format stored as a string
@@ -160,8 +235,5 @@ def extract_sentence_spans(article_text, nlp):
     :return: list(spaCy.Doc)
         A Doc object for each sentence in the article.
     """
-    root = ET.fromstring(article_text)
-    # Extracts the article as a list of paragraphs
-    paragraphs = [nlp(p) for p in extract_paragraphs(root)]
-    sentences = [sent.as_doc() for p in paragraphs for sent in p.sents]
-    return sentences
+    _, paragraphs = parse_article_xml(article_text)
+    return extract_sentence_docs([nlp(p) for p in paragraphs])